@@ -59,6 +59,7 @@ setup(
     ],
     packages=find_packages(exclude=['tests', 'tests.*']),
     install_requires=['Fabric>=1.10.2', 'six', 'xmltodict>=0.9.2', ],
+    extras_require={'async': ['asyncssh']},
     dependency_links=[
         'git+https://github.com/akaariai/fabric.git@py34#egg=Fabric-1.10.2',
     ],
@@ -20,5 +20,25 @@ from project_factory import *
 from system_factory import *
 from django_pm import *
 from post_update_hooks import *
+from command_batch import *
+from rollout import *
+from parallel import *
+from daemon import *
+from vcs import *
+from changes import *
+from virtual_env import *
+from wheelhouse import *
+from db import *
+from retention import *
+from profiler import *
+from benchmark import *
+from connection import *
+from agent import *
+from aio import *
+from artifact import *
+from snapshot import *
+from reconcile import *
+from release import *
+from migration_planner import *
 
 __author__ = 'y.gavenchuk'
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from http.client import HTTPConnection
+from unittest import TestCase
+from unittest import mock
+
+from test_tools import FixtureManager
+
+from web_deploy.agent import Agent, Job, JobQueue, make_server
+from web_deploy.base import DeployError
+
+
+__author__ = 'y.gavenchuk'
+__all__ = ('JobQueueTestCase', 'AgentTestCase', )
+
+
+def _run_job(worker, job):
+    if job.tag == 'broken':
+        raise RuntimeError('Deploy failed')
+    if job.tag == 'crash':
+        os._exit(1)
+    if job.tag == 'slow':
+        time.sleep(10)
+    if job.tag == 'spawn':
+        # pid of child is written to file named by environment of job
+        child = subprocess.Popen(['sleep', '30'])
+        with open(job.environment, 'w') as f:
+            f.write(str(child.pid))
+        time.sleep(10)
+
+    return ['%s: ok' % job.tag]
+
+
+class JobQueueTestCase(TestCase):
+    def test_queued_job_should_be_superseded_by_newer_tag(self):
+        queue = JobQueue()
+        old = queue.submit(Job('shop', 'v1'))
+        new = queue.submit(Job('shop', 'v2'))
+
+        self.assertEqual(old.status, Job.SUPERSEDED)
+        self.assertEqual(old.superseded_by, new.id)
+        self.assertEqual(len(queue), 1)
+        self.assertIs(queue.take(0), new)
+
+    def test_duplicate_job_should_not_be_queued(self):
+        queue = JobQueue()
+        job = queue.submit(Job('shop', 'v1'))
+        self.assertIs(queue.submit(Job('shop', 'v1')), job)
+        self.assertIsNot(queue.submit(Job('shop', 'v1', force=True)), job)
+
+    def test_duplicate_of_running_job_should_not_be_queued(self):
+        queue = JobQueue()
+        job = queue.submit(Job('shop', 'v1'))
+        queue.take(0)
+        self.assertIs(queue.submit(Job('shop', 'v1')), job)
+        self.assertEqual(len(queue), 0)
+
+    def test_jobs_of_the_same_project_should_not_run_simultaneously(self):
+        queue = JobQueue()
+        first = queue.submit(Job('shop', 'v1'))
+        queue.submit(Job('blog', 'v1'))
+        self.assertIs(queue.take(0), first)
+        second = queue.submit(Job('shop', 'v2'))
+
+        self.assertEqual(queue.take(0).project, 'blog')
+        self.assertIsNone(queue.take(0))
+
+        queue.done(first)
+        self.assertEqual(first.status, Job.SUCCEEDED)
+        self.assertIs(queue.take(0), second)
+
+    def test_jobs_of_common_hosts_should_not_run_simultaneously(self):
+        queue = JobQueue()
+        web1 = queue.submit(Job('shop', 'v1', hosts=['web1']))
+        web2 = queue.submit(Job('shop', 'v1', hosts=['web2']))
+        self.assertIs(queue.take(0), web1)
+        self.assertIs(queue.take(0), web2)
+
+        everywhere = queue.submit(Job('shop', 'v2'))
+        again = queue.submit(Job('shop', 'v3', hosts=['web3']))
+        self.assertIsNone(queue.take(0))
+
+        queue.done(web1)
+        queue.done(web2)
+        self.assertIs(queue.take(0), everywhere)
+        self.assertIsNone(queue.take(0))
+        queue.done(everywhere)
+        self.assertIs(queue.take(0), again)
+
+    def test_old_finished_jobs_should_be_forgotten(self):
+        queue = JobQueue(history=1)
+        jobs = [queue.submit(Job('shop', 'v%d' % i)) for i in range(3)]
+        self.assertEqual([j.id for j in queue.jobs()],
+                         [jobs[2].id, jobs[1].id])
+
+
+class AgentTestCase(TestCase):
+    _config = FixtureManager.get_fixture_path('config.xml')
+
+    def _request(self, server, method, path, data=None):
+        conn = HTTPConnection(*server.server_address)
+        body = json.dumps(data) if data is not None else None
+        conn.request(method, path, body)
+        response = conn.getresponse()
+        result = response.status, json.loads(response.read().decode('utf-8'))
+        conn.close()
+        return result
+
+    def _wait(self, agent, job_id, timeout=10):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            job = agent.queue.job(job_id)
+            if job.status in Job.FINISHED:
+                return job
+            time.sleep(0.05)
+
+        self.fail('Job #%d is not finished' % job_id)
+
+    def test_api_should_queue_jobs(self):
+        agent = Agent(self._config, workers=1)
+        server = make_server(agent, '127.0.0.1:0')
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            status, job = self._request(server, 'POST', '/jobs', {
+                'project': 'shop', 'tag': 'v1', 'hosts': 'web1'
+            })
+            self.assertEqual(status, 202)
+            self.assertEqual(job['status'], Job.QUEUED)
+            self.assertEqual(job['hosts'], ['web1'])
+
+            self.assertEqual(
+                self._request(server, 'GET', '/jobs/%d' % job['id']),
+                (200, job)
+            )
+            status, jobs = self._request(server, 'GET', '/jobs')
+            self.assertEqual([j['id'] for j in jobs], [job['id']])
+            self.assertEqual(self._request(server, 'GET', '/jobs/0')[0], 404)
+            self.assertEqual(
+                self._request(server, 'GET', '/health')[1]['queued'], 1
+            )
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+    def test_workers_should_run_jobs(self):
+        agent = Agent(self._config, workers=2)
+        with mock.patch('web_deploy.agent._Worker.run', _run_job):
+            agent.start()
+            try:
+                ok = agent.submit(Job('shop', 'v1'))
+                broken = agent.submit(Job('blog', 'broken'))
+                ok = self._wait(agent, ok.id)
+                broken = self._wait(agent, broken.id)
+            finally:
+                agent.stop()
+
+        self.assertEqual(ok.status, Job.SUCCEEDED)
+        self.assertEqual(ok.output, ['v1: ok'])
+        self.assertEqual(broken.status, Job.FAILED)
+        self.assertEqual(broken.error, 'RuntimeError: Deploy failed')
+
+    def test_dead_and_timed_out_workers_should_be_replaced(self):
+        agent = Agent(self._config, workers=1, timeout=1)
+        with mock.patch('web_deploy.agent._Worker.run', _run_job):
+            agent.start()
+            try:
+                jobs = [
+                    self._wait(agent, agent.submit(Job('shop', tag)).id)
+                    for tag in ('crash', 'slow', 'v1')
+                ]
+            finally:
+                agent.stop()
+
+        crash, slow, ok = jobs
+        self.assertEqual(crash.status, Job.FAILED)
+        self.assertTrue(crash.error.startswith('WorkerError'))
+        self.assertEqual(slow.status, Job.FAILED)
+        self.assertTrue(slow.error.startswith('TimeoutError'))
+        self.assertEqual(ok.status, Job.SUCCEEDED)
+
+    def test_timed_out_job_should_kill_children_of_worker(self):
+        fd, pid_file = tempfile.mkstemp()
+        os.close(fd)
+        agent = Agent(self._config, workers=1, timeout=1)
+        with mock.patch('web_deploy.agent._Worker.run', _run_job):
+            agent.start()
+            try:
+                job = self._wait(agent, agent.submit(
+                    Job('shop', 'spawn', pid_file)
+                ).id)
+            finally:
+                agent.stop()
+
+        with open(pid_file) as f:
+            pid = int(f.read())
+        os.unlink(pid_file)
+
+        self.assertTrue(job.error.startswith('TimeoutError'))
+        # the child is killed (it's a zombie until init reaps it)
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            try:
+                with open('/proc/%d/stat' % pid) as f:
+                    alive = f.read().split(')')[-1].split()[0] != 'Z'
+            except FileNotFoundError:
+                alive = False
+            if not alive:
+                break
+            time.sleep(0.05)
+
+        self.assertFalse(alive)
+
+    def test_job_without_hosts_should_be_rejected_if_config_has_none(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        config = os.path.join(tmp_dir, 'config.xml')
+        with open(self._config) as src, open(config, 'w') as dst:
+            xml = src.read()
+            dst.write(xml[:xml.index('<hosts')] +
+                      xml[xml.index('</hosts>') + len('</hosts>'):])
+
+        for config_file, code in ((self._config, 202), (config, 400)):
+            server = make_server(Agent(config_file, workers=1),
+                                 '127.0.0.1:0')
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+            try:
+                status, _ = self._request(server, 'POST', '/jobs',
+                                          {'tag': 'v1'})
+                self.assertEqual(status, code)
+                status, _ = self._request(server, 'POST', '/jobs',
+                                          {'tag': 'v1', 'hosts': ['web1']})
+                self.assertEqual(status, 202)
+            finally:
+                server.shutdown()
+                server.server_close()
+                thread.join()
+
+    def test_unix_socket_should_not_replace_other_file(self):
+        with tempfile.NamedTemporaryFile() as f:
+            self.assertRaises(DeployError, make_server, None, f.name)
+            self.assertTrue(os.path.exists(f.name))
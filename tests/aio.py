@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from web_deploy.aio import AsyncTransport, Engine, LocalTransport, Result, \
+    Session
+from web_deploy.base import DeployError
+from web_deploy.daemon import Daemon, Nginx, Supervisor, Uwsgi
+from web_deploy.python import VirtualEnv
+from web_deploy.system import AsyncFileSystemAPI, System
+from web_deploy.vcs import Git
+
+
+__author__ = 'y.gavenchuk'
+__all__ = ('AioTestCase', )
+
+
+class _FakeTransport(AsyncTransport):
+    """
+    Records commands of all hosts, each command takes 10ms
+    """
+    commands = []
+
+    def __init__(self, host):
+        self._host = host
+
+    async def execute(self, command, sudo=False):
+        self.commands.append((self._host, command, sudo))
+        await asyncio.sleep(0.01)
+        return Result('', return_code=1 if command.startswith('test') else 0)
+
+    async def put(self, local_path, remote_path):
+        pass
+
+    async def get(self, remote_path, local_path):
+        pass
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+class AioTestCase(TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        _FakeTransport.commands = []
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_session_should_compose_context_of_command(self):
+        session = Session('localhost', LocalTransport())
+        with session.cd(self._dir), session.prefix('export X=1'):
+            output = _run(session.run('pwd && echo $X'))
+
+        self.assertEqual(output.splitlines(), [self._dir, '1'])
+
+    def test_failed_command_should_raise_error(self):
+        session = Session('localhost', LocalTransport())
+        self.assertRaises(DeployError, _run, session.run('exit 3'))
+        self.assertEqual(
+            _run(session.run('exit 3', warn_only=True)).return_code, 3
+        )
+
+    def test_async_fs_should_batch_commands(self):
+        session = Session('localhost', LocalTransport())
+        fs = AsyncFileSystemAPI(session)
+        app_dir = os.path.join(self._dir, 'www')
+
+        async def create():
+            with fs.batch():
+                await fs.mkdir(app_dir + '1')
+                await fs.mk_symlink(System._symlink_item(app_dir + '1',
+                                                         app_dir))
+            await fs.flush()
+            return await fs.readlink(app_dir)
+
+        self.assertEqual(_run(create()), app_dir + '1')
+
+    def test_engine_should_update_hosts_concurrently(self):
+        git = Git('/srv/www/www1/data', 'prj', 'git@example.com:prj.git')
+        hosts = ['web%d' % i for i in range(20)]
+        results = Engine(_FakeTransport).run(
+            hosts, lambda session: git.update_async(session, 'v1')
+        )
+
+        self.assertEqual([r.name for r in results], hosts)
+        self.assertFalse([r for r in results if r.failed])
+        self.assertEqual(len(_FakeTransport.commands), 20 * 6)
+        # hosts are updated simultaneously: 6 commands of 10ms each
+        self.assertLess(max(r.finished for r in results) -
+                        min(r.started for r in results), 1)
+
+    def test_blocking_code_should_use_session_of_its_host(self):
+        venv = VirtualEnv('/srv/www/www1', '.env')
+        Engine(_FakeTransport).run(
+            ['web1', 'web2'],
+            lambda session: session.call(venv.run, 'pip --version')
+        )
+
+        self.assertEqual(sorted(_FakeTransport.commands), [
+            (host, 'source "/srv/www/www1/.env/bin/activate" && '
+                   'pip --version', False)
+            for host in ('web1', 'web2')
+        ])
+
+    def test_concurrent_restart_should_respect_order_of_daemons(self):
+        system = System([], '/srv/www/www', [], daemons=[
+            Uwsgi(after=['supervisor']), Nginx(), Supervisor()
+        ], concurrent_restart=True)
+        session = Session('web1', _FakeTransport('web1'))
+        _run(system.restart_daemons_async(session))
+
+        commands = [c for _, c, _ in _FakeTransport.commands]
+        self.assertEqual(len(commands), 4)
+        self.assertLess(commands.index('supervisorctl restart all'),
+                        commands.index('service uwsgi restart'))
+
+    def test_daemon_declared_before_its_dependency_should_wait_for_it(self):
+        system = System([], '/srv/www/www', [], daemons=[
+            Nginx(after=['uwsgi']), Uwsgi(after=['supervisor']), Supervisor()
+        ], concurrent_restart=True)
+        session = Session('web1', _FakeTransport('web1'))
+        _run(system.restart_daemons_async(session))
+
+        self.assertEqual([c for _, c, _ in _FakeTransport.commands], [
+            'supervisorctl reread', 'supervisorctl restart all',
+            'service uwsgi restart', 'service nginx restart',
+        ])
+
+    def test_unknown_or_cyclic_dependency_of_daemon_should_be_rejected(self):
+        session = Session('web1', _FakeTransport('web1'))
+        for daemons in ([Uwsgi(after=['celery']), Nginx()],
+                        [Uwsgi(after=['nginx']), Nginx(after=['uwsgi'])]):
+            system = System([], '/srv/www/www', [], daemons=daemons,
+                            concurrent_restart=True)
+            self.assertRaises(DeployError, _run,
+                              system.restart_daemons_async(session))
+
+        self.assertEqual(_FakeTransport.commands, [])
+
+    def test_blocking_restart_of_daemon_should_use_session(self):
+        class Celery(Daemon):
+            _name = 'celery'
+
+            def restart(self):
+                self._api.sudo('systemctl restart celery')
+
+        results = Engine(_FakeTransport).run(
+            ['web1', 'web2'], lambda session: Celery().apply_async(session)
+        )
+
+        self.assertFalse([r for r in results if r.failed])
+        self.assertEqual(sorted(_FakeTransport.commands), [
+            (host, 'systemctl restart celery', True)
+            for host in ('web1', 'web2')
+        ])
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import subprocess
+import tempfile
+from unittest import TestCase
+from unittest import mock
+
+from fabric.api import hide, settings
+
+from web_deploy.artifact import ArtifactBuilder, TreeArtifact
+from web_deploy.project import ProjectModule
+from web_deploy.transport import LocalFabricTransport, RecordingTransport, \
+    SimulatedTransport, using
+from web_deploy.vcs import Git
+
+
+__author__ = 'y.gavenchuk'
+__all__ = ('ArtifactTestCase', )
+
+
+class _Module(ProjectModule):
+    BUILD_HOOKS = ('puh_build', )
+
+    def __init__(self, *args, **kwargs):
+        super(_Module, self).__init__(*args, **kwargs)
+        self.add_hook(self.puh_build, self.puh_migrate)
+
+    def puh_build(self):
+        self._api.run('echo built > "%s/build.txt"' % self.path)
+
+    def puh_migrate(self):
+        pass
+
+
+class ArtifactTestCase(TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        repo = os.path.join(self._dir, 'origin')
+        os.makedirs(repo)
+        with open(os.path.join(repo, 'app.py'), 'w') as fp:
+            fp.write('print(1)\n')
+
+        subprocess.check_output(
+            'git init -q && git add app.py && git -c user.name=t '
+            '-c user.email=t@t commit -qm init && git tag v1',
+            shell=True, cwd=repo
+        )
+        self._module = _Module('', Git('', 'app', repo, depth=1))
+        # the same as Project does before update
+        self._module.path = os.path.join(self._dir, 'prj', 'www1')
+        self._builder = ArtifactBuilder(
+            build_dir=os.path.join(self._dir, 'build'),
+            cache_dir=os.path.join(self._dir, 'cache')
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_artifact_should_be_reproducible(self):
+        with settings(hide('everything')):
+            first = self._builder.build(self._module, 'v1')
+            second = self._builder.build(self._module, 'v1')
+
+        self.assertEqual(first.digest, second.digest)
+        self.assertTrue(os.path.isfile(first.path))
+        self.assertEqual(self._module.path,
+                         os.path.join(self._dir, 'prj', 'www1', 'data'))
+
+    def test_artifact_should_replace_module_content(self):
+        with settings(hide('everything')):
+            artifact = self._builder.build(self._module, 'v1')
+            with using(LocalFabricTransport()):
+                artifact.install(self._module)
+
+        path = self._module.path
+        self.assertTrue(os.path.isfile(os.path.join(path, 'app', 'app.py')))
+        self.assertTrue(os.path.isfile(os.path.join(path, 'build.txt')))
+        self.assertFalse(os.path.exists(os.path.join(path, 'app', '.git')))
+        self.assertTrue(os.path.isfile(os.path.join(
+            self._dir, 'prj', '.web-deploy', 'artifacts', artifact.name
+        )))
+
+    def test_update_should_skip_git_and_build_hooks(self):
+        artifact = mock.MagicMock()
+        self._module.artifact = artifact
+        with mock.patch.object(Git, 'update') as update, \
+                mock.patch.object(_Module, '_api') as m_api:
+            self._module.update('v1')
+
+        artifact.install.assert_called_once_with(self._module)
+        self.assertFalse(update.called)
+        self.assertFalse(m_api.run.called)
+
+    def test_tree_should_be_synced_by_rsync(self):
+        builder = ArtifactBuilder(
+            build_dir=os.path.join(self._dir, 'build'), mode='rsync'
+        )
+        with settings(hide('everything')):
+            artifact = builder.build(self._module, 'v1')
+
+        self.assertIsInstance(artifact, TreeArtifact)
+        self.assertTrue(os.path.isfile(
+            os.path.join(artifact.built_path, 'build.txt')
+        ))
+
+        # the third slot is updated, the second one is active
+        self._module.path = os.path.join(self._dir, 'prj', 'www3')
+        active = os.path.join(self._dir, 'prj', 'www2', 'data')
+        recorder = RecordingTransport(SimulatedTransport(
+            paths=[active],
+            responses=[('^readlink', os.path.join(self._dir, 'prj', 'www2'))]
+        ))
+        with using(recorder), settings(host_string='deploy@web1:2222'):
+            artifact.install(self._module)
+
+        command = [r['target'] for r in recorder.records
+                   if r['kind'] == 'local'][0]
+        self.assertIn('--link-dest=%s' % active, command)
+        self.assertIn('--exclude=/app/.git', command)
+        self.assertIn('-e "ssh -p 2222"', command)
+        self.assertTrue(command.endswith(
+            'deploy@web1:%s/' % self._module.path
+        ))
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    Benchmark of the whole deploy against simulated remote host. The number
+    of round trips is the main cost of deploy over high latency links, so
+    it's kept within budget. Run this module as a script to see the report.
+"""
+
+import json
+import re
+import sys
+from unittest import TestCase
+
+from test_tools import FixtureManager
+
+from web_deploy.base import DeployEntity, FabricSession, run_sync
+from web_deploy.factory import ProjectFactory
+from web_deploy.transport import SimulatedTransport, RecordingTransport, \
+    using
+
+
+__author__ = 'y.gavenchuk'
+__all__ = ('DeployBenchmarkTestCase', )
+
+
+class DeployBenchmarkTestCase(TestCase):
+    _cfg = FixtureManager.get_fixture_path('config.xml')
+
+    LATENCY = 0.05
+    # raise it only together with the change which really needs more trips
+    ROUND_TRIPS_BUDGET = 34
+    # answer to snapshot of host state: project tree is created and app
+    # directory points to the first slot, nothing else is deployed yet
+    SNAPSHOT = '\n'.join(
+        ['__wd_stat__\twww/web-deploy\t1\tsymbolic link\troot\troot\t'
+         '777\t/srv/www/web-deploy/www1'] +
+        ['__wd_stat__\t%s\t1\tdirectory\twww-data\twww-data\t755\t' % p
+         for p in (
+             '/srv/www/web-deploy/public_files',
+             '/srv/www/web-deploy/dumps',
+             '/srv/www/web-deploy/www1/data',
+             '/srv/www/web-deploy/www2/data',
+         )] +
+        ['__wd_stat__\t%s\t-' % p for p in (
+            '/var/log/web-deploy',
+            '/var/log/web-deploy/celery',
+            '/var/log/web-deploy/web-deploy.log',
+            '/var/log/web-deploy/celery/out.log',
+            '/srv/www/web-deploy/www2/data/web-deploy',
+            '/srv/www/web-deploy/www2/data/.virtualenv/bin/python',
+        )]
+    )
+
+    @classmethod
+    def simulate(cls, tag='v1', update=None):
+        """
+        :param callable|None update: project => None. Default is sync update
+        :return SimulatedTransport: transport used by deploy
+        """
+        sim = SimulatedTransport(
+            latency=cls.LATENCY,
+            responses=[
+                ('__wd_stat__', cls.SNAPSHOT),
+                ('readlink', '/srv/www/web-deploy/www1'),
+            ]
+        )
+        with using(sim):
+            project = ProjectFactory(cls._cfg).get()
+            if update is None:
+                project.update(tag)
+            else:
+                update(project)
+
+        return sim
+
+    def test_deploy_should_fit_round_trips_budget(self):
+        sim = self.simulate()
+
+        self.assertLessEqual(sim.round_trips, self.ROUND_TRIPS_BUDGET)
+        self.assertAlmostEqual(sim.elapsed, sim.round_trips * self.LATENCY)
+
+    def test_async_update_should_send_the_same_commands(self):
+        def update_async(project):
+            session = FabricSession(DeployEntity._api, DeployEntity._files)
+            run_sync(project.update_async(session, 'v1'))
+
+        def plan(sim):
+            # names of dumps contain time. Checks of modules are sent by
+            # session of async update, snapshot doesn't serve them
+            return [re.sub(r'dump_sql_[\d_]+', 'dump_sql_', c)
+                    for c in sim.commands if not c.startswith('test -e ')]
+
+        self.assertEqual(plan(self.simulate(update=update_async)),
+                         plan(self.simulate()))
+
+    def test_transport_should_be_restored(self):
+        api = DeployEntity._api
+        self.simulate()
+
+        self.assertIs(DeployEntity._api, api)
+
+    def test_recording_transport_should_keep_context_of_commands(self):
+        sim = SimulatedTransport(latency=0)
+        recorder = RecordingTransport(sim)
+        with using(recorder):
+            with DeployEntity._cm.shell_env(PGPASSWORD='secret'), \
+                    DeployEntity._api.cd('/srv/www'):
+                DeployEntity._api.run('ls')
+            DeployEntity._files.exists('/srv/www')
+
+        self.assertEqual(
+            [(r['kind'], r['target']) for r in recorder.records],
+            [
+                ('run', 'export PGPASSWORD="secret" && cd /srv/www && ls'),
+                ('exists', '/srv/www'),
+            ]
+        )
+        self.assertEqual(sim.commands[0], recorder.records[0]['target'])
+
+
+if __name__ == '__main__':
+    report = DeployBenchmarkTestCase.simulate().report()
+    report['budget'] = DeployBenchmarkTestCase.ROUND_TRIPS_BUDGET
+    json.dump(report, sys.stdout, indent=2)
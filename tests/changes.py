@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+from unittest import mock
+
+from web_deploy.changes import ChangeDetector, watch
+from web_deploy.project import ProjectModule
+
+
+__author__ = 'y.gavenchuk'
+__all__ = ('ChangeDetectorTestCase', )
+
+
+class ChangeDetectorTestCase(TestCase):
+    _target_api = 'web_deploy.changes.ChangeDetector._api'
+
+    def _module(self, calls):
+        @watch(lambda m: ['requirements.txt'])
+        def puh_python():
+            calls.append('puh_python')
+
+        git = mock.MagicMock()
+        git.name = 'prj'
+        pm = ProjectModule('/srv/www', git)
+        pm.path = '/srv/www/prj/www1'
+        pm.add_hook(puh_python)
+
+        return pm
+
+    def test_collect_should_parse_digests_and_state(self):
+        m_api = mock.MagicMock(**{'run.return_value': (
+            'digest puh_python 123\r\n'
+            'digest puh_system 456\r\n'
+            'state puh_python 123\r\n'
+        )})
+        with mock.patch(self._target_api, m_api):
+            detector = ChangeDetector('/srv', '/srv/.web-deploy')
+            digests, state = detector.collect({
+                'puh_python': ['req.txt'],
+                'puh_system': ['apt.txt'],
+            })
+
+        self.assertEqual(m_api.run.call_count, 1)
+        self.assertEqual(digests, {'puh_python': '123', 'puh_system': '456'})
+        self.assertEqual(state, {'puh_python': '123'})
+
+    def test_hook_with_unchanged_inputs_should_be_skipped(self):
+        calls = []
+        m_api = mock.MagicMock(**{'run.return_value': (
+            'digest puh_python 123\nstate puh_python 123\n'
+        )})
+        with mock.patch(self._target_api, m_api):
+            self._module(calls).post_update_hndl()
+
+        self.assertEqual(calls, [])
+
+    def test_changed_hook_should_run_and_record_digest(self):
+        calls = []
+        m_api = mock.MagicMock(**{'run.return_value': (
+            'digest puh_python 123\nstate puh_python 122\n'
+        )})
+        with mock.patch(self._target_api, m_api):
+            self._module(calls).post_update_hndl()
+
+        self.assertEqual(calls, ['puh_python'])
+        m_api.run.assert_called_with(
+            'mkdir -p -- "/srv/www/prj/www1/data/.web-deploy" && '
+            'echo "123" > "/srv/www/prj/www1/data/.web-deploy/puh_python"'
+        )
+
+    def test_force_should_run_unchanged_hook(self):
+        calls = []
+        m_api = mock.MagicMock(**{'run.return_value': (
+            'digest puh_python 123\nstate puh_python 123\n'
+        )})
+        with mock.patch(self._target_api, m_api):
+            self._module(calls).post_update_hndl(force=True)
+
+        self.assertEqual(calls, ['puh_python'])
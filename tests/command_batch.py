@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+from unittest import mock
+
+from web_deploy.base import DeployError
+from web_deploy.batch import CommandBatch
+from web_deploy.system import FileSystemAPI, FileSystemEntity
+
+
+__author__ = 'y.gavenchuk'
+__all__ = ('CommandBatchTestCase', )
+
+
+class CommandBatchTestCase(TestCase):
+    def test_batch_should_run_one_script_per_privilege_level(self):
+        api = mock.MagicMock()
+        batch = CommandBatch(api)
+        batch.add('mkdir -p -- "/a"')
+        batch.add('mkdir -p -- "/b"')
+        batch.add('chown a:b -- "/a"', sudo=True)
+        batch.add('chmod 755 -- "/a"', sudo=True)
+        batch.flush()
+
+        self.assertEqual(api.run.call_count, 1)
+        self.assertEqual(api.sudo.call_count, 1)
+        self.assertEqual(len(batch), 0)
+
+    def test_batch_should_report_exit_status_of_each_command(self):
+        api = mock.MagicMock(**{
+            'run.return_value': '__wd_exit__:0:0\r\n__wd_exit__:1:0\r\n'
+        })
+        batch = CommandBatch(api)
+        batch.add('touch -- "/a"')
+        batch.add('touch -- "/b"')
+        results = batch.flush()
+
+        self.assertEqual([r.status for r in results], [0, 0])
+
+    def test_failed_command_should_raise_error(self):
+        api = mock.MagicMock(**{
+            'run.return_value': '__wd_exit__:0:0\n__wd_exit__:1:1\n'
+        })
+        batch = CommandBatch(api)
+        batch.add('touch -- "/a"')
+        batch.add('touch -- "/root/b"')
+        batch.add('touch -- "/c"')
+
+        with self.assertRaises(DeployError):
+            batch.flush()
+
+        self.assertEqual([r.status for r in batch.results], [0, 1, None])
+
+    def test_forced_symlink_should_not_flush_batch(self):
+        api = mock.MagicMock()
+        files = mock.MagicMock()
+        with mock.patch.object(FileSystemAPI, '_api', api), \
+                mock.patch.object(FileSystemAPI, '_files', files):
+            fs = FileSystemAPI()
+            with fs.batch() as batch:
+                fs.mkdir('/a')
+                fs.mk_symlink(FileSystemEntity(
+                    '/a', target='/b', type_=FileSystemEntity.TYPE_SYMLINK
+                ), force=True)
+                self.assertEqual(len(batch), 2)
+                self.assertFalse(api.run.called)
+
+        self.assertFalse(files.exists.called)
+        self.assertIn('ln -sfT -- "/a" "/b"', api.run.call_args[0][0])
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+from unittest import mock
+
+from fabric import state
+from test_tools import FixtureManager
+
+from web_deploy.base import DeployEntity
+from web_deploy.connection import ConnectionManager, ManagedTransport
+from web_deploy.daemon import Daemon
+from web_deploy.factory import ConnectionFactory
+from web_deploy.settings import SettingsXML
+
+
+__author__ = 'y.gavenchuk'
+__all__ = ('ConnectionManagerTestCase', )
+
+
+class ConnectionManagerTestCase(TestCase):
+    _cfg = SettingsXML(
+        FixtureManager.get_fixture_path('config.xml')
+    ).data['project']
+
+    def test_factory_should_read_connection_section(self):
+        manager = ConnectionFactory().get(self._cfg)
+
+        self.assertEqual(manager.max_sessions, 4)
+
+    def test_manager_should_be_installed_for_all_entities(self):
+        api = DeployEntity._api
+        manager = ConnectionManager(keepalive=15, sudo_password='secret')
+        with mock.patch('web_deploy.connection.disconnect_all') as m_disc, \
+                mock.patch.dict(state.env, {'host_string': 'web1:22',
+                                            'sudo_passwords': {}}):
+            with manager:
+                self.assertIsInstance(DeployEntity._api, ManagedTransport)
+                self.assertIs(Daemon._api, DeployEntity._api)
+                self.assertEqual(state.env.keepalive, 15)
+                self.assertEqual(
+                    list(state.env.sudo_passwords.values()), ['secret']
+                )
+
+        self.assertIs(DeployEntity._api, api)
+        self.assertTrue(m_disc.called)
+
+    def test_dropped_connection_should_be_reopened(self):
+        client = mock.MagicMock()
+        client.get_transport.return_value.is_active.return_value = False
+        connections = mock.MagicMock(**{'get.return_value': client})
+        manager = ConnectionManager(max_sessions=1)
+        with mock.patch.object(state, 'connections', connections), \
+                mock.patch.dict(state.env, {'host_string': 'web1'}):
+            with manager.session():
+                pass
+
+            with manager.session():
+                pass
+
+        self.assertEqual(connections.connect.call_count, 2)
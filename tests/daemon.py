@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+from unittest import mock
+
+from web_deploy.base import DeployError
+from web_deploy.daemon import Daemon, Nginx, Uwsgi, Probe, TcpProbe, \
+    HttpProbe, UnixSocketProbe
+from web_deploy.factory import DaemonFactory
+
+
+__author__ = 'y.gavenchuk'
+__all__ = ('DaemonTestCase', )
+
+
+class DaemonTestCase(TestCase):
+    def test_probe_should_be_created_from_uri(self):
+        self.assertIsInstance(Probe.from_uri('tcp://127.0.0.1:80'), TcpProbe)
+        self.assertIsInstance(Probe.from_uri('http://127.0.0.1/'), HttpProbe)
+        self.assertIsInstance(
+            Probe.from_uri('unix:///run/uwsgi.sock'), UnixSocketProbe
+        )
+        self.assertRaises(DeployError, Probe.from_uri, 'ftp://127.0.0.1')
+
+    def test_factory_should_pass_daemon_options(self):
+        uwsgi = DaemonFactory().get({
+            'text': 'Uwsgi',
+            'graceful': '1',
+            'master_fifo': '/run/uwsgi/fifo',
+            'after': 'nginx, supervisor',
+        })
+
+        self.assertEqual(uwsgi.after, ['nginx', 'supervisor'])
+        with mock.patch.object(Uwsgi, '_api') as m_api:
+            uwsgi.apply()
+
+        m_api.sudo.assert_called_once_with('echo c > "/run/uwsgi/fifo"')
+
+    def test_apply_should_wait_for_readiness(self):
+        nginx = Nginx(graceful=True, probe='tcp://127.0.0.1:80',
+                      probe_timeout=5)
+        m_api = mock.MagicMock(**{'run.return_value.failed': False})
+        with mock.patch.object(Nginx, '_api', m_api):
+            nginx.apply()
+
+        m_api.sudo.assert_called_once_with('nginx -t && nginx -s reload')
+        m_api.run.assert_called_once_with(
+            "timeout 5 bash -c 'until (echo > /dev/tcp/127.0.0.1/80) "
+            "2>/dev/null; do sleep 1; done'",
+            warn_only=True
+        )
+
+    def test_not_ready_daemon_should_raise_error(self):
+        nginx = Nginx(probe='http://127.0.0.1/')
+        m_api = mock.MagicMock(**{'run.return_value.failed': True})
+        with mock.patch.object(Nginx, '_api', m_api):
+            self.assertRaises(DeployError, nginx.apply)
+
+    def test_daemon_with_blocking_restart_only_should_be_applied(self):
+        class Celery(Daemon):
+            _name = 'celery'
+
+            def restart(self):
+                self._api.sudo('systemctl restart celery')
+
+        m_api = mock.MagicMock()
+        with mock.patch.object(Celery, '_api', m_api):
+            Celery().apply()
+            Celery(graceful=True).apply()
+
+        self.assertEqual(m_api.sudo.call_args_list,
+                         [mock.call('systemctl restart celery')] * 2)
+
+    def test_daemon_without_restart_should_not_be_created(self):
+        class Celery(Daemon):
+            _name = 'celery'
+
+        self.assertRaises(TypeError, Celery)
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+from unittest import mock
+
+from web_deploy.base import DeployError
+from web_deploy.db import Postgres
+from web_deploy.factory import DbFactory
+
+
+__author__ = 'y.gavenchuk'
+__all__ = ('PostgresTestCase', )
+
+
+class PostgresTestCase(TestCase):
+    _cfg = {
+        'type': 'Postgres',
+        'path': '/srv/www/dumps',
+        'name': 'web-deploy-db',
+        'user': 'web-deploy-user',
+        'password': 'secret',
+    }
+
+    def _get_db(self, **kwargs):
+        cfg = self._cfg.copy()
+        cfg.update(kwargs)
+        return DbFactory().get(cfg)
+
+    def test_plain_backup_should_be_streamed_to_compressor(self):
+        cmd = self._get_db(compressor='zstd', level='3')._job_cmd()
+
+        self.assertRegex(
+            cmd,
+            r'pg_dump --clean -h localhost -U web-deploy-user web-deploy-db '
+            r'\|zstd -q -T0 -3 \| tee "dump_sql_[\d_]+_db\.sq\.zst" \| '
+            r'sha1sum > "dump_sql_[\d_]+_db\.sq\.zst\.sha1" && '
+        )
+
+    def test_directory_backup_should_use_parallel_jobs(self):
+        cmd = self._get_db(format='directory', jobs='8', port='5433',
+                           compressor='pigz')._job_cmd()
+
+        self.assertIn(
+            'pg_dump --clean -Fd -Z 6 -j 8 -h localhost -U web-deploy-user '
+            '-p 5433 -f "dump_sql_', cmd
+        )
+        # tables are compressed by pg_dump, directory is removed anyway
+        self.assertRegex(
+            cmd, r'\. \| tee "dump_sql_[\d_]+_db\.tar" .*; \}; '
+                 r'_wd_rc=\$\?; rm -rf "dump_sql_[\d_]+_db\.tar\.d"'
+        )
+        self.assertNotIn('pigz', cmd)
+
+    def test_directory_backup_should_be_compressed_by_pg_dump(self):
+        cmd = self._get_db(format='directory', compressor='zstd',
+                           level='3')._job_cmd()
+        self.assertIn('pg_dump --clean -Fd -Z zstd:3 -h localhost', cmd)
+
+    def test_backup_of_tables_should_be_partial(self):
+        cmd = self._get_db()._job_cmd(['shop_order', 'shop_item'])
+
+        self.assertRegex(
+            cmd,
+            r'pg_dump --clean -h localhost -U web-deploy-user '
+            r'-t \'"shop_order"\' -t \'"shop_item"\' web-deploy-db '
+            r'\|gzip \| tee "dump_sql_[\d_]+_tables\.sq\.gz"'
+        )
+
+    def test_async_backup_should_be_joined_instead_of_new_one(self):
+        database = self._get_db(async_backup='1')
+        m_api = mock.MagicMock(**{'run.return_value': 'backup-status 0'})
+        with mock.patch.object(Postgres, '_api', m_api), \
+                mock.patch.object(Postgres, '_cm', mock.MagicMock()):
+            database.start_backup()
+            database.create_backup()
+
+        self.assertTrue(database.is_async)
+        calls = m_api.run.call_args_list
+        self.assertEqual(calls[0][1], {'pty': False})
+        self.assertIn('nohup setsid bash -c', calls[0][0][0])
+        self.assertNotIn('pg_dump', calls[1][0][0])
+        # join and rotation of backups (there is no manifest)
+        self.assertEqual(len(calls), 4)
+        self.assertEqual(calls[-1][0][0], 'ls "/srv/www/dumps"')
+
+    def test_failed_async_backup_should_stop_deploy(self):
+        database = self._get_db(async_backup='1')
+        m_api = mock.MagicMock(**{'run.return_value': 'backup-status 1'})
+        with mock.patch.object(Postgres, '_api', m_api):
+            self.assertRaises(DeployError, database.join_backup)
+
+    def test_rotation_should_use_manifest(self):
+        database = self._get_db(retention={'keep_last': '2'})
+        manifest = '\n'.join(
+            'dump_%d.sq.gz %d 10 100 -' % (i, 1444000000 + i) for i in range(3)
+        )
+        m_api = mock.MagicMock(**{'run.return_value': manifest})
+        with mock.patch.object(Postgres, '_api', m_api):
+            database._rotate_backups()
+
+        calls = m_api.run.call_args_list
+        self.assertEqual(len(calls), 2)
+        self.assertTrue(calls[1][0][0].startswith(
+            'rm -f -- "dump_0.sq.gz" && printf "%s\\n" '
+            '"dump_1.sq.gz 1444000001 10 100 -" '
+            '"dump_2.sq.gz 1444000002 10 100 -" > .manifest.tmp'
+        ))
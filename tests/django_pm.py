@@ -1,10 +1,19 @@
 # -*- coding: utf-8 -*-
+import base64
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
 from unittest import TestCase
 from unittest import mock
 
 from test_tools import FixtureManager
 
+from web_deploy.factory import StaticCollectorFactory
 from web_deploy.python import DjangoProjectModule
+from web_deploy.static import _PREPARE
 from web_deploy.system import FileSystemAPI
 from web_deploy.settings import SettingsXML
 
@@ -13,6 +22,18 @@ __author__ = 'y.gavenchuk'
 __all__ = ('DjangoPrjModuleTestCase', )
 
 
+class _Storage(object):
+    def __init__(self, location=None):
+        self._location = location
+
+    def path(self, name):
+        # remote storages of django have no local paths
+        if self._location is None:
+            raise NotImplementedError()
+
+        return os.path.join(self._location, name)
+
+
 class DjangoPrjModuleTestCase(TestCase):
     _cfg = SettingsXML(
         FixtureManager.get_fixture_path('config.xml')
@@ -48,3 +69,96 @@ class DjangoPrjModuleTestCase(TestCase):
                 )
             ]
         )
+
+    def test_incremental_static_should_reuse_active_slot(self):
+        v_env = mock.MagicMock()
+        fs = mock.MagicMock(**{
+            'exists.return_value': True,
+            'join_path.side_effect': lambda *p: '/'.join(p),
+        })
+        dj_m = DjangoProjectModule(
+            path='/srv/prj/www2',
+            git=mock.MagicMock(),
+            virtual_env=v_env,
+            system=mock.MagicMock(fs=fs, app_directory_active='/srv/prj/www1'),
+            python_rq_file='req.txt',
+            apt_rq_file='apt.txt',
+            db=mock.MagicMock(),
+            manage_py='app/manage.py',
+            container_name='data',
+            static_collector=StaticCollectorFactory().get({
+                'text': '1', 'incremental': '1'
+            })
+        )
+        dj_m.path = '/srv/prj/www2'
+        dj_m.puh_collect_static()
+
+        command = v_env.run.call_args[0][0]
+        scripts = [
+            base64.b64decode(s).decode('utf-8')
+            for s in re.findall(r"b64decode\('([^']+)'\)", command)
+        ]
+
+        self.assertEqual(v_env.run.call_count, 1)
+        self.assertIn('"/srv/prj/www2/data/app/manage.py" collectstatic',
+                      command)
+        self.assertEqual(len(scripts), 2)
+        self.assertIn("'active_static': '/srv/prj/www1/data/static'",
+                      scripts[0])
+        self.assertIn("'active_manifest': "
+                      "'/srv/prj/www1/data/.web-deploy/static.manifest'",
+                      scripts[0])
+        self.assertIn("'compress': True", scripts[1])
+
+    def _prepare_static(self, local_source=True, local_static=True):
+        """
+        Runs preparation of incremental static with finder of one file
+
+        :param bool local_source: storage of finder has local paths
+        :param bool local_static: STATICFILES_STORAGE has local paths
+        :return dict: manifest of release
+        """
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        with open(os.path.join(tmp_dir, 'app.js'), 'w') as f:
+            f.write('alert(1);')
+
+        static = os.path.join(tmp_dir, 'static')
+        storage = _Storage(tmp_dir if local_source else None)
+        finder = mock.MagicMock(**{
+            'list.return_value': [('app.js', storage)]
+        })
+        modules = {
+            'django': mock.MagicMock(),
+            'django.contrib': mock.MagicMock(),
+            'django.contrib.staticfiles': mock.MagicMock(),
+            'django.contrib.staticfiles.finders': mock.MagicMock(
+                get_finders=lambda: [finder]
+            ),
+            'django.contrib.staticfiles.storage': mock.MagicMock(
+                staticfiles_storage=_Storage(static if local_static else None)
+            ),
+        }
+        manifest = os.path.join(tmp_dir, 'manifest')
+        args = dict(static=static, manifest=manifest,
+                    active_static=os.path.join(tmp_dir, 'active'),
+                    active_manifest=os.path.join(tmp_dir, 'none'),
+                    suffixes=['.gz'])
+        with mock.patch.dict(sys.modules, modules), \
+                mock.patch('sys.stdout'):
+            exec(_PREPARE, {'args': args})
+
+        with open(manifest + '.new') as f:
+            return json.load(f)
+
+    def test_static_of_storage_with_paths_should_be_incremental(self):
+        manifest = self._prepare_static()
+
+        self.assertEqual(list(manifest['files']), ['app.js'])
+        self.assertEqual(manifest['changed'], ['app.js'])
+
+    def test_static_of_storage_without_paths_should_be_collected(self):
+        for options in ({'local_source': False}, {'local_static': False}):
+            manifest = self._prepare_static(**options)
+
+            self.assertEqual(manifest, {'files': {}, 'changed': []})
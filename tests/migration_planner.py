@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+from unittest import mock
+
+from web_deploy.factory import MigrationPlannerFactory
+from web_deploy.migrations import Migration
+from web_deploy.python import DjangoProjectModule
+
+
+__author__ = 'y.gavenchuk'
+__all__ = ('MigrationPlannerTestCase', )
+
+
+class MigrationPlannerTestCase(TestCase):
+    _plan = '[X]  contenttypes.0001_initial\n' \
+            '[X]  shop.0001_initial\n' \
+            '[ ]  shop.0002_order_note\n' \
+            '[ ]  blog.0001_initial\n'
+
+    _sql = 'BEGIN;\n' \
+           '--\n' \
+           '-- Add field note to order\n' \
+           '--\n' \
+           'ALTER TABLE "shop_order" ADD COLUMN "note" text NULL;\n' \
+           'CREATE TABLE "blog_post" ("id" serial NOT NULL PRIMARY KEY);\n' \
+           'CREATE INDEX "blog_post_x" ON "blog_post" ("id");\n' \
+           'COMMIT;\n'
+
+    def _module(self, planner, output):
+        v_env = mock.MagicMock(**{'output.side_effect': output})
+        database = mock.MagicMock(is_async=False)
+        module = DjangoProjectModule(
+            path='/srv/prj/www2', git=mock.MagicMock(), virtual_env=v_env,
+            system=mock.MagicMock(), python_rq_file='req.txt',
+            apt_rq_file='apt.txt', db=database, manage_py='manage.py',
+            migration_planner=MigrationPlannerFactory().get(planner)
+        )
+        return module, v_env, database
+
+    def test_plan_should_contain_pending_migrations_only(self):
+        planner = MigrationPlannerFactory().get('1')
+
+        self.assertEqual(
+            planner.parse_plan(self._plan),
+            [Migration('shop', '0002_order_note'),
+             Migration('blog', '0001_initial')]
+        )
+
+    def test_tables_should_be_changed_existing_ones(self):
+        planner = MigrationPlannerFactory().get({
+            'text': '1', 'backup': 'tables'
+        })
+
+        self.assertEqual(planner.parse_tables(self._sql), ['shop_order'])
+        self.assertIsNone(planner.parse_tables(
+            self._sql + '-- MIGRATION NOW PERFORMS OPERATION THAT CANNOT BE '
+                        'WRITTEN AS SQL:\n-- Raw Python operation\n'
+        ))
+        self.assertIsNone(planner.parse_tables('VACUUM;\n'))
+
+    def test_backup_and_migrate_should_be_skipped_without_pending(self):
+        module, v_env, database = self._module('1', lambda cmd: '[X]  a.1')
+        module.puh_db_backup()
+        module.puh_migrate()
+
+        self.assertEqual(v_env.output.call_count, 2)
+        self.assertFalse(database.create_backup.called)
+        self.assertFalse(v_env.run.called)
+
+    def test_backup_should_dump_tables_of_pending_migrations(self):
+        outputs = {'showmigrations': self._plan, 'sqlmigrate': self._sql}
+        module, v_env, database = self._module(
+            {'text': '1', 'backup': 'tables'},
+            lambda cmd: next(v for k, v in outputs.items() if k in cmd)
+        )
+        module.puh_db_backup()
+
+        self.assertRegex(
+            v_env.output.call_args[0][0],
+            r'sqlmigrate shop 0002_order_note && .* sqlmigrate blog '
+            r'0001_initial$'
+        )
+        database.create_backup.assert_called_once_with(['shop_order'])
+        self.assertEqual(module._after(module.puh_db_backup),
+                         ('puh_python', ))
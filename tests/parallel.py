@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import time
+from unittest import TestCase
+
+from web_deploy.parallel import Task, TaskRunner, _ProcessPool
+
+
+__author__ = 'y.gavenchuk'
+__all__ = ('TaskRunnerTestCase', )
+
+
+def _fail():
+    raise RuntimeError('failed')
+
+
+class TaskRunnerTestCase(TestCase):
+    def test_task_should_wait_for_its_dependencies(self):
+        done = []
+
+        def step(name, delay=0.0):
+            time.sleep(delay)
+            done.append(name)
+
+        runner = TaskRunner(pool=TaskRunner.POOL_THREAD)
+        runner.run([
+            Task('b', step, 'b', depends=['a']),
+            Task('a', step, 'a', 0.05),
+            Task('c', step, 'c'),
+        ])
+
+        self.assertEqual(done, ['c', 'a', 'b'])
+
+    def test_failed_dependency_should_fail_dependent_task(self):
+        runner = TaskRunner()
+        results = runner.run([
+            Task('a', _fail),
+            Task('b', time.time, depends=['a']),
+            Task('c', time.time),
+        ])
+
+        self.assertEqual([r.failed for r in results], [True, True, False])
+        self.assertIsNone(results[1].started)
+
+    def test_crashed_worker_should_fail_its_task_only(self):
+        results = TaskRunner().run([
+            Task('a', os._exit, 3),
+            Task('b', time.sleep, 0.3),
+        ] + [Task('c%d' % i, time.time) for i in range(10)])
+
+        self.assertEqual(results[0].error, 'Worker exited with code 3')
+        self.assertFalse([r for r in results[1:] if r.failed])
+
+    def test_result_of_reaped_task_should_be_dropped(self):
+        pool = _ProcessPool(2)
+        pool.start(Task('a', time.time))
+        pool.start(Task('b', time.sleep, 0.2))
+        # "a" is reported as failed one, its late result is ignored
+        pool._running.pop('a').join()
+
+        results = pool.wait()
+        pool.close()
+
+        self.assertEqual([r.name for r in results], ['b'])
+        self.assertFalse(results[0].failed)
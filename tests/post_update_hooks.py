@@ -28,11 +28,10 @@ class PostUpdateHookTestCase(TestCase):
         ))
         factory = ProjectModuleFactory()
         factory._git = mock.MagicMock()
-        factory._sys = mock.MagicMock()
         factory._venv = mock.MagicMock()
         factory._db = mock.MagicMock()
 
-        dj_m = factory.get(config)[0]
+        dj_m = factory.get(config, mock.MagicMock())[0]
         return dj_m._post_update_hooks[-1]
 
     def test_create_symlink_hook(self):
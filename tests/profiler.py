@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+from unittest import TestCase
+from unittest import mock
+
+from web_deploy.base import DeployEntity
+from web_deploy.parallel import Task, TaskRunner
+from web_deploy.profiler import Profiler, phase, profiled, current
+
+
+__author__ = 'y.gavenchuk'
+__all__ = ('ProfilerTestCase', )
+
+
+def _remote_step(command):
+    return DeployEntity._api.run(command)
+
+
+class ProfilerTestCase(TestCase):
+    def setUp(self):
+        m_api = mock.MagicMock(**{'run.return_value': 'ok'})
+        patcher = mock.patch.object(DeployEntity, '_api', m_api)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_commands_should_be_attributed_to_running_phases(self):
+        with Profiler() as prof:
+            with phase('update'):
+                with phase('git'):
+                    _remote_step('git fetch')
+                _remote_step('ls')
+
+        self.assertIsNone(current())
+        self.assertIsInstance(DeployEntity._api, mock.MagicMock)
+
+        totals = {t['phase']: t for t in prof.totals()}
+        self.assertEqual(totals['update/git']['commands'], 1)
+        self.assertEqual(totals['update/git']['bytes'], len('git fetch') + 2)
+        self.assertEqual(totals['update']['commands'], 2)
+        self.assertEqual(totals['update']['host'], 'localhost')
+
+    def test_phase_should_cost_nothing_without_profiler(self):
+        with phase('update'):
+            self.assertEqual(_remote_step('ls'), 'ok')
+
+    def test_records_of_forked_workers_should_be_merged(self):
+        with Profiler() as prof:
+            with phase('update_modules'):
+                results = TaskRunner().run([
+                    Task('a', profiled, 'module:a', _remote_step, 'a'),
+                    Task('b', profiled, 'module:b', _remote_step, 'b'),
+                ])
+
+        self.assertFalse([r for r in results if r.failed])
+        report = json.loads(prof.to_json())
+        totals = {t['phase']: t for t in report['totals']}
+        self.assertEqual(totals['update_modules']['commands'], 2)
+        self.assertEqual(totals['update_modules/module:a']['commands'], 1)
+        self.assertIn('update_modules/module:b', prof.summary())
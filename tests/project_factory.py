@@ -15,15 +15,18 @@
 # limitations under the License.
 
 from unittest import TestCase
+from unittest import mock
 
 from test_tools import FixtureManager
 
+from web_deploy.base import DeployError
 from web_deploy.factory import ProjectFactory
 from web_deploy.project import Project
+from web_deploy.settings import SettingsXML
 
 
 __author__ = 'y.gavenchuk'
-__all__ = ('AppTestCase', )
+__all__ = ('AppTestCase', 'MultiProjectTestCase', )
 
 
 class AppTestCase(TestCase):
@@ -32,3 +35,53 @@ class AppTestCase(TestCase):
     def test_project_factory_should_return_project_instance(self):
         pf = ProjectFactory(self._cfg).get()
         self.assertIsInstance(pf, Project)
+
+
+class MultiProjectTestCase(TestCase):
+    _cfg = FixtureManager.get_fixture_path('projects.xml')
+
+    def test_project_should_inherit_defaults_and_parent(self):
+        cfg = ProjectFactory(self._cfg, 'shop').config
+
+        self.assertEqual(cfg['system']['app_dir'], 'www/shop')
+        self.assertEqual(cfg['system']['project_tree']['item'],
+                         '/srv/www/shared')
+        self.assertEqual(cfg['modules']['module']['git']['url'],
+                         'git@example.com:app.git')
+        self.assertNotIn('environment', cfg)
+        self.assertNotIn('hosts', cfg)
+
+    def test_environment_should_override_project(self):
+        production = ProjectFactory(self._cfg, 'shop', 'production').config
+        staging = ProjectFactory(self._cfg, 'shop', 'staging').config
+
+        self.assertEqual(len(production['hosts']['host']), 2)
+        self.assertEqual(staging['connection'], {'max_sessions': '2'})
+        self.assertRaises(DeployError, ProjectFactory(
+            self._cfg, 'blog', 'production'
+        ).get)
+
+    def test_only_selected_project_should_be_built(self):
+        settings = SettingsXML(self._cfg)
+        self.assertEqual(settings.projects, ['blog', 'shop'])
+        self.assertRaises(DeployError, settings.project)
+
+        factory = ProjectFactory(self._cfg, 'blog')
+        with mock.patch.object(factory._p_mod, 'get_djangoprojectmodule',
+                               wraps=factory._p_mod.get_djangoprojectmodule
+                               ) as m_get:
+            factory.get()
+
+        self.assertEqual(m_get.call_count, 1)
+        self.assertEqual(m_get.call_args[0][0]['git']['name'], 'app')
+
+    def test_modules_with_equal_config_should_not_share_git_and_venv(self):
+        shop = ProjectFactory(self._cfg, 'shop').get().modules[0]
+        blog = ProjectFactory(self._cfg, 'blog').get().modules[0]
+        shop.path = '/srv/www/shop/www1'
+        blog.path = '/srv/www/blog/www1'
+
+        self.assertIsNot(shop.git, blog.git)
+        self.assertIsNot(shop._v_env, blog._v_env)
+        self.assertEqual(shop.git.path, shop.path)
+        self.assertEqual(shop._v_env.path, shop.path)
@@ -15,7 +15,8 @@
 # limitations under the License.
 
 from unittest import TestCase, mock
-from web_deploy.project import ProjectModule
+from web_deploy.base import DeployError
+from web_deploy.project import Project, ProjectModule, run_after
 
 
 __author__ = 'y.gavenchuk'
@@ -32,3 +33,103 @@ class ProjectModuleTestCase(TestCase):
         pm.path = path_after
 
         self.assertEqual(pm.path, "%s/%s" % (path_after, pm.container))
+
+    def test_update_tasks_should_chain_git_and_hooks(self):
+        git = mock.MagicMock()
+        git.name = 'core'
+
+        def puh_migrate():
+            pass
+
+        pm = ProjectModule('/a/b/c', git)
+        pm.add_hook(puh_migrate, lambda: None)
+        tasks = pm.update_tasks('v1', depends=['api.puh_migrate'])
+
+        self.assertEqual(
+            [(t.name, t.depends) for t in tasks],
+            [
+                ('core.git', ()),
+                ('core.puh_migrate', ('core.git', 'api.puh_migrate')),
+                ('core.hook1', ('core.puh_migrate', )),
+            ]
+        )
+
+    def test_update_tasks_should_run_independent_hooks_concurrently(self):
+        git = mock.MagicMock()
+        git.name = 'core'
+
+        @run_after()
+        def puh_python():
+            pass
+
+        @run_after()
+        def puh_db_backup():
+            pass
+
+        @run_after('puh_python', 'puh_db_backup')
+        def puh_migrate():
+            pass
+
+        @run_after('puh_python')
+        def puh_collect_static():
+            pass
+
+        pm = ProjectModule('/a/b/c', git)
+        pm.add_hook(puh_python, puh_db_backup, puh_migrate,
+                    puh_collect_static)
+        tasks = pm.update_tasks('v1')
+
+        self.assertEqual(
+            [(t.name, t.depends) for t in tasks],
+            [
+                ('core.git', ()),
+                ('core.puh_python', ('core.git', )),
+                ('core.puh_db_backup', ('core.git', )),
+                ('core.puh_migrate', ('core.puh_python',
+                                      'core.puh_db_backup')),
+                ('core.puh_collect_static', ('core.puh_python', )),
+                ('core.hooks', ('core.puh_migrate',
+                                'core.puh_collect_static')),
+            ]
+        )
+
+    def _modules(self, *names):
+        modules = []
+        for name in names:
+            git = mock.MagicMock()
+            git.name = name
+            pm = ProjectModule('/a/b/c', git)
+            pm.add_hook(lambda: None)
+            modules.append(pm)
+
+        return modules
+
+    def test_tasks_of_module_should_be_built_once(self):
+        core, api = self._modules('core', 'api')
+        # declared before the module it depends on
+        api.add_dependency('core')
+        project = Project(mock.MagicMock(), [api, core], concurrent=True)
+        with mock.patch.object(ProjectModule, 'update_tasks',
+                               autospec=True,
+                               side_effect=ProjectModule.update_tasks) as m:
+            tasks, modules = project._module_tasks('v1')
+
+        self.assertEqual(m.call_count, 2)
+        self.assertEqual(
+            [(t.name, t.depends) for t in tasks],
+            [
+                ('api.git', ()),
+                ('api.hook0', ('api.git', 'core.hook0')),
+                ('core.git', ()),
+                ('core.hook0', ('core.git', )),
+            ]
+        )
+        self.assertEqual(modules['core.hook0'], 'core')
+
+    def test_modules_depending_on_each_other_should_be_rejected(self):
+        core, api = self._modules('core', 'api')
+        api.add_dependency('core')
+        core.add_dependency('api')
+        project = Project(mock.MagicMock(), [api, core], concurrent=True)
+
+        self.assertRaises(DeployError, project._module_tasks, 'v1')
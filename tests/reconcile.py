@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+
+from web_deploy.base import DeployError
+from web_deploy.reconcile import DesiredState, Reconciler
+from web_deploy.system import FileSystemAPI, FileSystemEntity
+from web_deploy.transport import SimulatedTransport, using
+
+
+__author__ = 'y.gavenchuk'
+__all__ = ('ReconcilerTestCase', )
+
+
+class ReconcilerTestCase(TestCase):
+    DESIRED = [
+        DesiredState('/srv/prj/www1', FileSystemEntity.TYPE_DIRECTORY),
+        DesiredState('/var/log/prj', FileSystemEntity.TYPE_DIRECTORY,
+                     owner='www-data', group='www-data', mode='755',
+                     sudo=True),
+        DesiredState('/var/log/prj/app.log', FileSystemEntity.TYPE_FILE,
+                     owner='www-data', group='www-data', mode='0644',
+                     sudo=True),
+        DesiredState('/srv/prj/www', FileSystemEntity.TYPE_SYMLINK,
+                     target='/srv/prj/www1'),
+    ]
+
+    @staticmethod
+    def _state(*lines):
+        return '\n'.join('__wd_stat__\t%s' % '\t'.join(l) for l in lines)
+
+    def _apply(self, state, dry_run=False):
+        sim = SimulatedTransport(latency=0,
+                                 responses=[('__wd_stat__', state)])
+        with using(sim):
+            changes = Reconciler(FileSystemAPI()).apply(self.DESIRED,
+                                                        dry_run)
+
+        return sim, changes
+
+    def test_steady_state_should_not_be_changed(self):
+        sim, changes = self._apply(self._state(
+            ('/srv/prj/www1', '1', 'directory', 'me', 'me', '700', ''),
+            ('/var/log/prj', '1', 'directory', 'www-data', 'www-data',
+             '755', ''),
+            ('/var/log/prj/app.log', '1', 'regular file', 'www-data',
+             'www-data', '644', ''),
+            ('/srv/prj/www', '1', 'symbolic link', 'root', 'root', '777',
+             '/srv/prj/www2'),
+        ))
+
+        self.assertEqual(changes, [])
+        self.assertEqual(sim.round_trips, 1)
+
+    def test_only_differences_should_be_applied(self):
+        state = self._state(
+            ('/srv/prj/www1', '-'),
+            ('/var/log/prj', '1', 'directory', 'www-data', 'www-data',
+             '755', ''),
+            ('/var/log/prj/app.log', '1', 'regular empty file', 'root',
+             'www-data', '600', ''),
+            ('/srv/prj/www', '-'),
+        )
+        sim, changes = self._apply(state, dry_run=True)
+        self.assertEqual(sim.round_trips, 1)
+        self.assertEqual(
+            [(c.action, c.path) for c in changes],
+            [
+                ('create', '/srv/prj/www1'),
+                ('owner', '/var/log/prj/app.log'),
+                ('mode', '/var/log/prj/app.log'),
+                ('link', '/srv/prj/www'),
+            ]
+        )
+
+        sim, changes = self._apply(state)
+        # collection of state and scripts of user, root and user again
+        self.assertEqual(sim.round_trips, 4)
+        self.assertIn('chown www-data:www-data -- "/var/log/prj/app.log"',
+                      sim.commands[2])
+        self.assertIn('ln -sT -- "/srv/prj/www1" "/srv/prj/www"',
+                      sim.commands[3])
+
+    def test_wrong_type_should_fail(self):
+        state = self._state(
+            ('/var/log/prj', '1', 'regular file', 'root', 'root', '644', ''),
+        )
+        with self.assertRaises(DeployError):
+            self._apply(state)
+
+    def test_existing_create_only_path_should_not_be_changed(self):
+        desired = [
+            DesiredState('/var/log/prj', FileSystemEntity.TYPE_DIRECTORY,
+                         owner='www-data', group='www-data', mode='755',
+                         sudo=True, create_only=True),
+            DesiredState('/var/log/prj/app.log', FileSystemEntity.TYPE_FILE,
+                         owner='www-data', group='www-data', mode='0644',
+                         sudo=True, create_only=True),
+        ]
+        state = self._state(
+            ('/var/log/prj', '1', 'directory', 'root', 'adm', '750', ''),
+            ('/var/log/prj/app.log', '-'),
+        )
+        sim = SimulatedTransport(latency=0,
+                                 responses=[('__wd_stat__', state)])
+        with using(sim):
+            changes = Reconciler(FileSystemAPI()).apply(desired, True)
+
+        self.assertEqual([(c.action, c.path) for c in changes], [
+            ('create', '/var/log/prj/app.log'),
+            ('mode', '/var/log/prj/app.log'),
+            ('owner', '/var/log/prj/app.log'),
+        ])
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+
+from web_deploy.base import DeployError
+from web_deploy.release import ReleaseSlots
+from web_deploy.transport import SimulatedTransport, using
+
+
+__author__ = 'y.gavenchuk'
+__all__ = ('ReleaseSlotsTestCase', )
+
+
+class ReleaseSlotsTestCase(TestCase):
+    # www1 is active, www2 is the previous release, www3 is the oldest one
+    STATUS = '\n'.join([
+        '/srv/prj/www1\t1500000300 v3',
+        '/srv/prj/www2\t1500000200 v2',
+        '/srv/prj/www3\t1500000100 v1',
+        '/srv/prj/www4\t',
+    ])
+
+    def setUp(self):
+        self._sim = SimulatedTransport(
+            latency=0, responses=[('\\.release', self.STATUS)]
+        )
+        self._slots = ReleaseSlots('/srv/prj/www', slots=4, keep=2)
+
+    def test_two_slots_should_not_ask_host(self):
+        slots = ReleaseSlots('/srv/prj/www')
+        with using(self._sim):
+            self.assertEqual(slots.inactive('/srv/prj/www2'),
+                             '/srv/prj/www1')
+
+        self.assertEqual(self._sim.round_trips, 0)
+
+    def test_empty_slot_should_be_used_first(self):
+        with using(self._sim):
+            self.assertEqual(self._slots.inactive('/srv/prj/www1'),
+                             '/srv/prj/www4')
+
+    def test_switch_should_rename_symlink(self):
+        cmd = self._slots.switch_cmd('/srv/prj/www2', 'v2')
+
+        self.assertTrue(cmd.startswith(
+            'echo "$(date +%s) v2" > "/srv/prj/www2/.release"'
+        ))
+        self.assertTrue(cmd.endswith(
+            'ln -sT -- "/srv/prj/www2" "/srv/prj/www.new" && '
+            'mv -fT -- "/srv/prj/www.new" "/srv/prj/www"'
+        ))
+
+    def test_rollback_should_activate_previous_release(self):
+        with using(self._sim):
+            release = self._slots.rollback('/srv/prj/www1')
+            self.assertEqual(release.tag, 'v2')
+            self.assertEqual(self._slots.rollback('/srv/prj/www1', 'v1').slot,
+                             '/srv/prj/www3')
+            with self.assertRaises(DeployError):
+                self._slots.rollback('/srv/prj/www1', 'v0')
+
+        # reading of releases and switch
+        self.assertEqual(self._sim.round_trips, 5)
+        self.assertIn('mv -fT', self._sim.commands[1])
+
+    def test_prune_should_keep_recent_releases(self):
+        with using(self._sim):
+            removed = self._slots.prune('/srv/prj/www1')
+
+        self.assertEqual([r.tag for r in removed], ['v1'])
+        # clone and virtualenv of slot are kept
+        self.assertEqual(self._sim.commands[-1],
+                         'rm -f -- "/srv/prj/www3/.release"')
+
+    def test_slots_should_have_multidigit_numbers(self):
+        status = '\n'.join([
+            '/srv/prj/www%d\t%d v%d' % (n, 1500000000 + n, n)
+            for n in range(1, 13)
+        ])
+        sim = SimulatedTransport(latency=0,
+                                 responses=[('\\.release', status)])
+        slots = ReleaseSlots('/srv/prj/www', slots=12)
+        with using(sim):
+            self.assertEqual(slots.inactive('/data/prj/www12'),
+                             '/data/prj/www1')
+            release = slots.rollback('/srv/prj/www12')
+            self.assertEqual(slots.rollback('/srv/prj/www1', '10').tag,
+                             'v10')
+
+        self.assertEqual(release.slot, '/srv/prj/www11')
+        self.assertEqual(slots.split('/srv/prj/www12'), ('/srv/prj/www', '12'))
+        self.assertIn('ln -sT -- "/srv/prj/www10"', sim.commands[-1])
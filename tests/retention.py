@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+
+from web_deploy.retention import Backup, RetentionPolicy, parse_size
+
+
+__author__ = 'y.gavenchuk'
+__all__ = ('RetentionPolicyTestCase', )
+
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+
+class RetentionPolicyTestCase(TestCase):
+    @staticmethod
+    def _names(backups):
+        return [b.name for b in backups]
+
+    def test_newest_backups_should_be_kept(self):
+        backups = [Backup('b%d' % i, i * HOUR) for i in range(5)]
+        keep, remove = RetentionPolicy(keep_last=2).select(backups)
+
+        self.assertEqual(self._names(keep), ['b4', 'b3'])
+        self.assertEqual(self._names(remove), ['b2', 'b1', 'b0'])
+
+    def test_one_backup_per_bucket_should_be_kept(self):
+        # two backups a day during 10 days
+        backups = [
+            Backup('b%02d' % i, i * DAY // 2) for i in range(20)
+        ]
+        keep, remove = RetentionPolicy(keep_last=1, daily=3,
+                                       weekly=2).select(backups)
+
+        self.assertEqual(self._names(keep), ['b19', 'b17', 'b15', 'b13'])
+        self.assertEqual(len(keep) + len(remove), len(backups))
+
+    def test_oldest_backups_should_be_removed_to_fit_quota(self):
+        backups = [Backup('b%d' % i, i, size=40) for i in range(5)]
+        keep, remove = RetentionPolicy(keep_last=5,
+                                       max_size='100').select(backups)
+
+        self.assertEqual(self._names(keep), ['b4', 'b3'])
+
+        # the newest one is never removed
+        keep, _ = RetentionPolicy(max_size=10).select(backups)
+        self.assertEqual(self._names(keep), ['b4'])
+
+    def test_partial_backups_should_not_rotate_full_one(self):
+        backups = [Backup('dump_0_db.sq.gz', 0, size=40)] + [
+            Backup('dump_%d_tables.sq.gz' % i, i, size=10)
+            for i in range(1, 6)
+        ]
+        keep, remove = RetentionPolicy(keep_last=2).select(backups)
+
+        self.assertEqual(self._names(keep), [
+            'dump_5_tables.sq.gz', 'dump_4_tables.sq.gz', 'dump_0_db.sq.gz'
+        ])
+        self.assertEqual(len(remove), 3)
+
+        # quota doesn't remove the newest full backup
+        keep, _ = RetentionPolicy(keep_last=5, max_size=60).select(backups)
+        self.assertEqual(self._names(keep), [
+            'dump_5_tables.sq.gz', 'dump_4_tables.sq.gz', 'dump_0_db.sq.gz'
+        ])
+
+    def test_manifest_line(self):
+        backup = Backup.from_line('dump.sq.gz 1444000000 30 1024 -')
+
+        self.assertEqual(backup.size, 1024)
+        self.assertIsNone(backup.checksum)
+        self.assertEqual(backup.to_line(), 'dump.sq.gz 1444000000 30 1024 -')
+        self.assertIsNone(Backup.from_line('garbage'))
+        self.assertEqual(parse_size('1.5G'), 3 << 29)
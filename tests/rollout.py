@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+
+from fabric.api import env
+from test_tools import FixtureManager
+
+from web_deploy.base import DeployError
+from web_deploy.factory import RolloutFactory
+from web_deploy.rollout import Rollout
+from web_deploy.settings import SettingsXML
+
+
+__author__ = 'y.gavenchuk'
+__all__ = ('RolloutTestCase', )
+
+
+def _host_string(*args):
+    if env.host_string == 'b':
+        raise DeployError('Deploy failed')
+
+    return env.host_string
+
+
+class RolloutTestCase(TestCase):
+    _cfg = SettingsXML(
+        FixtureManager.get_fixture_path('config.xml')
+    ).data['project']
+
+    def test_factory_should_read_hosts_from_config(self):
+        rollout = RolloutFactory().get(self._cfg)
+
+        self.assertEqual(
+            list(rollout.batches),
+            [['web1.example.com', 'web2.example.com'], ['web3.example.com']]
+        )
+
+    def test_each_host_should_be_handled_in_own_process(self):
+        rollout = Rollout(['a', 'c', 'd'], workers=2)
+        results = rollout.run(_host_string, 'tag')
+
+        self.assertEqual([r.value for r in results], ['a', 'c', 'd'])
+
+    def test_rollout_should_be_halted_if_max_failures_exceeded(self):
+        rollout = Rollout(['a', 'b', 'c', 'd'], batch_size=2, pool='thread',
+                          workers=1)
+        with self.assertRaises(DeployError):
+            rollout.run(_host_string)
+
+    def test_rollout_should_tolerate_allowed_failures(self):
+        rollout = Rollout(['a', 'b', 'c'], batch_size=1, max_failures=1,
+                          workers=1)
+        results = rollout.run(_host_string)
+
+        self.assertEqual([r.failed for r in results], [False, True, False])
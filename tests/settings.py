@@ -14,15 +14,20 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import shutil
+import tempfile
 from unittest import TestCase
+from unittest import mock
 
 from test_tools import FixtureManager
 
-from web_deploy.settings import SettingsXML
+from web_deploy.base import DeployError
+from web_deploy.settings import SettingsXML, SettingsCache
 
 
 __author__ = 'y.gavenchuk'
-__all__ = ('SettingsTestCase', )
+__all__ = ('SettingsTestCase', 'SettingsCacheTestCase', )
 
 
 class SettingsTestCase(TestCase):
@@ -34,3 +39,99 @@ class SettingsTestCase(TestCase):
 
     def test_parsed_data_should_non_empty(self):
         self.assertTrue(self._cfg.data)
+
+
+class SettingsCacheTestCase(TestCase):
+    _config_file = FixtureManager.get_fixture_path('config.xml')
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._dir)
+
+        self._cfg = os.path.join(self._dir, 'config.xml')
+        shutil.copy(self._config_file, self._cfg)
+
+        patcher = mock.patch.object(SettingsCache, '_memory', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _load(self):
+        cache = SettingsCache(os.path.join(self._dir, 'cache'))
+        with mock.patch.object(SettingsXML, 'compile',
+                               autospec=True,
+                               side_effect=SettingsXML.compile) as m_comp:
+            data = SettingsXML(self._cfg, cache).data
+
+        return data, m_comp.call_count
+
+    def test_config_should_be_compiled_once(self):
+        data, compiled = self._load()
+        self.assertEqual(compiled, 1)
+        self.assertEqual(data['project']['system']['app_dir'],
+                         'www/web-deploy')
+
+        # new process: memory cache is empty, disk cache is used
+        SettingsCache._memory.clear()
+        os.utime(self._cfg)
+        cached, compiled = self._load()
+        self.assertEqual(compiled, 0)
+        self.assertEqual(cached, data)
+
+        # data is own copy of caller
+        cached['project'].clear()
+        self.assertTrue(self._load()[0]['project'])
+
+    def test_changed_config_should_be_compiled_again(self):
+        self._load()
+        with open(self._cfg, 'a') as fp:
+            fp.write('\n')
+
+        self.assertEqual(self._load()[1], 1)
+
+    def test_memory_should_keep_one_entry_per_config(self):
+        self._load()
+        with open(self._cfg, 'a') as fp:
+            fp.write('\n')
+        self._load()
+
+        self.assertEqual(list(SettingsCache._memory), [self._cfg])
+
+    def test_cache_writable_by_others_should_be_ignored(self):
+        self._load()
+        SettingsCache._memory.clear()
+        cache_dir = os.path.join(self._dir, 'cache')
+        for name in os.listdir(cache_dir):
+            os.chmod(os.path.join(cache_dir, name), 0o666)
+
+        self.assertEqual(self._load()[1], 1)
+
+    def test_disk_cache_should_be_private(self):
+        cache_dir = os.path.join(self._dir, 'cache')
+        os.makedirs(cache_dir, mode=0o755)
+        os.chmod(cache_dir, 0o755)
+        self._load()
+
+        self.assertEqual(os.stat(cache_dir).st_mode & 0o777, 0o700)
+        for name in os.listdir(cache_dir):
+            mode = os.stat(os.path.join(cache_dir, name)).st_mode
+            self.assertEqual(mode & 0o777, 0o600)
+
+    def test_disk_cache_should_be_disabled_by_default(self):
+        with mock.patch.dict(os.environ, clear=True):
+            self.assertIsNone(SettingsCache.default()._dir)
+
+        cache_dir = os.path.join(self._dir, 'env-cache')
+        with mock.patch.dict(os.environ,
+                             {SettingsCache.DIR_VARIABLE: cache_dir}):
+            SettingsXML(self._cfg)
+
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+    def test_invalid_config_should_be_rejected(self):
+        with open(self._cfg, 'w') as fp:
+            fp.write('<WebDeploy><project><system><app_dir>www</app_dir>'
+                     '</system></project></WebDeploy>')
+
+        self.assertRaisesRegex(DeployError,
+                               '"WebDeploy/project/system/project_tree"',
+                               SettingsXML, self._cfg, SettingsCache(None))
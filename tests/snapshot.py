@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+from unittest import TestCase
+
+from fabric.api import env
+from fabric.context_managers import settings
+
+from web_deploy.base import DeployEntity
+from web_deploy.snapshot import HostSnapshot
+from web_deploy.transport import SimulatedTransport, installed, using
+
+
+__author__ = 'y.gavenchuk'
+__all__ = ('HostSnapshotTestCase', )
+
+
+class HostSnapshotTestCase(TestCase):
+    STATE = '\n'.join([
+        '__wd_stat__\t/srv/prj/www\t1\tsymbolic link\troot\troot\t777\t'
+        '/srv/prj/www1',
+        '__wd_stat__\t/srv/prj/www1/data\t1\tdirectory\twww\twww\t755\t',
+        '__wd_stat__\t/srv/prj/www2/data/repo\t-',
+        'garbage',
+    ])
+
+    def setUp(self):
+        self._sim = SimulatedTransport(
+            latency=0, responses=[('__wd_stat__', self.STATE)]
+        )
+        self._snapshot = HostSnapshot(self._sim, self._sim, self._sim)
+        self._snapshot.collect(['/srv/prj/www'], '/srv/prj/www', ['data'])
+
+    def test_collect_should_be_one_round_trip(self):
+        state = self._snapshot.state('/srv/prj/www1/data')
+
+        self.assertEqual(self._sim.round_trips, 1)
+        self.assertEqual(len(self._snapshot), 3)
+        self.assertEqual((state.type, state.owner, state.mode),
+                         ('directory', 'www', '755'))
+
+    def test_checks_should_be_served_from_memory(self):
+        snapshot = self._snapshot
+
+        self.assertTrue(snapshot.is_link('/srv/prj/www'))
+        self.assertTrue(snapshot.exists('/srv/prj/www1/data'))
+        self.assertFalse(snapshot.exists('/srv/prj/www2/data/repo'))
+        self.assertEqual(snapshot.run('readlink -- "/srv/prj/www"'),
+                         '/srv/prj/www1')
+        self.assertEqual(self._sim.round_trips, 1)
+        self.assertEqual(snapshot.hits, 4)
+
+        # unknown path
+        snapshot.exists('/srv/prj/www2/data')
+        self.assertEqual(self._sim.round_trips, 2)
+
+    def test_read_only_commands_should_keep_facts(self):
+        snapshot = self._snapshot
+        snapshot.run('test -e "/srv/prj/www1" && ls -la /srv/prj/www1 '
+                     '2>/dev/null')
+        snapshot.sudo('readlink -- "/srv/prj/www2" || echo "-"')
+        with snapshot.cd('/srv/prj/www2/data'):
+            snapshot.run('cat .release; stat -- repo')
+
+        self.assertEqual(len(snapshot), 3)
+
+    def test_other_commands_should_invalidate_everything(self):
+        commands = [
+            'mkdir -p -- "/srv/prj/www3"',
+            'git clone "origin" repo',
+            'echo 1 > /srv/prj/www1/data/flag',
+            'cat /srv/prj/www1/data/x | tee /tmp/x',
+            'ls $(rm -rf /srv/prj/www1)',
+        ]
+        for command in commands:
+            self.setUp()
+            self._snapshot.run(command)
+            self.assertEqual(len(self._snapshot), 0, command)
+
+        self.setUp()
+        with self._snapshot.prefix('source venv/bin/activate'):
+            self._snapshot.run('test -e "/srv/prj/www1"')
+        self.assertEqual(len(self._snapshot), 0)
+
+        self.setUp()
+        self._snapshot.local('rsync -a build/ web1:/srv/prj/www2/')
+        self.assertEqual(len(self._snapshot), 0)
+
+    def test_snapshot_should_serve_its_thread_and_host_only(self):
+        checks = []
+
+        def check():
+            checks.append(DeployEntity._files.exists('/srv/prj/www1/data'))
+
+        with using(self._sim):
+            before = installed()
+            with self._snapshot.activate():
+                self.assertIs(HostSnapshot.current(), self._snapshot)
+                check()
+                self.assertEqual(self._sim.round_trips, 1)
+
+                thread = threading.Thread(target=check)
+                thread.start()
+                thread.join()
+                with settings(host_string='%s-other' % env.host_string):
+                    self.assertIsNone(HostSnapshot.current())
+                    check()
+
+            self.assertEqual(installed(), before)
+
+        self.assertIsNone(HostSnapshot.current())
+        # checks of other thread and host are sent to the host
+        self.assertEqual(len(checks), 3)
+        self.assertEqual(self._sim.round_trips, 3)
+        self.assertEqual(self._snapshot.hits, 1)
@@ -14,18 +14,24 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import copy
+import threading
 from unittest import TestCase
 from unittest import mock
 
 from test_tools import FixtureManager
 
-from web_deploy.factory import SystemFactory
+from web_deploy.base import DeployError
+from web_deploy.factory import (
+    AbstractFactory, DaemonFactory, ObjectCache, ProjectModuleFactory,
+    SystemFactory
+)
 from web_deploy.system import System
 from web_deploy.settings import SettingsXML
 
 
 __author__ = 'y.gavenchuk'
-__all__ = ('SystemFactoryTestCase', )
+__all__ = ('SystemFactoryTestCase', 'ObjectCacheTestCase', )
 
 
 class SystemFactoryTestCase(TestCase):
@@ -37,20 +43,21 @@ class SystemFactoryTestCase(TestCase):
         sf = SystemFactory().get(self._cfg)
         self.assertIsInstance(sf, System)
 
-    def test_ensure_log_should_check_if_log_file_exists(self):
+    def test_ensure_log_should_collect_state_of_log_files(self):
         sys_files = mock.MagicMock()
+        sys_api = mock.MagicMock()
         target_files = 'web_deploy.system.FileSystemAPI._files'
         target_api = 'web_deploy.system.FileSystemAPI._api'
-        with mock.patch(target_files, sys_files), mock.patch(target_api):
+        with mock.patch(target_files, sys_files), \
+                mock.patch(target_api, sys_api):
             SystemFactory().get(self._cfg).ensure_log_files()
 
-        self.assertEqual(
-            sys_files.exists.call_args_list,
-            [
-                mock.call('/var/log/web-deploy/web-deploy.log'),
-                mock.call('/var/log/web-deploy/celery/out.log')
-            ]
-        )
+        # the only one remote query
+        self.assertFalse(sys_files.exists.called)
+        self.assertEqual(sys_api.run.call_count, 1)
+        script = sys_api.run.call_args[0][0]
+        self.assertIn('_wd_stat /var/log/web-deploy/web-deploy.log', script)
+        self.assertIn('_wd_stat /var/log/web-deploy/celery/out.log', script)
 
     def test_if_log_not_exists_ensure_log_should_create_them(self):
         sys_files = mock.MagicMock(**{'exists.return_value': False})
@@ -60,30 +67,106 @@ class SystemFactoryTestCase(TestCase):
         with mock.patch(tg_files, sys_files), mock.patch(tg_api, sys_api):
             SystemFactory().get(self._cfg).ensure_log_files()
 
+        self.assertEqual(sys_api.sudo.call_count, 1)
+        script = sys_api.sudo.call_args[0][0]
         self.assertEqual(
-            sys_api.sudo.call_args_list,
+            [line.split('; _wd_rc=$?')[0] for line in script.splitlines()],
             [
-                mock.call('mkdir -p -- "/var/log/web-deploy"'),
-                mock.call(
-                    'chown www-data:www-data -- "/var/log/web-deploy"'
-                ),
-                mock.call('chmod 755 -- "/var/log/web-deploy"'),
-                mock.call('touch -- "/var/log/web-deploy/web-deploy.log"'),
-                mock.call('chmod 0664 -- "/var/log/web-deploy/web-deploy.log"'),
-                mock.call(
-                    'chown me:www-data -- "/var/log/web-deploy/web-deploy.log"'
-                ),
-                mock.call('mkdir -p -- "/var/log/web-deploy/celery"'),
-                mock.call(
-                    'chown www-data:www-data -- '
-                    '"/var/log/web-deploy/celery"'
-                ),
-                mock.call('chmod 755 -- "/var/log/web-deploy/celery"'),
-                mock.call('touch -- "/var/log/web-deploy/celery/out.log"'),
-                mock.call('chmod 0644 -- "/var/log/web-deploy/celery/out.log"'),
-                mock.call(
-                    'chown www-data:www-data -- '
-                    '"/var/log/web-deploy/celery/out.log"'
-                )
+                'mkdir -p -- "/var/log/web-deploy"',
+                'chown www-data:www-data -- "/var/log/web-deploy"',
+                'chmod 755 -- "/var/log/web-deploy"',
+                'touch -- "/var/log/web-deploy/web-deploy.log"',
+                'chmod 0664 -- "/var/log/web-deploy/web-deploy.log"',
+                'chown me:www-data -- "/var/log/web-deploy/web-deploy.log"',
+                'mkdir -p -- "/var/log/web-deploy/celery"',
+                'chown www-data:www-data -- "/var/log/web-deploy/celery"',
+                'chmod 755 -- "/var/log/web-deploy/celery"',
+                'touch -- "/var/log/web-deploy/celery/out.log"',
+                'chmod 0644 -- "/var/log/web-deploy/celery/out.log"',
+                'chown www-data:www-data -- '
+                '"/var/log/web-deploy/celery/out.log"',
             ]
         )
+
+
+class ObjectCacheTestCase(TestCase):
+    _cfg = SettingsXML(
+        FixtureManager.get_fixture_path('config.xml')
+    ).data['project']
+
+    def tearDown(self):
+        AbstractFactory.evict_all()
+
+    def test_equal_configs_should_share_system(self):
+        sys1 = SystemFactory().get(self._cfg)
+        sys2 = SystemFactory().get(copy.deepcopy(self._cfg))
+        self.assertIs(sys1, sys2)
+
+    def test_different_configs_should_not_share_system(self):
+        cfg = copy.deepcopy(self._cfg)
+        cfg['system']['app_dir'] = '/srv/www/other'
+        self.assertIsNot(SystemFactory().get(self._cfg),
+                         SystemFactory().get(cfg))
+
+    def test_force_new_should_rebuild_system(self):
+        sys1 = SystemFactory().get(self._cfg)
+        sys2 = SystemFactory().get(self._cfg, force_new=True)
+        self.assertIsNot(sys1, sys2)
+        self.assertIs(SystemFactory().get(self._cfg), sys2)
+
+    def test_module_should_get_system_of_its_project(self):
+        system = SystemFactory().get(self._cfg)
+        other = SystemFactory().build(self._cfg)
+        modules = ProjectModuleFactory().get(self._cfg, system)
+        self.assertIs(modules[0]._sys, system)
+        modules = ProjectModuleFactory().get(self._cfg, other)
+        self.assertIs(modules[0]._sys, other)
+
+    def test_module_without_system_should_be_rejected(self):
+        SystemFactory().get(self._cfg)
+        with self.assertRaises(DeployError):
+            ProjectModuleFactory().get(self._cfg, None)
+
+    def test_objects_of_hosts_should_not_be_shared(self):
+        daemon_cfg = {'name': 'web-deploy:', 'text': 'Supervisor'}
+        with mock.patch('web_deploy.factory.env') as env:
+            env.host_string = 'web1'
+            daemon1 = DaemonFactory().get(daemon_cfg)
+            env.host_string = 'web2'
+            daemon2 = DaemonFactory().get(daemon_cfg)
+            self.assertIsNot(daemon1, daemon2)
+
+            DaemonFactory.evict(daemon_cfg)
+            self.assertIsNot(DaemonFactory().get(daemon_cfg), daemon2)
+            env.host_string = 'web1'
+            self.assertIs(DaemonFactory().get(daemon_cfg), daemon1)
+
+    def test_cache_should_evict_least_recently_used(self):
+        cache = ObjectCache(2)
+        cache.get('a', object)
+        cache.get('b', object)
+        cache.get('a', object)
+        cache.get('c', object)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('b', lambda: 'new'), 'new')
+
+    def test_cache_should_build_object_once_under_threads(self):
+        cache = ObjectCache()
+        built = []
+        results = []
+
+        def build():
+            built.append(1)
+            return object()
+
+        def worker():
+            results.append(cache.get(ObjectCache.key({'x': [1, 2]}), build))
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(built), 1)
+        self.assertEqual(len(set(id(r) for r in results)), 1)
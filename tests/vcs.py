@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+from unittest import mock
+
+from web_deploy.vcs import Git
+
+
+__author__ = 'y.gavenchuk'
+__all__ = ('GitTestCase', )
+
+
+class GitTestCase(TestCase):
+    def test_fast_update_should_be_one_remote_command(self):
+        git = Git('/srv/www/www1/data', 'prj', 'git@example.com:prj.git',
+                  mirror='/srv/git/prj.git', depth='1')
+        with mock.patch.object(Git, '_api') as m_api:
+            git.update('v1.0')
+
+        self.assertEqual(m_api.run.call_count, 1)
+        cmd = m_api.run.call_args[0][0]
+        self.assertIn(
+            '( flock 9 && ( [ -d "/srv/git/prj.git" ] || git  clone --mirror '
+            '"git@example.com:prj.git" "/srv/git/prj.git" ) && '
+            'git  --git-dir="/srv/git/prj.git" fetch --prune --quiet ) '
+            '9>"/srv/git/prj.git.lock"', cmd
+        )
+        self.assertIn(
+            '( flock -s 9 && git  clone --no-checkout --depth 1 --reference '
+            '"/srv/git/prj.git" --dissociate "git@example.com:prj.git" '
+            '"/srv/www/www1/data/prj" ) 9>"/srv/git/prj.git.lock"', cmd
+        )
+        self.assertIn(
+            '( flock -s 9 && git  fetch --depth 1 --quiet "/srv/git/prj.git" '
+            'v1.0 ) 9>"/srv/git/prj.git.lock"', cmd
+        )
+        self.assertNotIn('origin', cmd)
+
+    def test_fast_update_without_mirror_should_fetch_origin(self):
+        git = Git('/srv/www/www1/data', 'prj', 'git@example.com:prj.git',
+                  depth='1')
+        with mock.patch.object(Git, '_api') as m_api:
+            git.update('v1.0')
+
+        cmd = m_api.run.call_args[0][0]
+        self.assertIn('git  fetch --depth 1 --quiet origin v1.0', cmd)
+        self.assertNotIn('flock', cmd)
+
+    def test_update_without_options_should_use_full_clone(self):
+        git = Git('/srv/www/www1/data', 'prj', 'git@example.com:prj.git')
+        files = mock.MagicMock(**{'exists.return_value': True})
+        with mock.patch.object(Git, '_api') as m_api, \
+                mock.patch.object(Git, '_files', files):
+            git.update()
+
+        self.assertEqual(
+            m_api.run.call_args_list,
+            [mock.call('git  clean -fd'), mock.call('git  pull')]
+        )
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+from unittest import mock
+
+from web_deploy.python import VirtualEnv
+
+
+__author__ = 'y.gavenchuk'
+__all__ = ('VirtualEnvTestCase', )
+
+
+class VirtualEnvTestCase(TestCase):
+    _source = '/srv/www/www1/data/.virtualenv'
+
+    def test_seeded_env_should_not_be_created_from_scratch(self):
+        v_env = VirtualEnv('/srv/www/www2/data', seed=VirtualEnv.SEED_COPY)
+        files = mock.MagicMock(**{'exists.return_value': True})
+        with mock.patch.object(VirtualEnv, '_api') as m_api, \
+                mock.patch.object(VirtualEnv, '_files', files):
+            v_env.mk(self._source)
+
+        self.assertEqual(m_api.run.call_count, 1)
+        cmd = m_api.run.call_args[0][0]
+        self.assertTrue(cmd.startswith(
+            'if [ -x "/srv/www/www1/data/.virtualenv/bin/python" ]; then'
+        ))
+        self.assertIn(
+            'sed -i "s#/srv/www/www1/data/.virtualenv#'
+            '/srv/www/www2/data/.virtualenv#g"', cmd
+        )
+
+    def test_env_without_seed_mode_should_ignore_source(self):
+        v_env = VirtualEnv('/srv/www/www2/data')
+        files = mock.MagicMock(**{'exists.return_value': True})
+        with mock.patch.object(VirtualEnv, '_api') as m_api, \
+                mock.patch.object(VirtualEnv, '_files', files):
+            v_env.mk(self._source)
+
+        self.assertFalse(m_api.run.called)
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import os
+import tempfile
+from unittest import TestCase
+from unittest import mock
+
+from web_deploy.factory import WheelhouseFactory
+from web_deploy.python import Wheelhouse
+
+
+__author__ = 'y.gavenchuk'
+__all__ = ('WheelhouseTestCase', )
+
+
+class WheelhouseTestCase(TestCase):
+    _requirements = b'six==1.10.0\n'
+
+    @staticmethod
+    def _get(remote_path, buf):
+        buf.write(WheelhouseTestCase._requirements)
+
+    def test_shipped_wheels_should_not_be_built_again(self):
+        digest = hashlib.sha1(self._requirements).hexdigest()
+        files = mock.MagicMock(**{'exists.return_value': True})
+        m_api = mock.MagicMock(**{'get.side_effect': self._get})
+        wheelhouse = WheelhouseFactory().get({
+            'text': '/srv/www/wheels', 'build': 'local'
+        })
+        with mock.patch.object(Wheelhouse, '_api', m_api), \
+                mock.patch.object(Wheelhouse, '_files', files):
+            path = wheelhouse.prepare('/srv/www/req.txt', mock.MagicMock())
+
+        self.assertEqual(path, '/srv/www/wheels/' + digest)
+        self.assertFalse(m_api.local.called)
+        self.assertFalse(m_api.put.called)
+
+    def test_wheels_should_be_built_locally_once(self):
+        files = mock.MagicMock(**{'exists.return_value': False})
+        m_api = mock.MagicMock(**{'get.side_effect': self._get})
+        with tempfile.TemporaryDirectory() as cache_dir:
+            wheelhouse = Wheelhouse('/srv/www/wheels', cache_dir=cache_dir)
+            with mock.patch.object(Wheelhouse, '_api', m_api), \
+                    mock.patch.object(Wheelhouse, '_files', files):
+                wheelhouse.prepare('/srv/www/req.txt', mock.MagicMock())
+                digest = hashlib.sha1(self._requirements).hexdigest()
+                open(os.path.join(cache_dir, digest + '.tar.gz'), 'w').close()
+                wheelhouse.prepare('/srv/www/req.txt', mock.MagicMock())
+
+        self.assertEqual(m_api.local.call_count, 1)
+        self.assertEqual(m_api.put.call_count, 2)
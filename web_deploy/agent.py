@@ -0,0 +1,683 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    Long-running deploy agent. Agent accepts deploy jobs by HTTP API (on TCP
+    port or unix socket), queues them and runs them by a bounded pool of
+    worker processes. Workers are forked once, so fabric is imported, config
+    is compiled and connections to hosts are opened once per worker instead
+    of once per deploy.
+
+    Jobs of the same project and environment never run on the same host at
+    the same time. A queued job is replaced by a newer one of the same
+    project: rapid successive tags are coalesced into the deploy of the
+    latest tag. Dead worker (or worker whose job runs longer than timeout)
+    is replaced by a new one, its job fails.
+
+    API::
+
+        POST /jobs         {"project": ..., "tag": ..., "environment": ...,
+                            "hosts": [...], "force": false} => job
+        GET  /jobs         => list of jobs
+        GET  /jobs/<id>    => job
+        GET  /health       => {"status": "ok", "workers": N}
+"""
+
+import itertools
+import json
+import multiprocessing
+import os
+import signal
+import socketserver
+import stat
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from queue import Empty
+
+from fabric.api import env
+from fabric.context_managers import settings
+
+from .base import DeployError
+from .factory import ConnectionFactory
+
+
+__author__ = 'y.gavenchuk'
+__all__ = ('Job', 'JobQueue', 'Agent', 'make_server', 'serve', )
+
+
+class Job(object):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    SUPERSEDED = 'superseded'
+
+    FINISHED = frozenset((SUCCEEDED, FAILED, SUPERSEDED))
+
+    _ids = itertools.count(1)
+
+    __slots__ = ('_id', '_project', '_tag', '_environment', '_hosts',
+                 '_force', 'status', 'error', 'output', 'superseded_by',
+                 'created', 'started', 'finished', )
+
+    def __init__(self, project=None, tag=None, environment=None, hosts=None,
+                 force=False):
+        """
+        :param str|None project: name of project in multi-project config
+        :param str|None tag: git tag
+        :param str|None environment: name of environment of project
+        :param list[str]|None hosts: hosts to deploy to. None - hosts of
+                                     config
+        :param bool force: run all post update hooks
+        """
+        self._id = next(self._ids)
+        self._project = project
+        self._tag = tag
+        self._environment = environment
+        self._hosts = tuple(hosts) if hosts else None
+        self._force = bool(force)
+        self.status = self.QUEUED
+        self.error = None
+        self.output = []
+        self.superseded_by = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    def __str__(self):
+        return 'job #%d %s@%s: %s' % (self.id, self.project or '-',
+                                      self.tag or '-', self.status)
+
+    @property
+    def id(self):
+        return self._id
+
+    @property
+    def project(self):
+        return self._project
+
+    @property
+    def tag(self):
+        return self._tag
+
+    @property
+    def environment(self):
+        return self._environment
+
+    @property
+    def hosts(self):
+        return self._hosts
+
+    @property
+    def force(self):
+        return self._force
+
+    @property
+    def key(self):
+        """
+        :return tuple: jobs with equal keys are coalesced
+        """
+        return self._project, self._environment, self._hosts
+
+    def overlaps(self, other):
+        """
+        :param Job other:
+        :return bool: jobs deploy the same project and environment to a
+                      common host (no hosts - all hosts of config). Such
+                      jobs never run simultaneously
+        """
+        if self.key[:2] != other.key[:2]:
+            return False
+
+        if self._hosts is None or other.hosts is None:
+            return True
+
+        return bool(set(self._hosts) & set(other.hosts))
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'project': self.project,
+            'tag': self.tag,
+            'environment': self.environment,
+            'hosts': list(self.hosts) if self.hosts else None,
+            'force': self.force,
+            'status': self.status,
+            'error': self.error,
+            'output': list(self.output),
+            'superseded_by': self.superseded_by,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+
+class JobQueue(object):
+    """
+    Thread-safe queue of jobs with coalescing of jobs of the same key
+    """
+    __slots__ = ('_queue', '_jobs', '_running', '_history', '_lock', )
+
+    def __init__(self, history=100):
+        """
+        :param int history: number of finished jobs to remember
+        """
+        self._queue = []
+        self._jobs = {}
+        self._running = {}
+        self._history = int(history)
+        self._lock = threading.Condition()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._queue)
+
+    def jobs(self):
+        """
+        :return list[Job]: all known jobs, the newest first
+        """
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda j: -j.id)
+
+    def job(self, job_id):
+        """
+        :param int job_id:
+        :return Job|None:
+        """
+        with self._lock:
+            return self._jobs.get(int(job_id))
+
+    def submit(self, job):
+        """
+        Queues job. If there is a queued (not running) job of the same key,
+        it's superseded by the new one. If a job of the same key and tag is
+        queued or running already, the new one is dropped (unless it's
+        forced)
+
+        :param Job job:
+        :return Job: queued job (the existing one if the new job is
+                     duplicate)
+        """
+        with self._lock:
+            current = None
+            for running in self._running.values():
+                if running.key == job.key:
+                    current = running
+            for queued in self._queue:
+                if queued.key == job.key:
+                    current = queued
+
+            if current is not None and current.tag == job.tag and \
+                    not job.force:
+                return current
+
+            for queued in [j for j in self._queue if j.key == job.key]:
+                self._queue.remove(queued)
+                self._finish(queued, Job.SUPERSEDED)
+                queued.superseded_by = job.id
+
+            self._queue.append(job)
+            self._jobs[job.id] = job
+            self._lock.notify_all()
+            return job
+
+    def take(self, timeout=None):
+        """
+        :param float|None timeout: seconds to wait for a job
+        :return Job|None: the oldest queued job which doesn't overlap
+                          running jobs and older queued ones
+        """
+        with self._lock:
+            deadline = None if timeout is None else time.time() + timeout
+            while True:
+                for i, job in enumerate(self._queue):
+                    blockers = self._queue[:i] + list(self._running.values())
+                    if not any(job.overlaps(other) for other in blockers):
+                        del self._queue[i]
+                        self._running[job.id] = job
+                        job.status = Job.RUNNING
+                        job.started = time.time()
+                        return job
+
+                left = None if deadline is None else deadline - time.time()
+                if left is not None and left <= 0:
+                    return None
+                self._lock.wait(left)
+
+    def done(self, job, error=None, output=()):
+        """
+        Marks running job as finished
+
+        :param Job job:
+        :param str|None error: None - job succeeded
+        :param list[str] output: results of hosts
+        """
+        with self._lock:
+            self._running.pop(job.id, None)
+            job.error = error
+            job.output = list(output)
+            self._finish(job, Job.FAILED if error else Job.SUCCEEDED)
+            self._lock.notify_all()
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished = time.time()
+
+        finished = sorted(
+            (j for j in self._jobs.values() if j.status in Job.FINISHED),
+            key=lambda j: j.id
+        )
+        for old in finished[:max(len(finished) - self._history, 0)]:
+            del self._jobs[old.id]
+
+
+class _Worker(object):
+    """
+    Executes jobs in forked process. Apps (compiled configs) and connection
+    manager are kept between jobs
+    """
+    def __init__(self, config_file):
+        self._config_file = config_file
+        self._apps = {}
+        self._manager = None
+        self._manager_cfg = None
+
+    def app(self, job):
+        # local import: app imports fabric's tasks
+        from .app import App
+
+        info = os.stat(self._config_file)
+        version = (info.st_mtime_ns, info.st_size)
+        key = (job.project, job.environment) + version
+        app = self._apps.get(key)
+        if app is None:
+            # apps of previous versions of config are dropped
+            self._apps = {k: a for k, a in self._apps.items()
+                          if k[2:] == version}
+            app = self._apps[key] = App(self._config_file, job.project,
+                                        job.environment)
+
+        return app
+
+    def connect(self, config):
+        """
+        Installs connection manager of config. It's kept installed while
+        jobs use the same <connection> section
+        """
+        cfg = config.get('connection')
+        if self._manager is not None and cfg == self._manager_cfg:
+            return
+
+        if self._manager is not None:
+            self._manager.uninstall()
+
+        self._manager = ConnectionFactory().get(config)
+        self._manager_cfg = cfg
+        self._manager.install()
+
+    def run(self, job):
+        """
+        :param Job job:
+        :return list[str]: results of hosts
+        :raise DeployError:
+        """
+        app = self.app(job)
+        self.connect(app.config)
+
+        hosts = list(job.hosts or ())
+        if len(hosts) == 1:
+            # the only host is updated in this process: its connection
+            # stays warm
+            with settings(host_string=hosts[0]):
+                app.deploy(job.tag, job.force)
+            return ['%s: ok' % hosts[0]]
+
+        results = app.rollout(job.tag, job.force, hosts=hosts or None)
+        failed = [str(r) for r in results if r.failed]
+        if failed:
+            raise DeployError('; '.join(failed))
+
+        return [str(r) for r in results]
+
+    def close(self):
+        if self._manager is not None:
+            self._manager.uninstall()
+
+
+def _work(config_file, inbox, outbox):
+    # worker leads its own process group: processes it starts (ssh, workers
+    # of rollout) are killed with it
+    os.setsid()
+    worker = _Worker(config_file)
+    try:
+        for job in iter(inbox.get, None):
+            try:
+                output = worker.run(job)
+            except BaseException as e:  # abort() raises SystemExit
+                outbox.put((job.id, '%s: %s' % (e.__class__.__name__, e),
+                            []))
+            else:
+                outbox.put((job.id, None, output))
+    finally:
+        worker.close()
+
+
+class Agent(object):
+    """
+    Usage::
+
+        agent = Agent('deploy.xml', workers=2)
+        agent.start()
+        agent.submit(Job('shop', 'v1.2.3'))
+        ...
+        agent.stop()
+    """
+    __slots__ = ('_config_file', '_workers', '_queue', '_ctx', '_procs',
+                 '_idle', '_outbox', '_threads', '_stopped', '_timeout', )
+
+    def __init__(self, config_file, workers=2, history=100, timeout=None):
+        """
+        :param str config_file:
+        :param int workers: number of worker processes
+        :param int history: number of finished jobs to remember
+        :param float|None timeout: max seconds of job. Worker of job which
+                                   runs longer is killed, the job fails
+        """
+        self._config_file = config_file
+        self._workers = int(workers)
+        assert self._workers > 0, "Workers count should be positive"
+        self._timeout = None if timeout is None else float(timeout)
+
+        self._queue = JobQueue(history)
+        self._ctx = multiprocessing.get_context('fork')
+        self._procs = []
+        self._idle = None
+        self._outbox = None
+        self._threads = []
+        self._stopped = threading.Event()
+
+    @property
+    def queue(self):
+        return self._queue
+
+    @property
+    def workers(self):
+        return self._workers
+
+    def validate(self, job):
+        """
+        :param Job job:
+        :raise DeployError: if job doesn't name its hosts while project is
+                            unknown or its config has no <hosts>
+        """
+        if job.hosts is not None:
+            return
+
+        from .settings import SettingsXML
+        config = SettingsXML(self._config_file).project(job.project,
+                                                        job.environment)
+        if not env.hosts and not (config.get('hosts') or {}).get('host'):
+            raise DeployError('Hosts of job should be given: config of "%s" '
+                              'has no <hosts>' % job.project)
+
+    def submit(self, job):
+        """
+        :param Job job:
+        :return Job: see `JobQueue.submit`
+        """
+        return self._queue.submit(job)
+
+    def start(self):
+        """
+        Forks worker processes and starts dispatching of jobs
+        """
+        assert not self._procs, 'Agent is started already'
+        # compile config once, workers inherit it
+        from .settings import SettingsXML
+        SettingsXML(self._config_file)
+
+        self._outbox = self._ctx.Queue()
+        self._procs = [self._spawn() for _ in range(self._workers)]
+        # indexes of idle workers
+        self._idle = list(range(self._workers))
+
+        self._stopped.clear()
+        busy = {}
+        free = threading.Semaphore(self._workers)
+        lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._dispatch, args=(busy, free, lock)),
+            threading.Thread(target=self._collect, args=(busy, free, lock)),
+        ]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def _spawn(self):
+        """
+        :return tuple(multiprocessing.Process, multiprocessing.Queue):
+                started worker process and its inbox
+        """
+        inbox = self._ctx.Queue()
+        proc = self._ctx.Process(target=_work, args=(
+            self._config_file, inbox, self._outbox
+        ))
+        proc.start()
+        return proc, inbox
+
+    def _dispatch(self, busy, free, lock):
+        while not self._stopped.is_set():
+            if not free.acquire(timeout=0.1):
+                continue
+
+            job = self._queue.take(timeout=0.1)
+            if job is None:
+                free.release()
+                continue
+
+            with lock:
+                worker = self._idle.pop()
+                busy[job.id] = (job, worker)
+                self._procs[worker][1].put(job)
+
+    def _collect(self, busy, free, lock):
+        while not self._stopped.is_set():
+            self._reap(busy, free, lock)
+            try:
+                job_id, error, output = self._outbox.get(timeout=0.1)
+            except Empty:
+                continue
+
+            with lock:
+                # job of reaped worker is failed already
+                job, worker = busy.pop(job_id, (None, None))
+                if job is not None:
+                    self._idle.append(worker)
+            if job is not None:
+                self._queue.done(job, error, output)
+                free.release()
+
+    def _reap(self, busy, free, lock):
+        """
+        Replaces dead workers and kills workers of timed out jobs. Their
+        jobs fail, so hosts of jobs are released
+        """
+        failed = []
+        with lock:
+            running = dict((worker, job) for job, worker in busy.values())
+            for worker, (proc, _) in enumerate(self._procs):
+                job = running.get(worker)
+                if not proc.is_alive():
+                    error = 'WorkerError: worker died with exit code %s' % (
+                        proc.exitcode
+                    )
+                elif job is not None and self._timeout is not None and \
+                        time.time() - job.started > self._timeout:
+                    error = 'TimeoutError: job runs longer than %ss' % (
+                        self._timeout
+                    )
+                else:
+                    continue
+
+                self._kill(proc)
+                self._procs[worker] = self._spawn()
+                if job is not None:
+                    del busy[job.id]
+                    self._idle.append(worker)
+                    failed.append((job, error))
+
+        for job, error in failed:
+            self._queue.done(job, error)
+            free.release()
+
+    @staticmethod
+    def _kill(proc):
+        """
+        Kills process group of worker (children of dead worker too)
+        """
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+        proc.join()
+
+    def stop(self):
+        """
+        Stops workers. Running jobs are finished, queued ones are left
+        """
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join()
+
+        for proc, inbox in self._procs:
+            inbox.put(None)
+        for proc, _ in self._procs:
+            proc.join()
+
+        self._procs = []
+        self._threads = []
+
+
+class _Handler(BaseHTTPRequestHandler):
+    agent = None
+
+    def address_string(self):
+        # client of unix socket has no address
+        return str(self.client_address[0]) if self.client_address else '-'
+
+    def _reply(self, code, data):
+        body = json.dumps(data, indent=2, sort_keys=True).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        if parts == ['health']:
+            return self._reply(200, {'status': 'ok',
+                                     'workers': self.agent.workers,
+                                     'queued': len(self.agent.queue)})
+
+        if parts == ['jobs']:
+            return self._reply(
+                200, [j.to_dict() for j in self.agent.queue.jobs()]
+            )
+
+        if len(parts) == 2 and parts[0] == 'jobs' and parts[1].isdigit():
+            job = self.agent.queue.job(parts[1])
+            if job is not None:
+                return self._reply(200, job.to_dict())
+
+        self._reply(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        if self.path.strip('/') != 'jobs':
+            return self._reply(404, {'error': 'Not found'})
+
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            data = json.loads(self.rfile.read(length).decode('utf-8') or '{}')
+            hosts = data.get('hosts')
+            job = Job(
+                project=data.get('project'),
+                tag=data.get('tag'),
+                environment=data.get('environment'),
+                hosts=[hosts] if isinstance(hosts, str) else hosts,
+                force=data.get('force', False),
+            )
+            self.agent.validate(job)
+        except (ValueError, AttributeError, TypeError, DeployError) as e:
+            return self._reply(400, {'error': str(e)})
+
+        self._reply(202, self.agent.submit(job).to_dict())
+
+
+class _TCPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _UnixServer(socketserver.ThreadingMixIn,
+                  socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(agent, listen):
+    """
+    :param Agent agent:
+    :param str listen: "host:port" or path of unix socket
+    :return socketserver.BaseServer:
+    """
+    handler = type('Handler', (_Handler, ), {'agent': agent})
+    if '/' in listen:
+        try:
+            mode = os.lstat(listen).st_mode
+        except FileNotFoundError:
+            mode = None
+
+        if mode is not None:
+            # stale socket of previous agent
+            if not stat.S_ISSOCK(mode):
+                raise DeployError('"%s" exists and is not a socket' % listen)
+            os.unlink(listen)
+
+        return _UnixServer(listen, handler)
+
+    host, _, port = listen.rpartition(':')
+    return _TCPServer((host or '127.0.0.1', int(port)), handler)
+
+
+def serve(listen='127.0.0.1:8765', workers=2, timeout=None):
+    """
+    Fabric task: runs deploy agent for config `env.wd_settings`
+
+    :param str listen: "host:port" or path of unix socket
+    :param int workers: number of worker processes
+    :param float|None timeout: max seconds of job
+    """
+    agent = Agent(env.wd_settings, int(workers), timeout=timeout)
+    server = make_server(agent, listen)
+    agent.start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        agent.stop()
@@ -0,0 +1,483 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    Asyncio execution engine. Deploy operations (`Git.update_async`,
+    `VirtualEnv.run_async`, `Daemon.apply_async`, `Project.update_async`,
+    `AsyncFileSystemAPI`, ...) are coroutines which talk to the host by
+    session. The sync API runs the same coroutines with FabricSession; this
+    engine runs them by an event loop with Session per host, so one process
+    drives many hosts without fabric's global `env`.
+
+    Commands are executed by async transport:
+
+        * SSHTransport - asyncssh (optional dependency, `pip install
+          web-deploy[async]`), one connection per host;
+        * LocalTransport - local shell, stand-in of remote host.
+
+    Post update hooks are blocking code (they use `_api` of deploy
+    entities), so they're called in a bounded pool of threads. Their
+    commands are sent back to the event loop by session of their host.
+"""
+
+import asyncio
+import shlex
+import shutil
+import threading
+import time
+from abc import ABCMeta, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+from fabric import api as fab_api
+from fabric.context_managers import settings
+from six import add_metaclass
+
+try:
+    import asyncssh
+except ImportError:  # pragma: no cover
+    asyncssh = None
+
+from . import transport
+from .base import DeployError
+from .parallel import TaskResult
+from .transport import _ContextTracker, Transport
+
+
+__author__ = 'y.gavenchuk'
+__all__ = ('Result', 'AsyncTransport', 'LocalTransport', 'SSHTransport',
+           'Session', 'Engine', 'deploy', )
+
+
+class Result(str):
+    """
+    Output of command with attributes of fabric's result
+    """
+    def __new__(cls, stdout='', stderr='', return_code=0, command=''):
+        result = super(Result, cls).__new__(cls, stdout.rstrip('\r\n'))
+        result.stderr = stderr
+        result.return_code = return_code
+        result.command = command
+        return result
+
+    @property
+    def failed(self):
+        return self.return_code != 0
+
+    @property
+    def succeeded(self):
+        return not self.failed
+
+
+@add_metaclass(ABCMeta)
+class AsyncTransport(object):
+    SHELL = '/bin/bash -l -c'
+    SUDO = 'sudo -n'
+
+    def _wrap(self, command, sudo=False):
+        """
+        :return str: command in shell the same way as fabric runs it
+        """
+        wrapped = '%s %s' % (self.SHELL, shlex.quote(command))
+        return '%s %s' % (self.SUDO, wrapped) if sudo else wrapped
+
+    @abstractmethod
+    async def execute(self, command, sudo=False):
+        """
+        :param str command:
+        :param bool sudo:
+        :return Result:
+        """
+
+    @abstractmethod
+    async def put(self, local_path, remote_path):
+        pass
+
+    @abstractmethod
+    async def get(self, remote_path, local_path):
+        pass
+
+    async def close(self):
+        pass
+
+
+class LocalTransport(AsyncTransport):
+    """
+    Executes commands by local shell
+    """
+    # profile of local user isn't needed
+    SHELL = '/bin/bash -c'
+
+    async def execute(self, command, sudo=False):
+        proc = await asyncio.create_subprocess_shell(
+            self._wrap(command, sudo),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stdout, stderr = await proc.communicate()
+        return Result(stdout.decode('utf-8', 'replace'),
+                      stderr.decode('utf-8', 'replace'), proc.returncode,
+                      command)
+
+    async def put(self, local_path, remote_path):
+        await self._copy(local_path, remote_path)
+
+    async def get(self, remote_path, local_path):
+        await self._copy(remote_path, local_path)
+
+    @staticmethod
+    async def _copy(source, target):
+        loop = asyncio.get_event_loop()
+        if hasattr(target, 'write'):
+            with open(source, 'rb') as fp:
+                data = await loop.run_in_executor(None, fp.read)
+            target.write(data)
+        elif hasattr(source, 'read'):
+            with open(target, 'wb') as fp:
+                fp.write(source.read())
+        else:
+            await loop.run_in_executor(None, shutil.copy, source, target)
+
+
+class SSHTransport(AsyncTransport):
+    """
+    One asyncssh connection per host. Commands of the host are channels of
+    the connection
+    """
+    def __init__(self, host, username=None, port=None, max_sessions=10,
+                 keepalive=30, **options):
+        """
+        :param str host:
+        :param str|None username:
+        :param int|None port:
+        :param int max_sessions: max number of simultaneous commands
+        :param int keepalive: interval of keepalive packets (seconds)
+        :param options: options of `asyncssh.connect`
+        """
+        if asyncssh is None:
+            raise DeployError('asyncssh is required by SSHTransport, '
+                              'install web-deploy[async]')
+
+        self._host = host
+        self._options = dict(options, keepalive_interval=int(keepalive))
+        if username:
+            self._options['username'] = username
+        if port:
+            self._options['port'] = int(port)
+
+        self._conn = None
+        self._lock = asyncio.Lock()
+        self._sessions = asyncio.Semaphore(int(max_sessions))
+
+    @classmethod
+    def from_host_string(cls, host_string, **kwargs):
+        """
+        :param str host_string: "[user@]host[:port]"
+        :return SSHTransport:
+        """
+        username, _, host = host_string.rpartition('@')
+        host, _, port = host.partition(':')
+        return cls(host, username or None, port or None, **kwargs)
+
+    async def _connection(self):
+        async with self._lock:
+            if self._conn is None:
+                self._conn = await asyncssh.connect(self._host,
+                                                    **self._options)
+
+        return self._conn
+
+    async def execute(self, command, sudo=False):
+        conn = await self._connection()
+        async with self._sessions:
+            result = await conn.run(self._wrap(command, sudo), check=False)
+
+        return Result(result.stdout or '', result.stderr or '',
+                      result.exit_status, command)
+
+    async def put(self, local_path, remote_path):
+        conn = await self._connection()
+        async with conn.start_sftp_client() as sftp:
+            if hasattr(local_path, 'read'):
+                async with sftp.open(remote_path, 'wb') as fp:
+                    await fp.write(local_path.read())
+            else:
+                await sftp.put(local_path, remote_path)
+
+    async def get(self, remote_path, local_path):
+        conn = await self._connection()
+        async with conn.start_sftp_client() as sftp:
+            if hasattr(local_path, 'write'):
+                async with sftp.open(remote_path, 'rb') as fp:
+                    local_path.write(await fp.read())
+            else:
+                await sftp.get(remote_path, local_path)
+
+    async def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            await self._conn.wait_closed()
+            self._conn = None
+
+
+class Session(_ContextTracker):
+    """
+    Commands of deploy operations on one host. Context of `cd`, `prefix`
+    and `shell_env` is composed into the command the same way as fabric
+    does. Operations of one host should use context one by one
+    """
+    def __init__(self, host, transport_, engine=None):
+        """
+        :param str host:
+        :param AsyncTransport transport_:
+        :param Engine|None engine: engine which calls blocking code
+        """
+        super(Session, self).__init__()
+        self._host = host
+        self._transport = transport_
+        self._engine = engine
+
+    @property
+    def host(self):
+        return self._host
+
+    async def _execute(self, command, sudo=False, warn_only=False):
+        result = await self._transport.execute(self._full_command(command),
+                                               sudo)
+        if result.failed and not warn_only:
+            raise DeployError(
+                '%s: command "%s" failed with exit status %d%s' % (
+                    self._host, command, result.return_code,
+                    ': %s' % result.stderr.strip() if result.stderr else ''
+                )
+            )
+
+        return result
+
+    async def run(self, command, warn_only=False, **kwargs):
+        return await self._execute(command, False, warn_only)
+
+    async def sudo(self, command, warn_only=False, **kwargs):
+        return await self._execute(command, True, warn_only)
+
+    async def exists(self, path):
+        result = await self._execute('test -e "$(echo %s)"' % path,
+                                     warn_only=True)
+        return result.succeeded
+
+    async def is_link(self, path):
+        result = await self._execute('test -L "$(echo %s)"' % path,
+                                     warn_only=True)
+        return result.succeeded
+
+    async def put(self, local_path, remote_path):
+        await self._transport.put(local_path, remote_path)
+        return [remote_path]
+
+    async def get(self, remote_path, local_path):
+        await self._transport.get(remote_path, local_path)
+        return [local_path]
+
+    async def close(self):
+        await self._transport.close()
+
+    async def call(self, func, *args):
+        """
+        Calls blocking function in thread of engine. Commands of deploy
+        entities called by it are sent by this session
+        """
+        assert self._engine is not None, 'Session has no engine'
+        return await self._engine.call(self, func, *args)
+
+
+class _Bridge(Transport):
+    """
+    Transport of blocking code called by engine: commands are sent to the
+    event loop by session of the current thread
+    """
+    def __init__(self, loop):
+        self._loop = loop
+        self._local = threading.local()
+
+    def bind(self, session):
+        self._local.session = session
+
+    @property
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            raise DeployError('Blocking code is called outside of engine')
+
+        return session
+
+    def _wait(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def run(self, command, **kwargs):
+        return self._wait(self._session.run(command, **kwargs))
+
+    def sudo(self, command, **kwargs):
+        return self._wait(self._session.sudo(command, **kwargs))
+
+    def local(self, command, **kwargs):
+        return fab_api.local(command, **kwargs)
+
+    def put(self, local_path=None, remote_path=None, **kwargs):
+        return self._wait(self._session.put(local_path, remote_path))
+
+    def get(self, remote_path, local_path=None, **kwargs):
+        return self._wait(self._session.get(remote_path, local_path))
+
+    def exists(self, path, use_sudo=False, verbose=False):
+        return self._wait(self._session.exists(path))
+
+    def is_link(self, path, use_sudo=False, verbose=False):
+        return self._wait(self._session.is_link(path))
+
+    def cd(self, path):
+        return self._session.cd(path)
+
+    def prefix(self, command):
+        return self._session.prefix(command)
+
+    def shell_env(self, **kwargs):
+        return self._session.shell_env(**kwargs)
+
+
+class Engine(object):
+    """
+    Usage::
+
+        engine = Engine(LocalTransport, concurrency=100)
+        results = engine.run(hosts, lambda session: project.update_async(
+            session, 'v1.2.3'
+        ))
+    """
+    __slots__ = ('_transport', '_concurrency', '_threads', '_executor',
+                 '_bridge', )
+
+    def __init__(self, transport_=None, concurrency=None, threads=32):
+        """
+        :param callable transport_: host => AsyncTransport. Default is
+                                    `SSHTransport.from_host_string`
+        :param int|None concurrency: max number of simultaneously updated
+                                     hosts. None means no limit
+        :param int threads: size of thread pool of blocking code (hooks)
+        """
+        self._transport = transport_ or SSHTransport.from_host_string
+        self._concurrency = int(concurrency) if concurrency else None
+        self._threads = int(threads)
+        self._executor = None
+        self._bridge = None
+
+    async def call(self, session, func, *args):
+        """
+        Calls blocking `func(*args)` in thread pool with session of host
+        """
+        def target():
+            self._bridge.bind(session)
+            try:
+                return func(*args)
+            finally:
+                self._bridge.bind(None)
+
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, target)
+
+    async def _run_host(self, host, operation, semaphore):
+        async with semaphore:
+            session = Session(host, self._transport(host), self)
+            start = time.time()
+            try:
+                value = await operation(session)
+            except Exception as e:
+                return TaskResult(
+                    host, error='%s: %s' % (e.__class__.__name__, e),
+                    started=start, duration=time.time() - start
+                )
+            finally:
+                await session.close()
+
+            return TaskResult(host, value=value, started=start,
+                              duration=time.time() - start)
+
+    async def run_async(self, hosts, operation):
+        """
+        :param list[str] hosts:
+        :param callable operation: session => coroutine
+        :return list[TaskResult]: results of hosts (in order of hosts)
+        """
+        loop = asyncio.get_event_loop()
+        semaphore = asyncio.Semaphore(self._concurrency or len(hosts) or 1)
+
+        self._executor = ThreadPoolExecutor(max_workers=self._threads)
+        self._bridge = _Bridge(loop)
+        try:
+            with transport.using(self._bridge):
+                return await asyncio.gather(*[
+                    self._run_host(h, operation, semaphore) for h in hosts
+                ])
+        finally:
+            self._executor.shutdown()
+
+    def run(self, hosts, operation):
+        """
+        The same as `run_async` but runs its own event loop
+        """
+        return asyncio.run(self.run_async(hosts, operation))
+
+
+def deploy(config_file, tag=None, hosts=None, force=False, project=None,
+           environment=None, transport_=None, concurrency=None):
+    """
+    Deploys project to many hosts by one process
+
+    :param str config_file:
+    :param str|None tag: git tag
+    :param list[str]|None hosts: default is hosts of config
+    :param bool force: run all post update hooks
+    :param str|None project: name of project in multi-project config
+    :param str|None environment: name of environment of project
+    :param callable transport_: host => AsyncTransport
+    :param int|None concurrency: max number of simultaneously updated hosts
+    :return list[TaskResult]:
+    """
+    # local import: factory imports all of deploy entities
+    from .factory import ArtifactFactory, ProjectFactory, RolloutFactory
+
+    factory = ProjectFactory(config_file, project, environment)
+    hosts = list(hosts or RolloutFactory().get(factory.config).hosts)
+
+    # objects of factories are cached per host, so each host gets its own
+    # project (paths of its modules are changed by update)
+    projects = {}
+    for host in hosts:
+        with settings(host_string=host):
+            projects[host] = factory.get()
+
+    builder = ArtifactFactory().get(factory.config)
+    if builder is not None and hosts:
+        artifacts = [
+            builder.build(m, tag, force) for m in projects[hosts[0]].modules
+        ]
+        for project_ in projects.values():
+            for module, artifact in zip(project_.modules, artifacts):
+                module.artifact = artifact
+
+    return Engine(transport_, concurrency).run(
+        hosts,
+        lambda session: projects[session.host].update_async(session, tag,
+                                                            force)
+    )
@@ -14,20 +14,172 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from contextlib import contextmanager
+
 from fabric.api import env
+from fabric.utils import puts
 
-from .factory import ProjectFactory
+from . import connection, profiler
+from .factory import AbstractFactory, ProjectFactory, RolloutFactory, \
+    ConnectionFactory, ArtifactFactory
 
-__all__ = ('App', 'deploy')
+__all__ = ('App', 'deploy', 'rollout', 'rollback', 'reconcile', )
 
 
 class App(object):
-    def __init__(self, config_file):
-        self._prj = ProjectFactory(config_file).get()
+    def __init__(self, config_file, project=None, environment=None):
+        """
+        :param str config_file:
+        :param str|None project: name of project in multi-project config
+        :param str|None environment: name of environment of project
+        """
+        self._factory = ProjectFactory(config_file, project, environment)
+        self._prj = self._factory.get()
+        # (tag, ) of built artifacts
+        self._built = None
+
+    @property
+    def config(self):
+        """
+        :return dict: config of project
+        """
+        return self._factory.config
+
+    @contextmanager
+    def _connections(self, hosts=()):
+        """
+        Keeps connections to hosts during deploy. Nested deploys (e.g. by
+        rollout) use connection manager of the outer one
+        """
+        if connection.current() is not None:
+            yield
+            return
+
+        manager = ConnectionFactory().get(self._factory.config)
+        manager.install(hosts)
+        try:
+            yield
+        finally:
+            manager.uninstall()
+
+    @staticmethod
+    @contextmanager
+    def _profiling(profile):
+        """
+        Installs profiler unless it's installed already (e.g. by rollout)
+
+        :param str|None profile: path of JSON report. None - no profiling
+        """
+        if not profile or profiler.current() is not None:
+            yield
+            return
+
+        with profiler.Profiler() as prof:
+            try:
+                yield
+            finally:
+                puts(prof.summary())
+                with open(profile, 'w') as fp:
+                    fp.write(prof.to_json())
+
+    def build_artifacts(self, tag, force=False):
+        """
+        Builds artifacts of modules if config has <artifact> section. Hosts
+        of rollout share artifacts built once
+        """
+        builder = ArtifactFactory().get(self._factory.config)
+        if builder is None or self._built == (tag, ):
+            return
+
+        with profiler.phase('build_artifacts'):
+            for module in self._prj.modules:
+                module.artifact = builder.build(module, tag, force)
+                puts('Artifact of "%s": %s' % (module.name, module.artifact))
+
+        self._built = (tag, )
+
+    def deploy(self, tag, force=False, profile=None):
+        """
+        :param str tag: git tag
+        :param bool force: run all post update hooks even if their inputs
+                           are unchanged
+        :param str|None profile: write timings of deploy phases to this file
+        """
+        with self._connections(), self._profiling(profile):
+            self.build_artifacts(tag, force)
+            self._prj.update(tag, force)
+
+    def rollout(self, tag, force=False, profile=None, hosts=None):
+        """
+        Deploys project to all hosts from <hosts> section of config
+
+        :param list[str]|None hosts: deploy to these hosts instead of hosts
+                                     of config (options of rollout are kept)
+        """
+        config = self._factory.config
+        if hosts:
+            config = dict(config)
+            config['hosts'] = dict(config.get('hosts') or {}, host=hosts)
+
+        rollout = RolloutFactory().get(config)
+        with self._connections(rollout.hosts), self._profiling(profile):
+            self.build_artifacts(tag, force)
+            results = rollout.run(self.deploy, tag, force)
+        for result in results:
+            puts(str(result))
+
+        return results
+
+    def rollback(self, to=None):
+        """
+        Activates previous (or selected) release on the current host
+
+        :param str|None to: tag, slot or number of slot
+        :return web_deploy.release.Release:
+        """
+        with self._connections():
+            release = self._prj.rollback(to)
+        puts('Rolled back to %s' % release)
+
+        return release
+
+    def reconcile(self, dry_run=True):
+        """
+        Brings project tree and log files of the current host to desired
+        state (see `web_deploy.reconcile`)
+
+        :param bool dry_run: only show changes
+        :return list[web_deploy.reconcile.Change]:
+        """
+        with self._connections():
+            changes = self._prj.system.reconcile(dry_run)
+        for change in changes:
+            puts(str(change))
+        if not changes:
+            puts('Nothing to change')
+
+        return changes
+
+
+def _app(project=None, environment=None):
+    return App(env.wd_settings, project or env.get('wd_project'),
+               environment or env.get('wd_environment'))
+
+
+def deploy(tag, force=False, profile=None, project=None, environment=None):
+    _app(project, environment).deploy(tag, AbstractFactory._2b(force),
+                                      profile)
+
+
+def rollout(tag=None, force=False, profile=None, project=None,
+            environment=None):
+    _app(project, environment).rollout(tag, AbstractFactory._2b(force),
+                                       profile)
+
 
-    def deploy(self, tag):
-        self._prj.update(tag)
+def rollback(to=None, project=None, environment=None):
+    _app(project, environment).rollback(to)
 
 
-def deploy(tag):
-    App(env.wd_settings).deploy(tag)
+def reconcile(dry_run=True, project=None, environment=None):
+    _app(project, environment).reconcile(AbstractFactory._2b(dry_run))
@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    Artifact based deploy. Module is built once (git checkout at tag and
+    build hooks: virtualenv, collected static, ...) on the local machine or
+    on a build host and packed into tarball named by sha256 of its content.
+    Each target host receives the tarball (unless it has the same one
+    already) and unpacks it into the inactive app directory instead of git
+    update and build hooks. Other hooks (migrations, ...) run as usual.
+
+    In "rsync" mode the module is built on the local machine and its tree
+    is synced into the inactive app directory by rsync: only changed blocks
+    of files are sent, unchanged files are hard-linked from the active app
+    directory.
+
+    Note! Build host should have the same platform and python version as
+    target hosts.
+"""
+
+import fcntl
+import shlex
+import shutil
+from contextlib import contextmanager
+
+from fabric.context_managers import settings
+from fabric.network import normalize
+from fabric.state import env
+
+from . import transport
+from .base import DeployEntity, DeployError
+from .release import ReleaseSlots
+
+
+__author__ = 'y.gavenchuk'
+__all__ = ('Artifact', 'TreeArtifact', 'ArtifactBuilder', )
+
+
+class Artifact(DeployEntity):
+    """
+    Content-addressed tarball of module
+    """
+    KEEP = 3
+
+    __slots__ = ('_path', '_digest', '_built_path', )
+
+    def __init__(self, path, digest, built_path):
+        """
+        :param str path: local path of tarball
+        :param str digest: sha256 of tarball
+        :param str built_path: path of module on build host
+        """
+        super(Artifact, self).__init__()
+        self._path = path
+        self._digest = digest
+        self._built_path = built_path
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def digest(self):
+        return self._digest
+
+    @property
+    def name(self):
+        return '%s.tar.gz' % self._digest
+
+    @property
+    def built_path(self):
+        return self._built_path
+
+    def _remote_dir(self, module):
+        # module's path is "<project>/<app dir>/<container>"
+        project_dir = self._os.path.dirname(
+            self._os.path.dirname(module.path)
+        )
+        return self._os.path.join(project_dir, module.STATE_DIR_NAME,
+                                  'artifacts')
+
+    def ship(self, module):
+        """
+        Uploads tarball to the current host unless it's there already
+
+        :param ProjectModule module:
+        :return str: remote path of tarball
+        """
+        remote_dir = self._remote_dir(module)
+        remote = self._os.path.join(remote_dir, self.name)
+        if self._files.exists(remote):
+            return remote
+
+        self._api.run('mkdir -p -- "%s"' % remote_dir)
+        self._api.put(self._path, remote + '.tmp')
+        self._api.run('mv -- "{0}.tmp" "{0}"'.format(remote))
+
+        return remote
+
+    def _prune_cmd(self, remote_dir):
+        return 'ls -1t -- "{dir}" | grep "\\.tar\\.gz$" | ' \
+               'tail -n +{keep} | sed "s#^#{dir}/#" | ' \
+               'xargs -r -d "\\n" rm -f --'.format(dir=remote_dir,
+                                                  keep=self.KEEP + 1)
+
+    def install(self, module):
+        """
+        Replaces content of module's path by content of tarball
+
+        :param ProjectModule module:
+        """
+        remote = self.ship(module)
+        commands = [
+            'rm -rf -- "{path}.new" && mkdir -p -- "{path}.new"',
+            'tar -xzf "{archive}" -C "{path}.new"',
+            'rm -rf -- "{path}" && mv -- "{path}.new" "{path}"',
+        ]
+        commands = [c.format(path=module.path, archive=remote)
+                    for c in commands]
+        commands += module.relocate_cmds(self._built_path)
+        commands.append(self._prune_cmd(self._os.path.dirname(remote)))
+
+        self._api.run(' && '.join(commands))
+
+
+class TreeArtifact(DeployEntity):
+    """
+    Local tree of built module which is synced to hosts by rsync
+    """
+    __slots__ = ('_built_path', )
+
+    def __init__(self, built_path):
+        """
+        :param str built_path: local path of built module
+        """
+        super(TreeArtifact, self).__init__()
+        self._built_path = built_path
+
+    def __str__(self):
+        return 'rsync:%s' % self._built_path
+
+    @property
+    def built_path(self):
+        return self._built_path
+
+    @staticmethod
+    def _active_slot(module):
+        """
+        :return str|None: active slot unless module is installed there
+        """
+        # module's path is "<project>/<app dir><N>/<container>"
+        slot = module.path.rstrip('/')[:-len(module.container) - 1]
+        active = ReleaseSlots(ReleaseSlots.split(slot)[0]).active()
+        return active if active != slot else None
+
+    def _destination(self, module):
+        if not env.host_string:
+            return '%s/' % module.path
+
+        user, host, port = normalize(env.host_string)
+        return '%s@%s:%s/' % (user, host, module.path)
+
+    def _rsync_cmd(self, module, link_dest=None):
+        options = ['-az', '--delete',
+                   '--exclude=/%s/.git' % module.git.name,
+                   '--exclude=/%s' % module.STATE_DIR_NAME]
+        if link_dest:
+            options.append('--link-dest=%s' % link_dest)
+        if env.host_string:
+            options.append('-e "ssh -p %s"' % normalize(env.host_string)[2])
+
+        return 'rsync {options} {source} {destination}'.format(
+            options=' '.join(options),
+            source=shlex.quote(self._built_path + '/'),
+            destination=shlex.quote(self._destination(module))
+        )
+
+    def install(self, module):
+        """
+        Syncs module's path with built tree. Files which are the same in
+        the active app directory are hard-linked from there
+
+        :param ProjectModule module:
+        """
+        link_dest = self._active_slot(module)
+        if link_dest is not None:
+            link_dest = self._os.path.join(link_dest, module.container)
+            if not self._files.exists(link_dest):
+                link_dest = None
+
+        self._api.local(self._rsync_cmd(module, link_dest))
+
+        commands = module.relocate_cmds(self._built_path)
+        if commands:
+            self._api.run(' && '.join(commands))
+
+
+class ArtifactBuilder(DeployEntity):
+    DEFAULT_BUILD_DIR = '/var/tmp/web-deploy/build'
+    DEFAULT_CACHE_DIR = '~/.cache/web-deploy/artifacts'
+
+    MODE_TARBALL = 'tarball'
+    MODE_RSYNC = 'rsync'
+
+    __slots__ = ('_build_host', '_build_dir', '_cache_dir', '_mode', )
+
+    def __init__(self, build_host=None, build_dir=DEFAULT_BUILD_DIR,
+                 cache_dir=DEFAULT_CACHE_DIR, mode=MODE_TARBALL):
+        """
+        :param str|None build_host: host string of build host. None - build
+                                    on the local machine
+        :param str build_dir: directory of builds (on build host). Builds of
+                              modules are kept there between deploys
+        :param str cache_dir: local directory of tarballs
+        :param str mode: MODE_TARBALL or MODE_RSYNC (local build only)
+        """
+        super(ArtifactBuilder, self).__init__()
+        assert mode in {self.MODE_TARBALL, self.MODE_RSYNC}, \
+            'Unknown mode of artifact "%s"' % mode
+        assert mode != self.MODE_RSYNC or not build_host, \
+            'Module should be built on the local machine to be synced'
+
+        self._build_host = build_host
+        self._build_dir = build_dir
+        self._cache_dir = self._os.path.expanduser(cache_dir)
+        self._mode = mode
+
+    @property
+    def build_host(self):
+        return self._build_host
+
+    @property
+    def mode(self):
+        return self._mode
+
+    @contextmanager
+    def _on_build_host(self):
+        if self._build_host:
+            with settings(host_string=self._build_host):
+                yield
+            return
+
+        with transport.using(transport.LocalFabricTransport()):
+            yield
+
+    def _pack_cmd(self, module, archive):
+        """
+        Tarball is reproducible: files are sorted, their time and owners
+        are fixed. Repository and state of hooks aren't packed
+        """
+        return 'tar --sort=name --mtime=@0 --owner=0 --group=0 ' \
+               '--numeric-owner --exclude="./{repo}/.git" ' \
+               '--exclude="./{state}" -C "{path}" -cf - . | gzip -n > ' \
+               '"{archive}" && sha256sum "{archive}" | cut -c1-64'.format(
+                   repo=module.git.name, state=module.STATE_DIR_NAME,
+                   path=module.path, archive=archive
+               )
+
+    def _fetch(self, remote, local):
+        if self._build_host:
+            self._api.get(remote, local + '.tmp')
+            self._os.rename(local + '.tmp', local)
+        else:
+            shutil.move(remote, local)
+
+    def build(self, module, tag=None, force=False):
+        """
+        :param ProjectModule module:
+        :param str tag: git tag
+        :param bool force: run all build hooks
+        :return Artifact|TreeArtifact:
+        """
+        app_dir = self._os.path.dirname(module.path)
+        build_root = self._os.path.join(self._build_dir, module.name)
+        self._os.makedirs(self._cache_dir, exist_ok=True)
+
+        # hosts of parallel deploys share the cache
+        with open(self._os.path.join(self._cache_dir, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with self._on_build_host():
+                    module.path = build_root
+                    module.build(tag, force)
+                    if self._mode == self.MODE_RSYNC:
+                        return TreeArtifact(module.path)
+
+                    archive = build_root + '.tar.gz.tmp'
+                    digest = str(self._api.run(
+                        self._pack_cmd(module, archive)
+                    )).strip()
+                    if len(digest) != 64:
+                        raise DeployError(
+                            'Artifact of "%s" is not built' % module.name
+                        )
+
+                    local = self._os.path.join(self._cache_dir,
+                                               '%s.tar.gz' % digest)
+                    if self._os.path.exists(local):
+                        self._api.run('rm -f -- "%s"' % archive)
+                    else:
+                        self._fetch(archive, local)
+
+                    return Artifact(local, digest, module.path)
+            finally:
+                module.path = app_dir
@@ -21,13 +21,64 @@ from fabric.contrib import files
 
 
 __author__ = 'y.gavenchuk'
-__all__ = ('DeployError', 'DeployEntity', 'LocatedDeployEntity', )
+__all__ = ('DeployError', 'DeployEntity', 'LocatedDeployEntity',
+           'FabricSession', 'run_sync', )
 
 
 class DeployError(Exception):
     pass
 
 
+def run_sync(coro):
+    """
+    Runs coroutine of deploy operation with FabricSession. Such coroutine
+    never suspends (fabric is blocking), so no event loop is needed
+
+    :return: value returned by coroutine
+    """
+    try:
+        coro.send(None)
+    except StopIteration as e:
+        return e.value
+
+    coro.close()
+    raise DeployError('Coroutine is suspended: it needs event loop')
+
+
+class FabricSession(object):
+    """
+    Session of sync API. Deploy operations are coroutines which talk to the
+    host by session (see `web_deploy.aio.Session`); this one executes their
+    commands by fabric (or by installed transport) immediately
+    """
+    __slots__ = ('_api', '_files', )
+
+    def __init__(self, api, files=None):
+        self._api = api
+        self._files = files
+
+    async def run(self, command, **kwargs):
+        return self._api.run(command, **kwargs)
+
+    async def sudo(self, command, **kwargs):
+        return self._api.sudo(command, **kwargs)
+
+    async def exists(self, path):
+        return self._files.exists(path)
+
+    async def is_link(self, path):
+        return self._files.is_link(path)
+
+    async def call(self, func, *args):
+        return func(*args)
+
+    def cd(self, path):
+        return self._api.cd(path)
+
+    def prefix(self, command):
+        return self._api.prefix(command)
+
+
 class DeployEntity(object):
     __slots__ = ()
 
@@ -36,6 +87,12 @@ class DeployEntity(object):
     _cm = context_managers
     _os = os
 
+    def _session(self):
+        """
+        :return FabricSession: session of sync API
+        """
+        return FabricSession(self._api, self._files)
+
 
 class LocatedDeployEntity(DeployEntity):
     __slots__ = ('_path', )
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from .base import DeployEntity, DeployError, FabricSession, run_sync
+
+
+__author__ = 'y.gavenchuk'
+__all__ = ('CommandBatch', 'CommandResult', )
+
+
+class CommandResult(object):
+    __slots__ = ('_command', '_sudo', '_status', )
+
+    def __init__(self, command, sudo=False, status=None):
+        """
+        :param str command:
+        :param bool sudo:
+        :param int|None status: exit status of command. None means that
+                                command wasn't executed (or status is unknown)
+        """
+        self._command = command
+        self._sudo = sudo
+        self._status = status
+
+    def __str__(self):
+        return self.command
+
+    @property
+    def command(self):
+        return self._command
+
+    @property
+    def sudo(self):
+        return self._sudo
+
+    @property
+    def status(self):
+        return self._status
+
+    @property
+    def failed(self):
+        return self._status is not None and self._status != 0
+
+
+class CommandBatch(DeployEntity):
+    """
+    Collects remote commands and executes them as one shell script per
+    privilege level (run vs sudo), i.e. one round trip instead of one per
+    command. Consecutive commands with the same privilege level are sent
+    together, so the order of execution is preserved.
+    """
+    STATUS_MARKER = '__wd_exit__'
+
+    __slots__ = ('_queue', '_results', '_executor', )
+
+    def __init__(self, api=None):
+        """
+        :param api: object with fabric-like `run` and `sudo`. Default is
+                    the one of DeployEntity
+        """
+        super(CommandBatch, self).__init__()
+        self._queue = []
+        self._results = []
+        self._executor = api or self._api
+
+    def __len__(self):
+        return len(self._queue)
+
+    @property
+    def results(self):
+        """
+        :return list[CommandResult]: results of all flushed commands
+        """
+        return list(self._results)
+
+    def add(self, command, sudo=False):
+        self._queue.append((command, bool(sudo)))
+
+    def _script(self, commands):
+        """
+        Builds script which reports exit status of each command and stops
+        on the first failed one
+
+        :param list[str] commands:
+        :return str:
+        """
+        lines = []
+        for idx, cmd in enumerate(commands):
+            lines.append(
+                '{cmd}; _wd_rc=$?; echo "{marker}:{idx}:$_wd_rc"; '
+                '[ $_wd_rc -eq 0 ] || exit $_wd_rc'.format(
+                    cmd=cmd,
+                    marker=self.STATUS_MARKER,
+                    idx=idx
+                )
+            )
+
+        return '\n'.join(lines)
+
+    def _parse(self, output, commands, sudo):
+        statuses = {}
+        prefix = self.STATUS_MARKER + ':'
+        for line in str(output).splitlines():
+            line = line.strip()
+            if not line.startswith(prefix):
+                continue
+
+            try:
+                idx, status = line[len(prefix):].split(':', 1)
+                statuses[int(idx)] = int(status)
+            except ValueError:
+                continue
+
+        return [
+            CommandResult(cmd, sudo, statuses.get(idx))
+            for idx, cmd in enumerate(commands)
+        ]
+
+    def _groups(self):
+        group, sudo = [], None
+        for cmd, cmd_sudo in self._queue:
+            if group and cmd_sudo != sudo:
+                yield sudo, group
+                group = []
+
+            group.append(cmd)
+            sudo = cmd_sudo
+
+        if group:
+            yield sudo, group
+
+    async def _execute(self, session, commands, sudo):
+        script = self._script(commands)
+        if sudo:
+            output = await session.sudo(script, warn_only=True)
+        else:
+            output = await session.run(script, warn_only=True)
+
+        return self._parse(output, commands, sudo)
+
+    def flush(self):
+        """
+        Executes all queued commands
+
+        :return list[CommandResult]: results of flushed commands
+        :raise DeployError: if any of commands has failed
+        """
+        return run_sync(self.flush_async(FabricSession(self._executor)))
+
+    async def flush_async(self, session):
+        """
+        The same as `flush` but commands are sent by session
+
+        :param session: FabricSession or web_deploy.aio.Session
+        """
+        groups = list(self._groups())
+        self._queue = []
+
+        flushed = []
+        for sudo, commands in groups:
+            results = await self._execute(session, commands, sudo)
+            flushed += results
+
+            failed = [r for r in results if r.failed]
+            if failed:
+                self._results += flushed
+                raise DeployError(
+                    'Command "%s" failed with exit status %d' % (
+                        failed[0].command, failed[0].status
+                    )
+                )
+
+        self._results += flushed
+        return flushed
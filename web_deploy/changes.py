@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    Detection of changes of post update hooks' inputs. Hook declares its
+    inputs with `watch` decorator. Digest of inputs is stored on the remote
+    host after successful run of the hook, so the hook may be skipped next
+    time if its inputs are unchanged.
+"""
+
+from six import string_types
+
+from .base import DeployEntity
+
+
+__author__ = 'y.gavenchuk'
+__all__ = ('SCOPE_SLOT', 'SCOPE_HOST', 'watch', 'ChangeDetector', )
+
+
+# state belongs to app directory (e.g. virtualenv is installed into it)
+SCOPE_SLOT = 'slot'
+# state is shared by all app directories (system packages, database)
+SCOPE_HOST = 'host'
+
+
+def watch(inputs, scope=SCOPE_SLOT):
+    """
+    Declares inputs of post update hook
+
+    :param callable inputs: receives project module and returns list of
+                            inputs. Each input is a path (file or directory)
+                            or tuple (directory, pattern of `find -path`).
+                            Paths are relative to module's path
+    :param str scope: SCOPE_SLOT or SCOPE_HOST
+    """
+    assert scope in {SCOPE_SLOT, SCOPE_HOST}, 'Unknown scope "%s"' % scope
+
+    def decorator(func):
+        func.watch = (inputs, scope)
+        return func
+
+    return decorator
+
+
+class ChangeDetector(DeployEntity):
+    """
+    Computes digests of inputs and keeps digests of the last successful run
+    in `state_dir` (one file per key)
+    """
+    __slots__ = ('_root', '_state_dir', )
+
+    def __init__(self, root, state_dir):
+        """
+        :param str root: base directory of relative inputs
+        :param str state_dir:
+        """
+        super(ChangeDetector, self).__init__()
+        self._root = root
+        self._state_dir = state_dir
+
+    @property
+    def state_dir(self):
+        return self._state_dir
+
+    def _input_cmd(self, item):
+        if isinstance(item, string_types):
+            root, find_args = self._root, '"./%s" -type f' % item
+        else:
+            root = self._os.path.join(self._root, item[0])
+            find_args = '. -type f -path "%s"' % item[1]
+
+        return '(cd "{root}" 2>/dev/null && ' \
+               'find {find_args} 2>/dev/null | LC_ALL=C sort | ' \
+               'xargs -r -d "\\n" sha1sum)'.format(
+                   root=root, find_args=find_args
+               )
+
+    def _digest_cmd(self, key, items):
+        return 'echo "digest {key} $({{ {inputs}; }} | sha1sum | ' \
+               'cut -c1-40)"'.format(
+                   key=key,
+                   inputs='; '.join(self._input_cmd(i) for i in items) or ':'
+               )
+
+    def _state_cmd(self):
+        return 'for f in "{dir}"/*; do [ -f "$f" ] && ' \
+               'echo "state ${{f##*/}} $(cat "$f")"; done'.format(
+                   dir=self._state_dir
+               )
+
+    def collect(self, inputs):
+        """
+        Computes digests and reads saved state by one remote command
+
+        :param dict inputs: key => list of inputs
+        :return tuple(dict, dict): current digests and saved state
+        """
+        script = '; '.join(
+            [self._digest_cmd(k, v) for k, v in sorted(inputs.items())] +
+            [self._state_cmd()]
+        )
+
+        digests, state = {}, {}
+        output = self._api.run(script, quiet=True)
+        for line in str(output).splitlines():
+            parts = line.strip().split(' ')
+            if len(parts) != 3:
+                continue
+
+            kind, key, value = parts
+            if kind == 'digest':
+                digests[key] = value
+            elif kind == 'state':
+                state[key] = value
+
+        return digests, state
+
+    def record(self, key, digest):
+        self._api.run('mkdir -p -- "{dir}" && echo "{digest}" > '
+                      '"{dir}/{key}"'.format(dir=self._state_dir, key=key,
+                                             digest=digest))
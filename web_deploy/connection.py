@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    Management of SSH connections during deploy. Fabric talks to hosts by
+    paramiko, so one SSH session per host is kept open (with keepalive) and
+    all of remote commands are sent as channels of it. Connections can't be
+    shared with forked workers: each worker opens its own session, but
+    limits of simultaneous commands per host are common for all of them.
+"""
+
+import getpass
+import multiprocessing
+from contextlib import contextmanager
+
+from fabric import state
+from fabric.network import disconnect_all, normalize_to_string
+
+from .transport import FabricTransport, using
+
+
+__author__ = 'y.gavenchuk'
+__all__ = ('ConnectionManager', 'ManagedTransport', 'current', )
+
+
+_active = None
+
+
+def current():
+    """
+    :return ConnectionManager|None: manager of running deploy
+    """
+    return _active
+
+
+class ConnectionManager(object):
+    __slots__ = ('_keepalive', '_timeout', '_max_sessions', '_sudo_password',
+                 '_prompt_sudo', '_semaphores', '_saved_env', '_using', )
+
+    def __init__(self, keepalive=30, timeout=None, max_sessions=None,
+                 sudo_password=None, prompt_sudo=False):
+        """
+        :param int keepalive: interval of keepalive packets (seconds)
+        :param int|None timeout: timeout of connection (seconds)
+        :param int|None max_sessions: max number of simultaneous commands
+                                      per host (None - no limit)
+        :param str|None sudo_password:
+        :param bool prompt_sudo: ask sudo password once per deploy
+        """
+        self._keepalive = int(keepalive)
+        self._timeout = int(timeout) if timeout else None
+        self._max_sessions = int(max_sessions) if max_sessions else None
+        assert self._max_sessions is None or self._max_sessions > 0, \
+            "Sessions count should be positive"
+
+        self._sudo_password = sudo_password
+        self._prompt_sudo = prompt_sudo
+        self._semaphores = {}
+        self._saved_env = None
+        self._using = None
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.uninstall()
+
+    @property
+    def max_sessions(self):
+        return self._max_sessions
+
+    def install(self, hosts=()):
+        """
+        Configures fabric and installs ManagedTransport
+
+        :param list[str] hosts: hosts which will be used by forked workers
+        """
+        global _active
+        assert _active is None, 'Connection manager is installed already'
+
+        self._saved_env = {
+            k: state.env.get(k) for k in ('keepalive', 'timeout')
+        }
+        state.env.keepalive = self._keepalive
+        if self._timeout:
+            state.env.timeout = self._timeout
+
+        if self._prompt_sudo and not self._sudo_password:
+            self._sudo_password = getpass.getpass('Sudo password: ')
+
+        for host in list(hosts) + [state.env.host_string]:
+            if host:
+                self.prepare(host)
+
+        self._using = using(ManagedTransport(self))
+        self._using.__enter__()
+        _active = self
+
+    def uninstall(self):
+        global _active
+        if _active is not self:
+            return
+
+        self._using.__exit__(None, None, None)
+        state.env.update(self._saved_env)
+        disconnect_all()
+        _active = None
+
+    def prepare(self, host):
+        """
+        Registers host: its sudo password and limit of sessions
+
+        :param str host: host string
+        """
+        key = normalize_to_string(host)
+        if self._sudo_password:
+            state.env.sudo_passwords[key] = self._sudo_password
+
+        if self._max_sessions and key not in self._semaphores:
+            self._semaphores[key] = multiprocessing.BoundedSemaphore(
+                self._max_sessions
+            )
+
+    def connection(self, host=None):
+        """
+        :param str|None host: default is current host
+        :return paramiko.SSHClient: opened connection. It's re-opened if it
+                                    was dropped
+        """
+        key = normalize_to_string(host or state.env.host_string)
+        client = state.connections.get(key)
+        transport = client.get_transport() if client is not None else None
+        if transport is None or not transport.is_active():
+            state.connections.connect(key)
+
+        return state.connections[key]
+
+    @contextmanager
+    def session(self, host=None):
+        """
+        Holds one of `max_sessions` slots of host and ensures that
+        connection is alive
+        """
+        host = host or state.env.host_string
+        if not host:
+            # local execution
+            yield
+            return
+
+        self.prepare(host)
+        semaphore = self._semaphores.get(normalize_to_string(host))
+        if semaphore is not None:
+            semaphore.acquire()
+
+        try:
+            self.connection(host)
+            yield
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+
+
+class ManagedTransport(FabricTransport):
+    """
+    Fabric transport which sends commands through ConnectionManager
+    """
+    def __init__(self, manager):
+        """
+        :param ConnectionManager manager:
+        """
+        self._manager = manager
+
+    def run(self, command, **kwargs):
+        with self._manager.session():
+            return super(ManagedTransport, self).run(command, **kwargs)
+
+    def sudo(self, command, **kwargs):
+        with self._manager.session():
+            return super(ManagedTransport, self).sudo(command, **kwargs)
+
+    def put(self, local_path=None, remote_path=None, **kwargs):
+        with self._manager.session():
+            return super(ManagedTransport, self).put(
+                local_path, remote_path, **kwargs
+            )
+
+    def get(self, remote_path, local_path=None, **kwargs):
+        with self._manager.session():
+            return super(ManagedTransport, self).get(
+                remote_path, local_path, **kwargs
+            )
+
+    def exists(self, path, use_sudo=False, verbose=False):
+        with self._manager.session():
+            return super(ManagedTransport, self).exists(
+                path, use_sudo, verbose
+            )
+
+    def is_link(self, path, use_sudo=False, verbose=False):
+        with self._manager.session():
+            return super(ManagedTransport, self).is_link(
+                path, use_sudo, verbose
+            )
@@ -17,18 +17,125 @@
 from abc import ABCMeta, abstractmethod
 
 from fabric import api
-from six import add_metaclass
+from six import add_metaclass, string_types
+from six.moves.urllib.parse import urlparse
+
+from .base import DeployError, FabricSession, run_sync
 
 
 __author__ = 'y.gavenchuk'
-__all__ = ('Daemon', 'SimpleService', 'Nginx', 'Uwsgi', 'Supervisor', )
+__all__ = ('Daemon', 'SimpleService', 'Nginx', 'Uwsgi', 'Supervisor',
+           'Probe', 'TcpProbe', 'HttpProbe', 'UnixSocketProbe', )
+
+
+@add_metaclass(ABCMeta)
+class Probe(object):
+    """
+    Readiness check of daemon. It's performed on the remote host and polls
+    the daemon until it answers or the timeout expires
+    """
+    POLL_INTERVAL = 1
+
+    @abstractmethod
+    def _check(self):
+        """
+        :return str: shell command which succeeds if daemon is ready
+        """
+
+    def command(self, timeout):
+        return "timeout {timeout} bash -c 'until {check}; " \
+               "do sleep {interval}; done'".format(
+                   timeout=int(timeout),
+                   check=self._check(),
+                   interval=self.POLL_INTERVAL
+               )
+
+    @staticmethod
+    def from_uri(uri):
+        """
+        :param str uri: "tcp://host:port", "http(s)://..." or
+                        "unix:///path/to/socket"
+        :return Probe:
+        """
+        parsed = urlparse(uri)
+        if parsed.scheme == 'tcp':
+            return TcpProbe(parsed.hostname, parsed.port)
+
+        if parsed.scheme in {'http', 'https'}:
+            return HttpProbe(uri)
+
+        if parsed.scheme == 'unix':
+            return UnixSocketProbe(parsed.path)
+
+        raise DeployError('Unsupported probe "%s"' % uri)
+
+
+class TcpProbe(Probe):
+    def __init__(self, host, port):
+        self._host = host or 'localhost'
+        self._port = int(port)
+
+    def __str__(self):
+        return 'tcp://%s:%d' % (self._host, self._port)
+
+    def _check(self):
+        return '(echo > /dev/tcp/%s/%d) 2>/dev/null' % (self._host,
+                                                        self._port)
+
+
+class HttpProbe(Probe):
+    def __init__(self, url):
+        self._url = url
+
+    def __str__(self):
+        return self._url
+
+    def _check(self):
+        return 'curl -fsS -o /dev/null --max-time 5 "%s"' % self._url
+
+
+class UnixSocketProbe(Probe):
+    def __init__(self, path):
+        self._path = path
+
+    def __str__(self):
+        return 'unix://' + self._path
+
+    def _check(self):
+        return 'python3 -c "import socket, sys; ' \
+               's = socket.socket(socket.AF_UNIX); s.connect(sys.argv[1])" ' \
+               '"%s" 2>/dev/null' % self._path
 
 
 @add_metaclass(ABCMeta)
 class Daemon(object):
+    DEFAULT_PROBE_TIMEOUT = 30
+
     _name = None
     _api = api
 
+    def __init__(self, *, graceful=False, probe=None,
+                 probe_timeout=DEFAULT_PROBE_TIMEOUT, after=None):
+        """
+        :param bool graceful: reload daemon instead of restart
+        :param Probe|str probe: readiness check (instance or its URI)
+        :param int probe_timeout: seconds to wait for readiness
+        :param list[str] after: names of daemons which should be restarted
+                                before this one (concurrent restart only)
+        """
+        cls = type(self)
+        if cls.restart is Daemon.restart and \
+                cls.restart_async is Daemon.restart_async:
+            raise TypeError("Can't instantiate daemon %s without restart "
+                            "method" % cls.__name__)
+
+        self._graceful = graceful
+        if isinstance(probe, string_types):
+            probe = Probe.from_uri(probe)
+        self._probe = probe
+        self._probe_timeout = int(probe_timeout)
+        self._after = list(after or [])
+
     def __str__(self):
         return self.name
 
@@ -36,35 +143,117 @@ class Daemon(object):
     def name(self):
         return str(self._name)
 
-    @abstractmethod
+    @property
+    def after(self):
+        return list(self._after)
+
+    def _session(self):
+        return FabricSession(self._api)
+
     def restart(self):
-        pass
+        """
+        Overridable hook (blocking one, commands are sent by `_api`).
+        By default `restart_async` is run
+        """
+        run_sync(self.restart_async(self._session()))
+
+    def reload(self):
+        run_sync(self.reload_async(self._session()))
+
+    def wait_ready(self):
+        run_sync(self.wait_ready_async(self._session()))
+
+    def apply(self):
+        """
+        Restarts (or reloads) daemon and waits until it's ready
+        """
+        run_sync(self.apply_async(self._session()))
+
+    async def restart_async(self, session):
+        """
+        By default blocking `restart` is called by session. Daemon should
+        override one of them
+
+        :param session: FabricSession or web_deploy.aio.Session
+        """
+        await session.call(self.restart)
+
+    async def reload_async(self, session):
+        """
+        Graceful reload. By default it's the same as restart
+        """
+        await self.restart_async(session)
+
+    async def wait_ready_async(self, session):
+        if self._probe is None:
+            return
+
+        result = await session.run(
+            self._probe.command(self._probe_timeout), warn_only=True
+        )
+        if result.failed:
+            raise DeployError('Daemon "%s" is not ready after %ds (%s)' % (
+                self.name, self._probe_timeout, self._probe
+            ))
+
+    async def apply_async(self, session):
+        if self._graceful:
+            await self.reload_async(session)
+        else:
+            await self.restart_async(session)
+
+        await self.wait_ready_async(session)
 
 
 class SimpleService(Daemon):
-    def restart(self):
-        self._api.sudo('service %s restart' % self.name)
+    async def restart_async(self, session):
+        await session.sudo('service %s restart' % self.name)
+
+    async def reload_async(self, session):
+        await session.sudo('service %s reload' % self.name)
 
 
 class Nginx(SimpleService):
     _name = 'nginx'
 
+    async def reload_async(self, session):
+        await session.sudo('nginx -t && nginx -s reload')
+
 
 class Uwsgi(SimpleService):
     _name = 'uwsgi'
 
+    def __init__(self, *, touch_reload=None, master_fifo=None, **kwargs):
+        """
+        :param str touch_reload: file from "touch-chain-reload" (or
+                                 "touch-reload") option of uwsgi
+        :param str master_fifo: master FIFO of uwsgi
+        """
+        super(Uwsgi, self).__init__(**kwargs)
+        self._touch_reload = touch_reload
+        self._master_fifo = master_fifo
+
+    async def reload_async(self, session):
+        if self._master_fifo:
+            # "c" - chain reload of workers
+            await session.sudo('echo c > "%s"' % self._master_fifo)
+        elif self._touch_reload:
+            await session.sudo('touch -- "%s"' % self._touch_reload)
+        else:
+            await super(Uwsgi, self).reload_async(session)
+
 
 class Supervisor(Daemon):
     _name = 'supervisor'
     _service = 'all'
 
-    def __init__(self, service=None):
-        super(Supervisor, self).__init__()
+    def __init__(self, service=None, **kwargs):
+        super(Supervisor, self).__init__(**kwargs)
         if service:
             self._service = service
 
-    def restart(self):
-        self._api.sudo('supervisorctl reread')
-        self._api.sudo(
+    async def restart_async(self, session):
+        await session.sudo('supervisorctl reread')
+        await session.sudo(
             'supervisorctl restart %s' % self._service
         )
@@ -19,19 +19,46 @@ from datetime import datetime
 
 from six import add_metaclass
 
-from .base import LocatedDeployEntity
+from .base import LocatedDeployEntity, DeployError
+from .retention import Backup, RetentionPolicy
 
 __author__ = 'y.gavenchuk'
 
+
 @add_metaclass(ABCMeta)
 class DataBase(LocatedDeployEntity):
     DEFAULT_BACKUP_COUNT = 5
 
+    # name => (command, extension of file)
+    COMPRESSORS = {
+        'gzip': ('gzip', 'gz'),
+        'pigz': ('pigz', 'gz'),
+        'zstd': ('zstd -q -T0', 'zst'),
+    }
+
+    # list of backups, see retention.Backup
+    MANIFEST = '.manifest'
+
+    # files of asynchronous backup job
+    JOB_RUNNING = '.backup.running'
+    JOB_STATUS = '.backup.status'
+    JOB_LOG = '.backup.log'
+
     __slots__ = ('_host', '_user', '_port', '_db_name', '_password',
-                 '_bkp_count', )
+                 '_bkp_count', '_compressor', '_level', '_async',
+                 '_retention', )
 
     def __init__(self, path, name, user, password, host='localhost', port='',
-                 backup_count=DEFAULT_BACKUP_COUNT):
+                 backup_count=DEFAULT_BACKUP_COUNT, compressor='gzip',
+                 level=None, async_backup=False, retention=None):
+        """
+        :param str compressor: "gzip", "pigz" or "zstd"
+        :param int level: compression level
+        :param bool async_backup: backup may be started in background by
+                                  `start_backup` and joined later
+        :param RetentionPolicy|None retention: default policy keeps
+                                               `backup_count` newest backups
+        """
         super(DataBase, self).__init__(path)
         self._host = host
         self._user = user
@@ -41,7 +68,14 @@ class DataBase(LocatedDeployEntity):
         self._bkp_count = int(backup_count)
         assert self._bkp_count > 1, "Backups count can't be less than 2"
 
-    def _rotate_backups(self):
+        assert compressor in self.COMPRESSORS, \
+            'Unknown compressor "%s"' % compressor
+        self._compressor = compressor
+        self._level = int(level) if level else None
+        self._async = bool(async_backup)
+        self._retention = retention or RetentionPolicy(self._bkp_count)
+
+    def _rotate_legacy(self):
         """
         Keep no more than `backup_count` dumps
         """
@@ -57,34 +91,273 @@ class DataBase(LocatedDeployEntity):
         with self._api.cd(self.path):
             self._api.run(cmd)
 
+    def read_manifest(self):
+        """
+        :return list[Backup]:
+        """
+        output = self._api.run(
+            'cat "%s" 2>/dev/null' % self._os.path.join(self.path,
+                                                       self.MANIFEST),
+            quiet=True
+        )
+
+        backups = (Backup.from_line(l) for l in str(output).splitlines())
+        return [b for b in backups if b is not None]
+
+    def _rotate_backups(self):
+        """
+        Removes backups according to retention policy. Dumps directory is
+        scanned only if there is no manifest yet
+        """
+        backups = self.read_manifest()
+        if not backups:
+            self._rotate_legacy()
+            return
+
+        keep, remove = self._retention.select(backups)
+        if not remove:
+            return
+
+        cmd = 'rm -f -- {files} && printf "%s\\n" {lines} > {manifest}.tmp ' \
+              '&& mv {manifest}.tmp {manifest}'.format(
+                  files=' '.join('"%s"' % b.name for b in remove),
+                  lines=' '.join('"%s"' % b.to_line() for b in reversed(keep)),
+                  manifest=self.MANIFEST
+              )
+        with self._api.cd(self.path):
+            self._api.run(cmd)
+
+    def _compress_cmd(self):
+        """
+        :return tuple(str, str): command of compressor and file extension
+        """
+        cmd, ext = self.COMPRESSORS[self._compressor]
+        if self._level:
+            cmd += ' -%d' % self._level
+
+        return cmd, ext
+
+    def _dump_name(self, partial=False):
+        return 'dump_sql_%s_%s.%s' % (
+            datetime.now().strftime('%Y_%m_%d_%H_%M_%S'),
+            'tables' if partial else 'db', self._dump_ext()
+        )
+
+    def _store_cmd(self, dump_file, compress=True):
+        """
+        :param bool compress: False - stream is compressed already
+        :return str: tail of pipeline which compresses stream to `dump_file`
+                     and computes its checksum on the fly
+        """
+        return '{compress}| tee "{file}" | sha1sum > "{file}.sha1"'.format(
+            compress='|%s ' % self._compress_cmd()[0] if compress else '',
+            file=dump_file
+        )
+
+    @abstractmethod
+    def _dump_ext(self):
+        """
+        :return str: extension of backup file
+        """
+
     @abstractmethod
-    def _do_backup(self):
-        pass
+    def _backup_cmd(self, dump_file, tables=None):
+        """
+        :param str dump_file: name of backup file. Its pipeline should be
+                              finished by `_store_cmd(dump_file)`
+        :param list[str]|None tables: dump these tables only. None - the
+                                      whole database
+        :return str: shell command which creates backup in current directory
+        """
+
+    def _job_cmd(self, tables=None):
+        """
+        :param list[str]|None tables: see `_backup_cmd`
+        :return str: backup command which registers new backup in manifest.
+                     Backups created before manifest are registered first.
+                     Partial backup is removed on failure
+        """
+        dump_file = self._dump_name(tables is not None)
+        return 'set -o pipefail; ' \
+               '[ -f {manifest} ] || for f in dump_sql_*; do [ -f "$f" ] && ' \
+               'echo "$f $(stat -c %Y "$f") 0 $(stat -c %s "$f") -"; ' \
+               'done > {manifest}; ' \
+               '_wd_start=$(date +%s); {backup} && echo "{file} $_wd_start ' \
+               '$(( $(date +%s) - _wd_start )) $(stat -c %s "{file}") ' \
+               '$(cut -c1-40 "{file}.sha1")" >> {manifest} && ' \
+               'rm -f "{file}.sha1" || ' \
+               '{{ _wd_rc=$?; rm -rf "{file}"*; exit $_wd_rc; }}'.format(
+                   manifest=self.MANIFEST,
+                   backup=self._backup_cmd(dump_file, tables),
+                   file=dump_file
+               )
+
+    def _env(self):
+        """
+        :return dict: environment variables of backup command
+        """
+        return {}
+
+    def _do_backup(self, tables=None):
+        with self._api.cd(self.path):
+            with self._cm.shell_env(**self._env()):
+                self._api.run(self._job_cmd(tables))
 
     @property
     def backup_count(self):
         return self._bkp_count
 
-    def create_backup(self):
-        self._do_backup()
+    @property
+    def is_async(self):
+        return self._async
+
+    def start_backup(self):
+        """
+        Starts backup in background on the remote host. The job survives
+        disconnection; its state is kept in files of dumps directory, so it
+        may be joined from any process
+        """
+        job = "{cmd}; echo $? > {status}.tmp && mv {status}.tmp {status}; " \
+              "rm -f {running}".format(cmd=self._job_cmd(),
+                                       status=self.JOB_STATUS,
+                                       running=self.JOB_RUNNING)
+
+        with self._api.cd(self.path):
+            with self._cm.shell_env(**self._env()):
+                self._api.run(
+                    "rm -f {status} && touch {running} && "
+                    "(nohup setsid bash -c '{job}' > {log} 2>&1 "
+                    "< /dev/null &)".format(job=job.replace("'", "'\\''"),
+                                            status=self.JOB_STATUS,
+                                            running=self.JOB_RUNNING,
+                                            log=self.JOB_LOG),
+                    pty=False
+                )
+
+    def join_backup(self):
+        """
+        Waits for background backup (if any) and rotates backups
+
+        :return bool: True if there was background backup
+        :raise DeployError: if background backup has failed
+        """
+        with self._api.cd(self.path):
+            output = self._api.run(
+                "if [ -f {running} ] || [ -f {status} ]; then "
+                "while [ ! -f {status} ]; do sleep 1; done; "
+                "echo \"backup-status $(cat {status})\"; rm -f {status}; "
+                "fi".format(running=self.JOB_RUNNING,
+                            status=self.JOB_STATUS)
+            )
+
+        statuses = [
+            line.split()[-1] for line in str(output).splitlines()
+            if line.startswith('backup-status ')
+        ]
+        if not statuses:
+            return False
+
+        if statuses[-1] != '0':
+            raise DeployError(
+                'Backup of "%s" failed with exit status %s. See %s' % (
+                    self._db_name, statuses[-1],
+                    self._os.path.join(self.path, self.JOB_LOG)
+                )
+            )
+
+        self._rotate_backups()
+        return True
+
+    def create_backup(self, tables=None):
+        """
+        :param list[str]|None tables: dump these tables only (e.g. tables
+                                      changed by pending migrations). None -
+                                      the whole database. Background backup
+                                      is always full
+        """
+        if self._async and self.join_backup():
+            return
+
+        self._do_backup(tables)
         self._rotate_backups()
 
 
 class Postgres(DataBase):
-    __slots__ = ()
-
-    def _do_backup(self):
-        now = datetime.now().strftime('%Y_%m_%d_%H_%M_%S')
-        dump_file = 'dump_sql_%s' % now
-        cmd_tpl = 'pg_dump --clean -h {host} -U {user} {dbname} ' \
-                  '|gzip > {file}_db.sq.gz'
-        cmd = cmd_tpl.format(
-            host=self._host,
-            user=self._user,
+    FORMAT_PLAIN = 'plain'
+    FORMAT_DIRECTORY = 'directory'
+
+    # compressor => compression of pg_dump's directory format ("zstd" needs
+    # PostgreSQL 16+)
+    DIRECTORY_COMPRESSION = {'gzip': 'gzip', 'pigz': 'gzip', 'zstd': 'zstd'}
+
+    __slots__ = ('_format', '_jobs', )
+
+    def __init__(self, path, name, user, password, format=FORMAT_PLAIN,
+                 jobs=None, **kwargs):
+        """
+        :param str format: "plain" - SQL script is streamed to compressor;
+                           "directory" - dump by `jobs` parallel workers
+                           which compress tables themselves, archived to
+                           tar afterwards
+        :param int jobs: number of parallel jobs of pg_dump ("directory"
+                         format only)
+        """
+        super(Postgres, self).__init__(path, name, user, password, **kwargs)
+        assert format in {self.FORMAT_PLAIN, self.FORMAT_DIRECTORY}, \
+            'Unknown format "%s"' % format
+
+        self._format = format
+        self._jobs = int(jobs) if jobs else None
+
+    def _env(self):
+        return {'PGPASSWORD': self._password}
+
+    def _connection_args(self):
+        args = '-h {host} -U {user}'.format(host=self._host, user=self._user)
+        if self._port:
+            args += ' -p %s' % self._port
+
+        return args
+
+    def _dump_ext(self):
+        if self._format == self.FORMAT_PLAIN:
+            return 'sq.' + self._compress_cmd()[1]
+
+        return 'tar'
+
+    def _compression_arg(self):
+        """
+        :return str: compression of directory format
+        """
+        method = self.DIRECTORY_COMPRESSION[self._compressor]
+        if method == 'gzip':
+            # plain level is understood by any version of pg_dump
+            return '-Z %d' % (self._level or 6)
+
+        return '-Z %s:%d' % (method, self._level) if self._level else \
+            '-Z %s' % method
+
+    def _backup_cmd(self, dump_file, tables=None):
+        plain = self._format == self.FORMAT_PLAIN
+        if plain:
+            cmd_tpl = 'pg_dump --clean {conn} {dbname} {store}'
+        else:
+            # tables are compressed by workers of pg_dump: tar only joins
+            # them. Dump directory is removed even if backup failed
+            cmd_tpl = '{{ pg_dump --clean -Fd {compression} {jobs}{conn} ' \
+                      '-f "{file}.d" {dbname} && ' \
+                      'tar -cf - -C "{file}.d" . {store}; }}; ' \
+                      '_wd_rc=$?; rm -rf "{file}.d"; (exit $_wd_rc)'
+
+        conn = self._connection_args()
+        if tables:
+            conn += ''.join(' -t \'"%s"\'' % t for t in tables)
+
+        return cmd_tpl.format(
+            conn=conn,
+            jobs='-j %d ' % self._jobs if self._jobs else '',
             dbname=self._db_name,
-            file=dump_file
+            store=self._store_cmd(dump_file, compress=plain),
+            file=dump_file,
+            compression='' if plain else self._compression_arg()
         )
-
-        with self._api.cd(self.path):
-            with self._cm.shell_env(PGPASSWORD=self._password):
-                self._api.run(cmd)
@@ -14,93 +14,318 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
+import threading
 from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
 
+from fabric.api import env
 from six import add_metaclass
 
+from .artifact import ArtifactBuilder
+from .base import DeployError
+from .connection import ConnectionManager
 from .system import System
 from . import daemon, db, post_update_hooks
 from .vcs import Git
-from .python import VirtualEnv, DjangoProjectModule
+from .python import VirtualEnv, Wheelhouse, DjangoProjectModule
 from .settings import SettingsXML
 from .project import Project
+from .retention import RetentionPolicy
+from .rollout import Rollout
+from .static import StaticCollector
+from .migrations import MigrationPlanner
 
 
 __author__ = 'y.gavenchuk'
 __all__ = (
     'DaemonFactory', 'SystemFactory', 'GitFactory', 'DbFactory',
-    'VirtualEnvFactory', 'ProjectModuleFactory', 'ProjectFactory',
+    'VirtualEnvFactory', 'WheelhouseFactory', 'StaticCollectorFactory',
+    'MigrationPlannerFactory', 'ProjectModuleFactory', 'ProjectFactory',
+    'RolloutFactory', 'ConnectionFactory', 'ObjectCache', 'ArtifactFactory',
 )
 
 
+class ObjectCache(object):
+    """
+    Thread-safe LRU cache of objects built by factory. Key is normalized
+    config (plus host)
+    """
+    DEFAULT_SIZE = 256
+
+    __slots__ = ('_items', '_lock', '_size', )
+
+    def __init__(self, size=DEFAULT_SIZE):
+        """
+        :param int size: max number of objects
+        """
+        self._items = OrderedDict()
+        self._lock = threading.RLock()
+        self._size = int(size)
+
+    def __len__(self):
+        return len(self._items)
+
+    @staticmethod
+    def key(config, *extra):
+        """
+        :param config: config of object (dict, list or str)
+        :return str:
+        """
+        return json.dumps([config] + list(extra), sort_keys=True,
+                          default=repr)
+
+    def get(self, key, build):
+        """
+        :param str key:
+        :param callable build: builds object if there is no cached one
+        """
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+
+            obj = self._items[key] = build()
+            while len(self._items) > self._size:
+                self._items.popitem(last=False)
+
+            return obj
+
+    def evict(self, key=None):
+        """
+        :param str|None key: None - evict all of objects
+        """
+        with self._lock:
+            if key is None:
+                self._items.clear()
+            else:
+                self._items.pop(key, None)
+
+
 @add_metaclass(ABCMeta)
 class AbstractFactory(object):
+    # cache of built objects (in subclasses)
+    _cache = None
+
+    @staticmethod
+    def _2b(value):
+        return str(value).lower() not in {
+            '0', 'false', '', 'none', 'null', 'no'
+        }
+
+    @staticmethod
+    def _as_list(value):
+        """
+        :param value: element (or list of elements) of config
+        :return list:
+        """
+        if value is None:
+            return []
+
+        return value if isinstance(value, list) else [value]
+
+    @staticmethod
+    def _get_list(value):
+        """
+        :param str|None value: comma separated list
+        :return list[str]:
+        """
+        return [v.strip() for v in (value or '').split(',') if v.strip()]
+
     @abstractmethod
     def get(self, config):
         pass
 
+    @classmethod
+    def _cache_key(cls, config):
+        return ObjectCache.key(config, env.host_string)
+
+    def _cached(self, config, build):
+        """
+        :return: cached object of config or new one built by `build(config)`
+        """
+        if self._cache is None:
+            return build(config)
+
+        return self._cache.get(self._cache_key(config),
+                               lambda: build(config))
+
+    @classmethod
+    def evict(cls, config=None):
+        """
+        Removes cached object of config (of current host) or all of them
+
+        :param config: None - evict all objects of factory
+        """
+        if cls._cache is None:
+            return
+
+        cls._cache.evict(None if config is None else cls._cache_key(config))
+
+    @staticmethod
+    def evict_all():
+        """
+        Clears caches of all factories
+        """
+        for factory in (DaemonFactory, SystemFactory, DbFactory):
+            factory.evict()
+
 
 class DaemonFactory(AbstractFactory):
+    _cache = ObjectCache()
+
     def get(self, config):
+        return self._cached(config, self._build)
+
+    def _build(self, config):
+        options = {}
         if isinstance(config, dict):
-            d_type = config.get('text')
-            name = config.get('name')
+            options = config.copy()
+            d_type = options.pop('text')
+            name = options.pop('name', None)
         else:
             d_type = config
             name = None
 
+        if 'graceful' in options:
+            options['graceful'] = self._2b(options['graceful'])
+
+        if 'after' in options:
+            options['after'] = self._get_list(options['after'])
+
         d_class = getattr(daemon, d_type.title())
+        if not name:
+            return d_class(**options)
+
         try:
-            return d_class(name)
+            return d_class(name, **options)
         except TypeError:
-            return d_class()
+            return d_class(**options)
 
 
 class SystemFactory(AbstractFactory):
-    _inst = None
+    _cache = ObjectCache()
 
     def __init__(self):
         self._df = DaemonFactory()
 
     def get(self, config, force_new=False):
         """
+        :param dict config: config of project
+        :param bool force_new: build new system instead of cached one
+        :return System:
+        """
+        if force_new:
+            self.evict(config['system'])
+
+        return self._cached(config['system'], self._build)
+
+    def build(self, config):
+        """
+        The same as `get` but the system isn't shared with other callers
+
         :param dict config:
-        :param bool force_new:
         :return System:
         """
-        if SystemFactory._inst is None or force_new:
-            cfg_system = config['system'].copy()
-            cfg_system['project_tree'] = cfg_system['project_tree']['item']
-            cfg_system['log_files'] = cfg_system['log_files']['item']
+        return self._build(config['system'])
+
+    def _build(self, section):
+        """
+        :param dict section: <system> section of config
+        :return System:
+        """
+        cfg_system = section.copy()
+        cfg_system['project_tree'] = self._as_list(
+            cfg_system['project_tree']['item']
+        )
+        cfg_system['log_files'] = self._as_list(
+            cfg_system['log_files']['item']
+        )
 
-            cfg_system['daemons'] = []
-            for d in config['system']['daemons']['daemon']:
-                cfg_system['daemons'].append(self._df.get(d))
+        cfg_system['daemons'] = []
+        for d in self._as_list(section['daemons']['daemon']):
+            cfg_system['daemons'].append(self._df.get(d))
 
-            SystemFactory._inst = System(**cfg_system)
+        cfg_system['concurrent_restart'] = self._2b(
+            section['daemons'].get('concurrent')
+        )
+        if isinstance(section.get('releases'), dict):
+            cfg_system['releases'] = dict(section['releases'])
+        else:
+            cfg_system.pop('releases', None)
 
-        return SystemFactory._inst
+        return System(**cfg_system)
 
 
 class GitFactory(AbstractFactory):
+    # repository isn't cached: module sets its path
     def get(self, config):
         return Git(**config)
 
 
 class DbFactory(AbstractFactory):
+    _cache = ObjectCache()
+
     def get(self, config):
+        return self._cached(config, self._build)
+
+    def _build(self, config):
         db_cfg = config.copy()
         del db_cfg['type']
         db_type = getattr(db, config['type'])
 
+        if 'async_backup' in db_cfg:
+            db_cfg['async_backup'] = self._2b(db_cfg['async_backup'])
+
+        if db_cfg.get('retention'):
+            db_cfg['retention'] = RetentionPolicy(**db_cfg['retention'])
+
         return db_type(**db_cfg)
 
 
 class VirtualEnvFactory(AbstractFactory):
+    # virtualenv isn't cached: module sets its path
     def get(self, config):
         return VirtualEnv(**config)
 
 
+class WheelhouseFactory(AbstractFactory):
+    def get(self, config):
+        if not isinstance(config, dict):
+            return Wheelhouse(config)
+
+        cfg = config.copy()
+        cfg['path'] = cfg.pop('text')
+        return Wheelhouse(**cfg)
+
+
+class StaticCollectorFactory(AbstractFactory):
+    def get(self, config):
+        """
+        :param dict|str config: <collect_static> element
+        :return StaticCollector|None: None - static files are collected by
+                                      collectstatic only
+        """
+        if not isinstance(config, dict) or \
+                not self._2b(config.get('incremental', '0')):
+            return None
+
+        return StaticCollector(compress=self._2b(config.get('compress', '1')))
+
+
+class MigrationPlannerFactory(AbstractFactory):
+    def get(self, config):
+        """
+        :param dict|str|None config: <plan_migrations> element
+        :return MigrationPlanner|None: None - migrations aren't planned
+        """
+        cfg = config.copy() if isinstance(config, dict) else {'text': config}
+        if not self._2b(cfg.pop('text', '1')):
+            return None
+
+        return MigrationPlanner(**cfg)
+
+
 class HooksFactory(AbstractFactory):
     def get(self, config):
         hook = getattr(post_update_hooks, config['type'])
@@ -110,12 +335,6 @@ class HooksFactory(AbstractFactory):
 
 
 class ProjectModuleFactory(AbstractFactory):
-    @staticmethod
-    def _2b(value):
-        return str(value).lower() not in {
-            '0', 'false', '', 'none', 'null', 'no'
-        }
-
     @staticmethod
     def _get_hooks(cfg):
         if 'hooks' not in cfg:
@@ -134,29 +353,60 @@ class ProjectModuleFactory(AbstractFactory):
         return [hook_factory.get(h) for h in hooks_list]
 
     def __init__(self):
-        self._sys = SystemFactory()
         self._venv = VirtualEnvFactory()
         self._db = DbFactory()
         self._git = GitFactory()
+        self._wheels = WheelhouseFactory()
+        self._static = StaticCollectorFactory()
+        self._migrations = MigrationPlannerFactory()
+
+    def get_djangoprojectmodule(self, config, system):
+        """
+        :param dict config: config of module
+        :param System system: system of project (config of module doesn't
+                              describe it)
+        :return DjangoProjectModule:
+        """
+        if system is None:
+            raise DeployError('System of module is required')
 
-    def get_djangoprojectmodule(self, config):
         cfg_module = config.copy()
         del cfg_module['type']
 
         cfg_module['git'] = self._git.get(cfg_module['git'])
         cfg_module['virtual_env'] = self._venv.get(cfg_module['virtual_env'])
         cfg_module['db'] = self._db.get(cfg_module['db'])
-        cfg_module['system'] = self._sys.get(config)
-
-        cfg_module['collect_static'] = self._2b(cfg_module['collect_static'])
+        cfg_module['system'] = system
+        if cfg_module.get('wheelhouse'):
+            cfg_module['wheelhouse'] = self._wheels.get(
+                cfg_module['wheelhouse']
+            )
+
+        collect_static = cfg_module['collect_static']
+        cfg_module['static_collector'] = self._static.get(collect_static)
+        if isinstance(collect_static, dict):
+            collect_static = collect_static.get('text', '1')
+        cfg_module['collect_static'] = self._2b(collect_static)
+        cfg_module['migration_planner'] = self._migrations.get(
+            cfg_module.pop('plan_migrations', None)
+        )
         hooks = self._get_hooks(cfg_module)
+        name = cfg_module.pop('name', None)
+        depends_on = self._get_list(cfg_module.pop('depends_on', None))
 
         dj = DjangoProjectModule(**cfg_module)
         dj.add_hook(*hooks)
+        dj.name = name
+        dj.add_dependency(*depends_on)
 
         return dj
 
-    def get(self, config):
+    def get(self, config, system):
+        """
+        :param dict config: project's config
+        :param System system: system of project
+        :return list[ProjectModule]:
+        """
         res = []
         if isinstance(config['modules']['module'], list):
             modules_list = config['modules']['module']
@@ -165,14 +415,65 @@ class ProjectModuleFactory(AbstractFactory):
 
         for m in modules_list:
             method = getattr(self, 'get_%s' % m['type'].lower())
-            res.append(method(m))
+            res.append(method(m, system))
 
         return res
 
 
+class RolloutFactory(AbstractFactory):
+    def get(self, config):
+        """
+        :param dict config: project's config. Hosts are taken from <hosts>
+                            section or from `env.hosts` if there is no one
+        :return Rollout:
+        """
+        cfg_hosts = (config.get('hosts') or {}).copy()
+        hosts = cfg_hosts.pop('host', None) or env.hosts
+        if not isinstance(hosts, list):
+            hosts = [hosts]
+
+        return Rollout(hosts=hosts, **cfg_hosts)
+
+
+class ConnectionFactory(AbstractFactory):
+    def get(self, config):
+        """
+        :param dict config: project's config. Connections are configured by
+                            <connection> section
+        :return ConnectionManager:
+        """
+        cfg = (config.get('connection') or {}).copy()
+        if 'prompt_sudo' in cfg:
+            cfg['prompt_sudo'] = self._2b(cfg['prompt_sudo'])
+
+        return ConnectionManager(**cfg)
+
+
+class ArtifactFactory(AbstractFactory):
+    def get(self, config):
+        """
+        :param dict config: project's config
+        :return ArtifactBuilder|None: builder of <artifact> section. None if
+                                      there is no such section
+        """
+        if 'artifact' not in config:
+            return None
+
+        cfg = config['artifact']
+        return ArtifactBuilder(**(cfg if isinstance(cfg, dict) else {}))
+
+
 class ProjectFactory(object):
-    def __init__(self, config_file):
+    def __init__(self, config_file, project=None, environment=None):
+        """
+        :param str config_file:
+        :param str|None project: name of project. May be omitted if config
+                                 contains one project only
+        :param str|None environment: name of environment of project
+        """
         self._cfg_file = config_file
+        self._project = project
+        self._environment = environment
         self._cfg = None
         self._sys = SystemFactory()
         self._p_mod = ProjectModuleFactory()
@@ -180,12 +481,23 @@ class ProjectFactory(object):
     @property
     def config(self):
         if self._cfg is None:
-            self._cfg = SettingsXML(self._cfg_file).data['project']
+            self._cfg = SettingsXML(self._cfg_file).project(
+                self._project, self._environment
+            )
 
         return self._cfg
 
     def get(self):
+        """
+        Builds objects of selected project only
+        """
+        system = self._sys.get(self.config)
         return Project(
-            system=self._sys.get(self.config),
-            modules=self._p_mod.get(self.config)
+            system=system,
+            modules=self._p_mod.get(self.config, system),
+            concurrent=ProjectModuleFactory._2b(self.config.get('concurrent')),
+            workers=self.config.get('workers'),
+            snapshot=ProjectModuleFactory._2b(
+                self.config.get('snapshot', '1')
+            )
         )
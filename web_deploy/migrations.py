@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    Planning of django migrations. Pending migrations are read from
+    `manage.py showmigrations --plan`, so backup and migrate are skipped if
+    the database is up to date already. Tables changed by pending migrations
+    are found in their SQL (`manage.py sqlmigrate`): backup may be limited
+    to these tables. SQL which can't be analysed (data migrations, custom
+    SQL) requires backup of the whole database.
+"""
+
+import re
+
+from .base import DeployEntity
+
+
+__author__ = 'y.gavenchuk'
+__all__ = ('Migration', 'MigrationPlanner', )
+
+
+class Migration(object):
+    __slots__ = ('_app', '_name', )
+
+    def __init__(self, app, name):
+        """
+        :param str app: label of django application
+        :param str name: name of migration
+        """
+        self._app = app
+        self._name = name
+
+    def __str__(self):
+        return '%s.%s' % (self._app, self._name)
+
+    def __eq__(self, other):
+        return isinstance(other, Migration) and str(self) == str(other)
+
+    def __hash__(self):
+        return hash(str(self))
+
+    @property
+    def app(self):
+        return self._app
+
+    @property
+    def name(self):
+        return self._name
+
+
+class MigrationPlanner(DeployEntity):
+    BACKUP_FULL = 'full'
+    BACKUP_TABLES = 'tables'
+
+    _plan_re = re.compile(r'^\s*\[( |X)\]\s+(\w+)\.(\w+)')
+    # statements which change the named table
+    _table_re = re.compile(
+        r'^(CREATE TABLE|ALTER TABLE(?: ONLY)?|DROP TABLE(?: IF EXISTS)?|'
+        r'TRUNCATE(?: TABLE)?|INSERT INTO|UPDATE|DELETE FROM|'
+        r'CREATE (?:UNIQUE )?INDEX(?: CONCURRENTLY)?(?: IF NOT EXISTS)?'
+        r'(?: "?\w+"?)? ON(?: ONLY)?) "?([\w.]+)"?', re.IGNORECASE
+    )
+    # statements which don't change data
+    _harmless_re = re.compile(
+        r'^(BEGIN|COMMIT|SET CONSTRAINTS |DROP INDEX |ALTER INDEX |'
+        r'CREATE SEQUENCE |ALTER SEQUENCE |SELECT setval\()', re.IGNORECASE
+    )
+
+    __slots__ = ('_backup', )
+
+    def __init__(self, backup=BACKUP_FULL):
+        """
+        :param str backup: BACKUP_FULL or BACKUP_TABLES - backup of tables
+                           changed by pending migrations only
+        """
+        super(MigrationPlanner, self).__init__()
+        assert backup in {self.BACKUP_FULL, self.BACKUP_TABLES}, \
+            'Unknown backup mode "%s"' % backup
+
+        self._backup = backup
+
+    @property
+    def backup(self):
+        return self._backup
+
+    def parse_plan(self, output):
+        """
+        :param str output: output of `showmigrations --plan`
+        :return list[Migration]: pending migrations in order of applying
+        """
+        pending = []
+        for line in str(output).splitlines():
+            match = self._plan_re.match(line)
+            if match and match.group(1) == ' ':
+                pending.append(Migration(match.group(2), match.group(3)))
+
+        return pending
+
+    def parse_tables(self, sql):
+        """
+        :param str sql: output of `sqlmigrate`
+        :return list[str]|None: existing tables changed by SQL (created ones
+                                aren't there yet). None - SQL has statements
+                                which can't be analysed
+        """
+        created, changed = set(), set()
+        for line in str(sql).splitlines():
+            line = line.strip()
+            if not line or line.startswith('--'):
+                if 'CANNOT BE WRITTEN AS SQL' in line.upper():
+                    return None
+                continue
+
+            match = self._table_re.match(line)
+            if match:
+                table = match.group(2)
+                if match.group(1).upper() == 'CREATE TABLE':
+                    created.add(table)
+                elif table not in created:
+                    changed.add(table)
+            elif not self._harmless_re.match(line):
+                return None
+
+        return sorted(changed)
+
+    def pending(self, v_env, manage_py):
+        """
+        :param web_deploy.python.VirtualEnv v_env:
+        :param str manage_py: path of manage.py
+        :return list[Migration]:
+        """
+        return self.parse_plan(v_env.output(
+            '"%s" showmigrations --plan' % manage_py
+        ))
+
+    def tables(self, v_env, manage_py, migrations):
+        """
+        Reads SQL of all migrations by one remote command
+
+        :param list[Migration] migrations: pending migrations
+        :return list[str]|None: see `parse_tables`
+        """
+        if not migrations:
+            return []
+
+        return self.parse_tables(v_env.output(' && '.join(
+            '"%s" sqlmigrate %s %s' % (manage_py, m.app, m.name)
+            for m in migrations
+        )))
+
+    def backup_tables(self, v_env, manage_py):
+        """
+        :return tuple(list[Migration], list[str]|None): pending migrations
+                and tables which should be dumped before them (None - the
+                whole database)
+        """
+        pending = self.pending(v_env, manage_py)
+        if not pending or self._backup == self.BACKUP_FULL:
+            return pending, None
+
+        return pending, self.tables(v_env, manage_py, pending)
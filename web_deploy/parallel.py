@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    Execution of deploy tasks (and their dependencies) in a pool of workers.
+
+    Fabric keeps its state (``env``, connections cache) in module globals,
+    so the default pool forks a process per task exactly as fabric's own
+    parallel mode does. Thread pool is available for callables which don't
+    depend on fabric's global state.
+"""
+
+import multiprocessing
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from queue import Empty
+
+from fabric import state
+
+from . import profiler
+
+
+__author__ = 'y.gavenchuk'
+__all__ = ('Task', 'TaskResult', 'TaskRunner', )
+
+
+class Task(object):
+    __slots__ = ('_name', '_func', '_args', '_depends', )
+
+    def __init__(self, name, func, *args, depends=()):
+        """
+        :param str name: unique name of task
+        :param callable func:
+        :param args: arguments of `func`
+        :param list[str] depends: names of tasks which should be successfully
+                                  finished before this one is started
+        """
+        self._name = str(name)
+        self._func = func
+        self._args = args
+        self._depends = tuple(str(d) for d in depends)
+
+    def __str__(self):
+        return self.name
+
+    def __call__(self):
+        return self._func(*self._args)
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def depends(self):
+        return self._depends
+
+
+class TaskResult(object):
+    __slots__ = ('_name', '_value', '_error', '_started', '_duration',
+                 'profile', )
+
+    def __init__(self, name, value=None, error=None, started=None,
+                 duration=0.0):
+        """
+        :param str name: name of task
+        :param value: value returned by task
+        :param str|None error: description of error raised by task
+        :param float|None started: timestamp of start. None if task wasn't
+                                   started at all
+        :param float duration: wall-clock time of task (seconds)
+        """
+        self._name = name
+        self._value = value
+        self._error = error
+        self._started = started
+        self._duration = duration
+        # results of profiler of forked worker
+        self.profile = None
+
+    def __str__(self):
+        status = 'failed: %s' % self.error if self.failed else 'ok'
+        return '%s: %s (%.2fs)' % (self.name, status, self.duration)
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def value(self):
+        return self._value
+
+    @property
+    def error(self):
+        return self._error
+
+    @property
+    def started(self):
+        return self._started
+
+    @property
+    def finished(self):
+        if self._started is None:
+            return None
+
+        return self._started + self._duration
+
+    @property
+    def duration(self):
+        return self._duration
+
+    @property
+    def failed(self):
+        return self._error is not None
+
+
+def _execute(task):
+    """
+    :param Task task:
+    :return TaskResult:
+    """
+    start = time.time()
+    try:
+        value = task()
+    except BaseException as e:  # abort() raises SystemExit
+        return TaskResult(
+            task.name,
+            error='%s: %s' % (e.__class__.__name__, e),
+            started=start,
+            duration=time.time() - start
+        )
+
+    return TaskResult(task.name, value=value, started=start,
+                      duration=time.time() - start)
+
+
+def _execute_in_child(task, queue):
+    # the same as fabric does for parallel tasks: connections of parent
+    # process mustn't be shared with its children
+    state.connections.clear()
+    state.env.update({'parallel': True, 'linewise': True})
+
+    prof = profiler.current()
+    if prof is not None:
+        prof.fork()
+
+    result = _execute(task)
+    if prof is not None:
+        result.profile = prof.snapshot()
+
+    queue.put(result)
+
+
+class _ThreadPool(object):
+    def __init__(self, size):
+        self._executor = ThreadPoolExecutor(max_workers=size)
+        self._futures = set()
+
+    def start(self, task):
+        self._futures.add(self._executor.submit(_execute, task))
+
+    def wait(self):
+        done, self._futures = wait(self._futures,
+                                   return_when=FIRST_COMPLETED)
+        return [f.result() for f in done]
+
+    def close(self):
+        self._executor.shutdown()
+
+
+class _ProcessPool(object):
+    def __init__(self, size):
+        self._ctx = multiprocessing.get_context('fork')
+        self._queue = self._ctx.Queue()
+        self._running = {}
+        # workers which exited successfully: result of such worker is in the
+        # queue, so it's reaped only if the queue is drained without it
+        self._suspects = set()
+
+    def start(self, task):
+        proc = self._ctx.Process(target=_execute_in_child,
+                                 args=(task, self._queue))
+        proc.start()
+        self._running[task.name] = proc
+
+    def _reap(self):
+        """
+        Called when the queue is drained
+
+        :return list[TaskResult]: failures of dead workers
+        """
+        results = []
+        for name, proc in list(self._running.items()):
+            if proc.is_alive():
+                continue
+
+            if proc.exitcode == 0 and name not in self._suspects:
+                self._suspects.add(name)
+                continue
+
+            proc.join()
+            del self._running[name]
+            self._suspects.discard(name)
+            error = 'Worker exited with code %s' % proc.exitcode
+            if proc.exitcode == 0:
+                error += ' without result'
+            results.append(TaskResult(name, error=error))
+
+        return results
+
+    def wait(self):
+        while True:
+            try:
+                result = self._queue.get(timeout=0.1)
+            except Empty:
+                results = self._reap()
+                if results:
+                    return results
+                continue
+
+            proc = self._running.pop(result.name, None)
+            if proc is None:
+                # task is already reaped (and reported as failed one)
+                continue
+
+            proc.join()
+            self._suspects.discard(result.name)
+            return [result]
+
+    def close(self):
+        for proc in self._running.values():
+            proc.join()
+
+
+class TaskRunner(object):
+    POOL_PROCESS = 'process'
+    POOL_THREAD = 'thread'
+
+    __slots__ = ('_workers', '_pool', )
+
+    def __init__(self, workers=None, pool=POOL_PROCESS):
+        """
+        :param int|None workers: max number of simultaneously running tasks.
+                                 None means no limit
+        :param str pool: "process" or "thread"
+        """
+        assert pool in {self.POOL_PROCESS, self.POOL_THREAD}, \
+            'Unknown pool "%s"' % pool
+
+        self._workers = int(workers) if workers else None
+        assert self._workers is None or self._workers > 0, \
+            "Workers count should be positive"
+
+        self._pool = pool
+
+    @property
+    def workers(self):
+        return self._workers
+
+    @property
+    def pool(self):
+        return self._pool
+
+    def _mk_pool(self, tasks):
+        size = min(self._workers or len(tasks), len(tasks))
+        if self._pool == self.POOL_THREAD:
+            return _ThreadPool(size), size
+
+        return _ProcessPool(size), size
+
+    @staticmethod
+    def _validate(tasks):
+        names = [t.name for t in tasks]
+        assert len(set(names)) == len(names), "Task names should be unique"
+
+        for task in tasks:
+            for dep in task.depends:
+                assert dep in names, 'Unknown dependency "%s" of "%s"' % (
+                    dep, task.name
+                )
+
+    def run(self, tasks):
+        """
+        Runs all of tasks. Task is started as soon as all of its dependencies
+        have finished successfully. Task with failed dependency is not
+        started and is reported as failed one.
+
+        :param list[Task] tasks:
+        :return list[TaskResult]: results in the same order as tasks
+        """
+        if not tasks:
+            return []
+
+        self._validate(tasks)
+        pool, size = self._mk_pool(tasks)
+        pending = list(tasks)
+        results = {}
+        running = 0
+
+        try:
+            while pending or running:
+                for task in list(pending):
+                    failed = [
+                        d for d in task.depends
+                        if d in results and results[d].failed
+                    ]
+                    if failed:
+                        pending.remove(task)
+                        results[task.name] = TaskResult(
+                            task.name,
+                            error='Dependency "%s" failed' % failed[0]
+                        )
+                        continue
+
+                    if running >= size:
+                        continue
+
+                    if all(d in results for d in task.depends):
+                        pending.remove(task)
+                        pool.start(task)
+                        running += 1
+
+                if not running:
+                    assert not pending, 'Circular dependencies: %s' % (
+                        ', '.join(t.name for t in pending)
+                    )
+                    break
+
+                for result in pool.wait():
+                    results[result.name] = result
+                    running -= 1
+                    if result.profile and profiler.current():
+                        profiler.current().merge(result.profile)
+        finally:
+            pool.close()
+
+        return [results[t.name] for t in tasks]
@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    Timing of deploy phases. While profiler is installed, remote commands of
+    all deploy entities are counted (number of commands and bytes
+    transferred) and attributed to the phases which are running on the
+    current host.
+
+    Phases are declared by `phase` context manager; it costs nothing if
+    there is no installed profiler.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from fabric.api import env
+
+from . import transport
+
+
+__author__ = 'y.gavenchuk'
+__all__ = ('Profiler', 'current', 'phase', 'profiled', )
+
+
+_active = None
+
+
+def current():
+    """
+    :return Profiler|None: installed profiler
+    """
+    return _active
+
+
+@contextmanager
+def phase(name):
+    """
+    Declares phase of deploy. Phases may be nested
+    """
+    profiler = _active
+    if profiler is None:
+        yield
+        return
+
+    with profiler.phase(name):
+        yield
+
+
+def profiled(name, func, *args):
+    """
+    Calls `func(*args)` inside of phase `name` (useful for tasks)
+    """
+    with phase(name):
+        return func(*args)
+
+
+def _size(local):
+    """
+    :param str|file local: local path or file-like object of put/get
+    :return int:
+    """
+    if hasattr(local, 'getbuffer'):
+        return local.getbuffer().nbytes
+
+    if isinstance(local, str) and os.path.isfile(local):
+        return os.path.getsize(local)
+
+    return 0
+
+
+class _Instrumented(object):
+    """
+    Proxy of fabric's api (or of fabric.contrib.files) which reports each
+    call of remote command to profiler
+    """
+    COMMANDS = frozenset(('run', 'sudo', 'local'))
+    TRANSFERS = frozenset(('put', 'get'))
+
+    def __init__(self, target, profiler, count_all=False):
+        """
+        :param target: module to wrap
+        :param Profiler profiler:
+        :param bool count_all: each call of function is a remote command
+        """
+        self._target = target
+        self._profiler = profiler
+        self._count_all = count_all
+
+    @property
+    def target(self):
+        return self._target
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name in self.COMMANDS:
+            return self._command(attr)
+        if name in self.TRANSFERS:
+            return self._transfer(attr)
+        if self._count_all and callable(attr):
+            return self._call(attr)
+
+        return attr
+
+    def _command(self, func):
+        def wrapper(command, *args, **kwargs):
+            output = func(command, *args, **kwargs)
+            self._profiler.count(len(command) + len(str(output or '')))
+            return output
+
+        return wrapper
+
+    def _transfer(self, func):
+        def wrapper(*args, **kwargs):
+            local = kwargs.get(
+                'local_path', args[1] if len(args) > 1 else None
+            )
+            output = func(*args, **kwargs)
+            self._profiler.count(_size(local))
+            return output
+
+        return wrapper
+
+    def _call(self, func):
+        def wrapper(*args, **kwargs):
+            output = func(*args, **kwargs)
+            self._profiler.count(sum(len(str(a)) for a in args))
+            return output
+
+        return wrapper
+
+
+class Profiler(object):
+    """
+    Usage::
+
+        with Profiler() as profiler:
+            project.update(tag)
+
+        puts(profiler.summary())
+    """
+    __slots__ = ('_records', '_local', '_lock', '_saved', )
+
+    def __init__(self):
+        self._records = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._saved = None
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.uninstall()
+
+    @property
+    def records(self):
+        """
+        :return list[dict]: finished phases in order of their finish
+        """
+        with self._lock:
+            return list(self._records)
+
+    @property
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+
+        return stack
+
+    def install(self):
+        global _active
+        assert _active is None, 'Profiler is installed already'
+
+        api, files, _, daemon_api = transport.installed()
+        self._saved = transport.install(
+            _Instrumented(api, self), _Instrumented(files, self, True),
+            daemon_api=_Instrumented(daemon_api, self)
+        )
+        _active = self
+
+    def uninstall(self):
+        global _active
+        if _active is not self:
+            return
+
+        transport.install(*self._saved)
+        _active = None
+
+    @contextmanager
+    def phase(self, name):
+        stack = self._stack
+        path = '/'.join([f['phase'] for f in stack[-1:]] + [str(name)])
+        frame = {'phase': path, 'started': time.time(), 'commands': 0,
+                 'bytes': 0}
+        stack.append(frame)
+        try:
+            yield
+        finally:
+            stack.pop()
+            frame['duration'] = time.time() - frame['started']
+            frame['host'] = env.host_string or 'localhost'
+            with self._lock:
+                self._records.append(frame)
+
+    def count(self, size=0):
+        """
+        Registers remote command in all running phases
+
+        :param int size: bytes transferred by command
+        """
+        for frame in self._stack:
+            frame['commands'] += 1
+            frame['bytes'] += size
+
+    def fork(self):
+        """
+        Should be called in forked worker: only its own records and counters
+        are kept
+        """
+        self._records = []
+        self._lock = threading.Lock()
+        for frame in self._stack:
+            frame['commands'] = frame['bytes'] = 0
+
+    def snapshot(self):
+        """
+        :return dict: records and counters of forked worker, see `merge`
+        """
+        stack = self._stack
+        return {
+            'records': self.records,
+            'commands': stack[0]['commands'] if stack else 0,
+            'bytes': stack[0]['bytes'] if stack else 0,
+        }
+
+    def merge(self, snapshot):
+        """
+        Adds results of forked worker to this profiler
+        """
+        for frame in self._stack:
+            frame['commands'] += snapshot['commands']
+            frame['bytes'] += snapshot['bytes']
+
+        with self._lock:
+            self._records += snapshot['records']
+
+    def totals(self):
+        """
+        :return list[dict]: records aggregated by host and phase
+        """
+        totals = {}
+        for rec in sorted(self.records, key=lambda r: r['started']):
+            key = (rec['host'], rec['phase'])
+            total = totals.setdefault(key, {
+                'host': rec['host'], 'phase': rec['phase'], 'calls': 0,
+                'duration': 0.0, 'commands': 0, 'bytes': 0
+            })
+            total['calls'] += 1
+            for field in ('duration', 'commands', 'bytes'):
+                total[field] += rec[field]
+
+        return list(totals.values())
+
+    def to_json(self):
+        return json.dumps(
+            {'phases': self.records, 'totals': self.totals()},
+            indent=2, sort_keys=True
+        )
+
+    def summary(self):
+        """
+        :return str: human-readable table of totals
+        """
+        header = ('host', 'phase', 'calls', 'time, s', 'commands', 'bytes')
+        rows = [
+            (t['host'], t['phase'], str(t['calls']), '%.2f' % t['duration'],
+             str(t['commands']), str(t['bytes']))
+            for t in self.totals()
+        ]
+        widths = [
+            max(len(r[i]) for r in [header] + rows)
+            for i in range(len(header))
+        ]
+
+        lines = []
+        for row in [header] + rows:
+            lines.append('  '.join(
+                v.ljust(w) if i < 2 else v.rjust(w)
+                for i, (v, w) in enumerate(zip(row, widths))
+            ))
+
+        lines.insert(1, '-' * len(lines[0]))
+        return '\n'.join(lines)
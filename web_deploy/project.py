@@ -14,17 +14,47 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from .base import LocatedDeployEntity, DeployEntity
+from contextlib import contextmanager
+
+from fabric.utils import puts
+
+from .base import LocatedDeployEntity, DeployEntity, DeployError
+from .changes import ChangeDetector, SCOPE_HOST
+from .parallel import Task, TaskRunner
+from .profiler import phase, profiled
+from .snapshot import HostSnapshot
 
 
 __author__ = 'y.gavenchuk'
-__all__ = ('Project', 'ProjectModule', )
+__all__ = ('Project', 'ProjectModule', 'run_after', )
+
+
+def run_after(*hooks):
+    """
+    Declares post update hooks (by their names) which should be finished
+    before this one. Hook without declaration runs after all of previous
+    hooks of module. Hooks which don't depend on each other are run
+    concurrently by concurrent update (see `ProjectModule.update_tasks`)
+
+    :param list[str] hooks: names of hooks. Hooks which aren't run (e.g.
+                            build hooks of artifact) are ignored
+    """
+    def decorator(func):
+        func.after = tuple(hooks)
+        return func
+
+    return decorator
 
 
 class ProjectModule(LocatedDeployEntity):
-    __slots__ = ('_git', '_post_update_hooks', '_container')
+    __slots__ = ('_git', '_post_update_hooks', '_container', '_name',
+                 '_depends_on', '_artifact', '_building', )
 
     DEFAULT_CONTAINER_NAME = 'data'
+    STATE_DIR_NAME = '.web-deploy'
+    # hooks whose results are the same on all hosts: they're run by
+    # artifact builder instead of target hosts
+    BUILD_HOOKS = ()
 
     def __init__(self, path, git, container_name=None):
         super(ProjectModule, self).__init__(path)
@@ -32,6 +62,10 @@ class ProjectModule(LocatedDeployEntity):
         self._git.path = self.path
         self._container = container_name or self.DEFAULT_CONTAINER_NAME
         self._post_update_hooks = []
+        self._name = None
+        self._depends_on = []
+        self._artifact = None
+        self._building = False
 
     @property
     def git(self):
@@ -41,6 +75,41 @@ class ProjectModule(LocatedDeployEntity):
     def container(self):
         return self._container
 
+    @property
+    def name(self):
+        return self._name or str(self._git.name)
+
+    @name.setter
+    def name(self, value):
+        self._name = str(value) if value else None
+
+    @property
+    def artifact(self):
+        """
+        :return Artifact|None: built module. If it's set, update unpacks it
+                               instead of git update and build hooks
+        """
+        return self._artifact
+
+    @artifact.setter
+    def artifact(self, value):
+        self._artifact = value
+
+    @property
+    def depends_on(self):
+        return list(self._depends_on)
+
+    def add_dependency(self, *dependencies):
+        """
+        Used by concurrent update only. Hooks of this module won't be started
+        until dependencies are finished
+
+        :param str dependencies: name of another module (the whole module
+                                 should be updated) or "<module>.<hook>"
+                                 (e.g. "core.puh_migrate")
+        """
+        self._depends_on += [str(d) for d in dependencies]
+
     @LocatedDeployEntity.path.setter
     def path(self, value):
         new_path = self._os.path.join(value, self._container)
@@ -55,24 +124,285 @@ class ProjectModule(LocatedDeployEntity):
     def add_hook(self, *hooks):
         self._post_update_hooks += hooks
 
-    def post_update_hndl(self):
-        for hook in self._post_update_hooks:
-            hook()
+    def _detector(self, scope):
+        """
+        :param str scope:
+        :return ChangeDetector:
+        """
+        if scope == SCOPE_HOST:
+            # path is "<project>/<app dir>/<container>"
+            project_dir = self._os.path.dirname(
+                self._os.path.dirname(self.path)
+            )
+            state_dir = self._os.path.join(
+                project_dir, self.STATE_DIR_NAME, self.name
+            )
+        else:
+            state_dir = self._os.path.join(self.path, self.STATE_DIR_NAME)
+
+        return ChangeDetector(self.path, state_dir)
+
+    def _collect_changes(self, hooks):
+        """
+        :param list hooks:
+        :return dict: hook's name => (detector, digest, is changed)
+        """
+        by_scope = {}
+        for hook in hooks:
+            watch = getattr(hook, 'watch', None)
+            if watch is not None:
+                inputs, scope = watch
+                by_scope.setdefault(scope, {})[hook.__name__] = inputs(self)
+
+        changes = {}
+        for scope, inputs in by_scope.items():
+            detector = self._detector(scope)
+            digests, state = detector.collect(inputs)
+            for name in inputs:
+                digest = digests.get(name)
+                changed = digest is None or state.get(name) != digest
+                changes[name] = (detector, digest, changed)
+
+        return changes
+
+    def _run_hook(self, hook, force=False, changes=None):
+        """
+        Runs hook unless its inputs are unchanged since its last run
+
+        :param callable hook:
+        :param bool force: run hook in any case
+        :param dict changes: result of `_collect_changes`
+        """
+        if getattr(hook, 'watch', None) is None:
+            return hook()
+
+        if changes is None:
+            changes = self._collect_changes([hook])
+
+        detector, digest, changed = changes[hook.__name__]
+        if not changed and not force:
+            puts('Hook "%s.%s" is skipped: inputs are unchanged' % (
+                self.name, hook.__name__
+            ))
+            return
+
+        hook()
+        if digest is not None:
+            detector.record(hook.__name__, digest)
 
-    def update(self, tag):
+    def _hooks(self, build=False):
+        """
+        :param bool build: hooks of artifact builder
+        :return list: hooks to run on the current host
+        """
+        if build:
+            return [
+                h for h in self._post_update_hooks
+                if getattr(h, '__name__', None) in self.BUILD_HOOKS
+            ]
+
+        if self._artifact is None:
+            return list(self._post_update_hooks)
+
+        return [
+            h for h in self._post_update_hooks
+            if getattr(h, '__name__', None) not in self.BUILD_HOOKS
+        ]
+
+    def _after(self, hook):
+        """
+        :param callable hook:
+        :return tuple|None: names of hooks which should be finished before
+                            hook (see `run_after`). None - all of previous
+                            hooks
+        """
+        return getattr(hook, 'after', None)
+
+    def _ordered(self, hooks):
+        """
+        :param list hooks:
+        :return list[tuple(int, callable, set)]: index of hook, hook and
+                                                 indexes of hooks it depends
+                                                 on in order of execution
+        """
+        names = [getattr(h, '__name__', None) for h in hooks]
+        depends = {}
+        for idx, hook in enumerate(hooks):
+            after = self._after(hook)
+            if after is None:
+                # after all of previous hooks
+                previous = set(range(idx))
+                depends[idx] = previous.difference(
+                    *[depends[i] for i in previous]
+                )
+            else:
+                depends[idx] = {
+                    i for i, name in enumerate(names)
+                    if name in after and i != idx
+                }
+
+        order = []
+        while len(order) < len(hooks):
+            ready = [
+                i for i in range(len(hooks))
+                if i not in order and depends[i].issubset(order)
+            ]
+            if not ready:
+                raise DeployError(
+                    'Post update hooks of "%s" depend on each other' %
+                    self.name
+                )
+            order.append(ready[0])
+
+        return [(i, hooks[i], depends[i]) for i in order]
+
+    def post_update_hndl(self, force=False):
+        hooks = self._hooks(self._building)
+        changes = self._collect_changes(hooks)
+        for idx, hook, _ in self._ordered(hooks):
+            with phase('hook:%s' % self._hook_name(hook, idx)):
+                self._run_hook(hook, force, changes)
+
+    def _checkout(self, tag):
+        """
+        Git update or unpacking of artifact
+        """
+        if self._artifact is None:
+            with phase('git'):
+                self.git.update(tag)
+        else:
+            with phase('artifact'):
+                self._artifact.install(self)
+
+    def update(self, tag, force=False):
         """
         Perform module update: pull changes from git and apply all  post
                                update hooks
 
         :param str tag: git tag
+        :param bool force: run hooks even if their inputs are unchanged
         """
-        self.git.update(tag)
-        self.post_update_hndl()
+        with phase('module:%s' % self.name):
+            self._checkout(tag)
+            self.post_update_hndl(force)
+
+    def build(self, tag, force=False):
+        """
+        Used by artifact builder: git update and build hooks only
+
+        :param str tag: git tag
+        :param bool force: run hooks even if their inputs are unchanged
+        """
+        self._building = True
+        try:
+            self.git.update(tag)
+            self.post_update_hndl(force)
+        finally:
+            self._building = False
+
+    def snapshot_paths(self):
+        """
+        :return list[str]: paths (relative to module's path) which are
+                           checked by update (see `web_deploy.snapshot`)
+        """
+        return [self.git.name]
+
+    def relocate_cmds(self, built_path):
+        """
+        :param str built_path: path of module on build host
+        :return list[str]: commands which fix absolute paths in unpacked
+                           artifact
+        """
+        return []
+
+    async def update_async(self, session, tag, force=False):
+        """
+        The same as `update` but commands of git are sent by session (see
+        `web_deploy.aio.Session`). Post update hooks are blocking, they are
+        called by `session.call`
+        """
+        if self._artifact is None:
+            await self.git.update_async(session, tag)
+        else:
+            await session.call(self._artifact.install, self)
+        await session.call(self.post_update_hndl, force)
+
+    @staticmethod
+    def _hook_name(hook, idx):
+        name = getattr(hook, '__name__', '')
+        return name if name.isidentifier() else 'hook%d' % idx
+
+    def _profiled(self, name, func, *args):
+        with phase('module:%s' % self.name):
+            return profiled(name, func, *args)
+
+    def _profiled_checkout(self, tag):
+        with phase('module:%s' % self.name):
+            return self._checkout(tag)
+
+    def update_tasks(self, tag=None, depends=(), force=False):
+        """
+        The same as `update` but split into tasks: git update and then each
+        of post update hooks. Hooks depend on the previous one or on hooks
+        declared by `run_after`. The last task is finished after all of
+        others
+
+        :param str tag: git tag
+        :param list[str] depends: tasks which should be finished before the
+                                  first hook
+        :param bool force: run hooks even if their inputs are unchanged
+        :return list[Task]:
+        """
+        hooks = self._hooks()
+        checkout = Task(
+            '%s.git' % self.name, self._profiled_checkout, tag,
+            depends=() if hooks else depends
+        )
+        names = [
+            self._hook_name(hook, idx) for idx, hook in enumerate(hooks)
+        ]
+
+        tasks = [checkout]
+        declared = False
+        for idx, hook, hook_deps in self._ordered(hooks):
+            declared |= self._after(hook) is not None
+            hook_depends = [
+                '%s.%s' % (self.name, names[i]) for i in sorted(hook_deps)
+            ] or [checkout.name] + list(depends)
+
+            tasks.append(Task(
+                '%s.%s' % (self.name, names[idx]),
+                self._profiled, 'hook:%s' % names[idx], self._run_hook, hook,
+                force, depends=hook_depends
+            ))
+
+        required = {d for t in tasks for d in t.depends}
+        leaves = [t.name for t in tasks[1:] if t.name not in required]
+        if declared and leaves != [tasks[-1].name]:
+            tasks.append(Task('%s.hooks' % self.name, self._noop,
+                              depends=leaves))
+
+        return tasks
+
+    @staticmethod
+    def _noop():
+        pass
+
 
 class Project(DeployEntity):
-    __slots__ = ('_p_modules', '_sys', )
+    __slots__ = ('_p_modules', '_sys', '_runner', '_snapshot', )
 
-    def __init__(self, system, modules):
+    def __init__(self, system, modules, concurrent=False, workers=None,
+                 snapshot=True):
+        """
+        :param System system:
+        :param list[ProjectModule] modules:
+        :param bool concurrent: update modules in parallel
+        :param int|None workers: max number of simultaneously running tasks
+                                 of concurrent update
+        :param bool snapshot: gather state of remote paths by one command
+                              at start of update (see `web_deploy.snapshot`)
+        """
         super(Project, self).__init__()
         self._sys = system
 
@@ -81,14 +411,210 @@ class Project(DeployEntity):
         assert len(modules), "Expected at least one module"
         self._p_modules = modules
 
-    def _update_modules(self, tag=None):
+        self._runner = TaskRunner(workers) if concurrent else None
+        self._snapshot = snapshot
+
+    @property
+    def modules(self):
+        return list(self._p_modules)
+
+    @property
+    def system(self):
+        return self._sys
+
+    def _module_tasks(self, tag, force=False):
+        """
+        :return tuple(list[Task], dict): tasks and map of task to its module
+        """
+        names = [m.name for m in self._p_modules]
+        assert len(set(names)) == len(names), "Module names should be unique"
+
+        # tasks of module are built once, after tasks of modules it depends
+        # on: their last tasks are known then
+        module_tasks = {}
+        pending = list(self._p_modules)
+        while pending:
+            ready = [
+                m for m in pending
+                if all(d in module_tasks or d not in names
+                       for d in m.depends_on)
+            ]
+            if not ready:
+                raise DeployError('Modules "%s" depend on each other' % (
+                    '", "'.join(m.name for m in pending)
+                ))
+
+            for prj_mod in ready:
+                depends = [
+                    module_tasks[d][-1].name if d in module_tasks else d
+                    for d in prj_mod.depends_on
+                ]
+                module_tasks[prj_mod.name] = prj_mod.update_tasks(
+                    tag, depends, force
+                )
+                pending.remove(prj_mod)
+
+        tasks, modules = [], {}
+        for prj_mod in self._p_modules:
+            for task in module_tasks[prj_mod.name]:
+                tasks.append(task)
+                modules[task.name] = prj_mod.name
+
+        return tasks, modules
+
+    def _update_modules_concurrently(self, tag=None, force=False):
+        tasks, modules = self._module_tasks(tag, force)
+        # forked tasks don't share snapshot: it doesn't see their commands
+        snapshot = HostSnapshot.current()
+        if snapshot is not None:
+            snapshot.invalidate()
+        results = self._runner.run(tasks)
+
+        for name in [m.name for m in self._p_modules]:
+            started = [
+                r for r in results if modules[r.name] == name and r.started
+            ]
+            if started:
+                puts('Module "%s" updated in %.2fs' % (name, (
+                    max(r.finished for r in started) -
+                    min(r.started for r in started)
+                )))
+
+        failed = [r for r in results if r.failed]
+        if failed:
+            raise DeployError('Update of modules failed: %s' % '; '.join(
+                str(r) for r in failed
+            ))
+
+    def _update_modules(self, inactive_dir, tag=None, force=False):
+        """
+        :param str inactive_dir: app directory of the next release
+        """
+        for prj_mod in self._p_modules:
+            prj_mod.path = inactive_dir
+
+        if self._runner is not None:
+            return self._update_modules_concurrently(tag, force)
+
         for prj_mod in self._p_modules:
-            prj_mod.path = self._sys.app_directory_inactive
-            prj_mod.update(tag)
-
-    def update(self, tag=None):
-        self._sys.create_project_tree()
-        self._sys.ensure_log_files()
-        self._update_modules(tag)
-        self._sys.app_directory_switch()
-        self._sys.restart_daemons()
+            prj_mod.update(tag, force)
+
+    @contextmanager
+    def _snapshot_installed(self):
+        """
+        Collects state of paths checked by update and activates snapshot
+        for the duration of the block. Any command which isn't read only
+        invalidates the snapshot
+        """
+        if not self._snapshot:
+            yield None
+            return
+
+        snapshot = HostSnapshot()
+        slot_paths = []
+        for prj_mod in self._p_modules:
+            slot_paths += [
+                self._os.path.join(prj_mod.container, p)
+                for p in prj_mod.snapshot_paths()
+            ]
+
+        with phase('snapshot'):
+            snapshot.collect(self._sys.snapshot_paths(),
+                             self._sys.app_directory, slot_paths,
+                             len(self._sys.releases.slots))
+
+        with snapshot.activate():
+            yield snapshot
+
+    def _prepare_host(self):
+        """
+        Steps of update before modules: project tree and log files
+        """
+        with phase('create_project_tree'):
+            self._sys.create_project_tree()
+        with phase('ensure_log_files'):
+            self._sys.ensure_log_files()
+
+    def _prune_releases(self):
+        if self._sys.releases.keep < len(self._sys.releases.slots):
+            with phase('prune_releases'):
+                self._sys.prune_releases()
+
+    def update(self, tag=None, force=False):
+        """
+        :param str tag: git tag
+        :param bool force: run all post update hooks even if their inputs
+                           are unchanged
+        """
+        with phase('update'), self._snapshot_installed():
+            # slot of release is read before the snapshot is invalidated
+            inactive_dir = self._sys.app_directory_inactive
+            self._prepare_host()
+            with phase('update_modules'):
+                self._update_modules(inactive_dir, tag, force)
+            with phase('app_directory_switch'):
+                self._sys.app_directory_switch(tag)
+            with phase('restart_daemons'):
+                self._sys.restart_daemons()
+            self._prune_releases()
+
+    def rollback(self, to=None):
+        """
+        Activates previous (or selected) release and restarts daemons.
+        Modules aren't updated and hooks aren't run
+
+        :param str|None to: tag, slot or number of slot
+        :return web_deploy.release.Release: activated release
+        """
+        with phase('rollback'):
+            with phase('app_directory_switch'):
+                release = self._sys.rollback(to)
+            with phase('restart_daemons'):
+                self._sys.restart_daemons()
+
+        return release
+
+    async def update_async(self, session, tag=None, force=False):
+        """
+        The same as `update` but commands are sent by session (see
+        `web_deploy.aio.Session`), so one process may update many hosts.
+        Steps of host are the same blocking ones called by `session.call`,
+        modules are updated one by one
+
+        :param session: FabricSession or web_deploy.aio.Session
+        :param str tag: git tag
+        :param bool force: run all post update hooks even if their inputs
+                           are unchanged
+        """
+        def prepare():
+            with self._snapshot_installed() as snapshot:
+                inactive_dir = self._sys.app_directory_inactive
+                self._prepare_host()
+                return snapshot, inactive_dir
+
+        snapshot, inactive_dir = await session.call(prepare)
+        for prj_mod in self._p_modules:
+            prj_mod.path = inactive_dir
+        for prj_mod in self._p_modules:
+            await prj_mod.update_async(session, tag, force)
+
+        if snapshot is not None:
+            # commands of modules are sent by session, snapshot doesn't
+            # see them
+            snapshot.invalidate()
+
+        await session.call(self._activated, snapshot,
+                           self._sys.app_directory_switch, tag)
+        await self._sys.restart_daemons_async(session)
+        await session.call(self._activated, snapshot, self._prune_releases)
+
+    @staticmethod
+    def _activated(snapshot, func, *args):
+        """
+        Calls func while snapshot (if any) is active
+        """
+        if snapshot is None:
+            return func(*args)
+
+        with snapshot.activate():
+            return func(*args)
@@ -14,25 +14,49 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import fcntl
+import hashlib
+import io
 import warnings
 
-from .base import LocatedDeployEntity
-from .project import ProjectModule
+from fabric.utils import puts
+
+from .base import LocatedDeployEntity, run_sync
+from .changes import watch, SCOPE_HOST
+from .parallel import Task
+from .project import ProjectModule, run_after
+from .static import StaticCollector
 
 
 __author__ = 'y.gavenchuk'
-__all__ = ('VirtualEnv', 'PythonProjectModule', 'DjangoProjectModule', )
+__all__ = ('VirtualEnv', 'Wheelhouse', 'PythonProjectModule',
+           'DjangoProjectModule', )
 
 
 class VirtualEnv(LocatedDeployEntity):
-    __slots__ = ('_v_name', )
+    __slots__ = ('_v_name', '_seed', )
 
     DEFAULT_NAME = '.virtualenv'
 
-    def __init__(self, path, name=DEFAULT_NAME):
+    SEED_NONE = 'none'
+    SEED_COPY = 'copy'
+    SEED_HARDLINK = 'hardlink'
+
+    def __init__(self, path, name=DEFAULT_NAME, seed=SEED_NONE):
+        """
+        :param str path:
+        :param str name:
+        :param str seed: how to seed this env from another one (e.g. from
+                         active app directory) before installation of
+                         packages: "none", "copy" or "hardlink"
+        """
         super(VirtualEnv, self).__init__(path)
 
         self._v_name = str(name)
+        self._seed = seed or self.SEED_NONE
+        assert self._seed in {
+            self.SEED_NONE, self.SEED_COPY, self.SEED_HARDLINK
+        }, 'Unknown seed mode "%s"' % self._seed
 
     def _activate(self):
         return 'source "%s"' % self._os.path.join(
@@ -47,6 +71,10 @@ class VirtualEnv(LocatedDeployEntity):
     def name(self):
         return self._v_name
 
+    @property
+    def seed_mode(self):
+        return self._seed
+
     @property
     def is_exists(self):
         return self._files.exists(
@@ -54,16 +82,82 @@ class VirtualEnv(LocatedDeployEntity):
         )
 
     def run(self, command):
-        activate_str = 'source "%s"' % self._os.path.join(
-            self.directory, 'bin/activate'
-        )
+        run_sync(self.run_async(self._session(), command))
+
+    def output(self, command):
+        """
+        :param str command:
+        :return str: output of command run in this env
+        """
+        with self._cm.prefix(self._activate()):
+            return str(self._api.run(command))
 
+    async def run_async(self, session, command):
+        """
+        The same as `run` but commands are sent by session
+
+        :param session: FabricSession or web_deploy.aio.Session
+        :param str|list[str] command:
+        """
         cmd_list = command if isinstance(command, (list, tuple)) else [command]
-        with self._api.prefix(activate_str):
+        with session.prefix(self._activate()):
             for cmd in cmd_list:
-                self._api.run(cmd)
+                await session.run(cmd)
+
+    def _seed_cmd(self, source):
+        """
+        :param str source: directory of source virtual env
+        :return str:
+        """
+        paths = dict(src=source.rstrip('/'), dst=self.directory.rstrip('/'))
+
+        if self._seed == self.SEED_HARDLINK:
+            copy = 'rm -rf -- "{dst}" && cp -al -- "{src}" "{dst}"'
+        else:
+            copy = 'if command -v rsync >/dev/null; then ' \
+                   'rsync -a --delete -- "{src}/" "{dst}/"; ' \
+                   'else rm -rf -- "{dst}" && cp -a -- "{src}" "{dst}"; fi'
+
+        return 'if [ -x "{src}/bin/python" ]; then {copy} && {relocate}; ' \
+               'fi'.format(
+                   copy=copy.format(**paths),
+                   relocate=self.relocate_cmd(source),
+                   **paths
+               )
+
+    def relocate_cmd(self, source):
+        """
+        :param str source: former directory of this env
+        :return str: command which replaces `source` by directory of this
+                     env in its scripts
+        """
+        # scripts and activators contain absolute path of env. sed creates
+        # new files, so hardlinked originals remain untouched
+        return 'grep -rlIF --null -- "{src}" "{dst}/bin" ' \
+               '"{dst}"/lib/python*/site-packages/*.pth 2>/dev/null ' \
+               '| xargs -r -0 sed -i "s#{src}#{dst}#g"'.format(
+                   src=source.rstrip('/'), dst=self.directory.rstrip('/')
+               )
+
+    def seed(self, source):
+        """
+        Replaces this env by a copy of `source` env (if it exists).
+        Packages which are already installed there aren't installed again
+
+        :param str source: directory of source virtual env
+        """
+        if self._seed == self.SEED_NONE or source == self.directory:
+            return
+
+        self._api.run(self._seed_cmd(source))
+
+    def mk(self, source=None):
+        """
+        :param str source: directory of env to seed from
+        """
+        if source:
+            self.seed(source)
 
-    def mk(self):
         if self.is_exists:
             return
 
@@ -74,8 +168,22 @@ class VirtualEnv(LocatedDeployEntity):
 
         self.run('pip install -U pip setuptools')
 
-    def install_packages(self, packages_file):
-        self.mk()
+    def install_packages(self, packages_file, source=None, find_links=None):
+        """
+        :param str packages_file: path to requirements file
+        :param str source: directory of env to seed from
+        :param str find_links: directory with wheels. If it's specified
+                               packages are installed from there only, the
+                               package index isn't used at all
+        """
+        self.mk(source)
+
+        if find_links:
+            self.run('pip install --no-index --find-links="%s" -r "%s"' % (
+                find_links, packages_file
+            ))
+            return
+
         self.run([
             'pip install -U pip setuptools',
             'pip install -r "%s"' % packages_file
@@ -88,11 +196,135 @@ class VirtualEnv(LocatedDeployEntity):
         )
 
 
+class Wheelhouse(LocatedDeployEntity):
+    """
+    Wheels of python requirements. In "local" build mode wheels are built
+    once on the local machine (cached by digest of requirements file) and
+    shipped to the remote host as one archive, so remote hosts don't use the
+    package index at all. Note! Local machine should have the same platform
+    and python version as remote hosts.
+    In "remote" mode wheels are built on the remote host and reused while
+    requirements are unchanged.
+    """
+    BUILD_LOCAL = 'local'
+    BUILD_REMOTE = 'remote'
+
+    DEFAULT_CACHE_DIR = '~/.cache/web-deploy/wheels'
+    COMPLETE_MARKER = '.complete'
+
+    __slots__ = ('_build', '_cache_dir', )
+
+    def __init__(self, path, build=BUILD_LOCAL, cache_dir=DEFAULT_CACHE_DIR):
+        """
+        :param str path: remote directory of wheelhouse
+        :param str build: "local" or "remote"
+        :param str cache_dir: local directory of wheels cache
+        """
+        super(Wheelhouse, self).__init__(path)
+        assert build in {self.BUILD_LOCAL, self.BUILD_REMOTE}, \
+            'Unknown build mode "%s"' % build
+
+        self._build = build
+        self._cache_dir = self._os.path.expanduser(cache_dir)
+
+    def _remote_dir(self, digest):
+        return self._os.path.join(self.path, digest)
+
+    def _is_shipped(self, digest):
+        return self._files.exists(self._os.path.join(
+            self._remote_dir(digest), self.COMPLETE_MARKER
+        ))
+
+    def _fetch_requirements(self, packages_file):
+        """
+        :return tuple(bytes, str): requirements and their digest
+        """
+        buf = io.BytesIO()
+        self._api.get(packages_file, buf)
+        content = buf.getvalue()
+
+        return content, hashlib.sha1(content).hexdigest()
+
+    def _build_local(self, content, digest):
+        """
+        :return str: path to local archive with wheels
+        """
+        self._os.makedirs(self._cache_dir, exist_ok=True)
+        local_dir = self._os.path.join(self._cache_dir, digest)
+        archive = local_dir + '.tar.gz'
+
+        # hosts of parallel rollout share the cache
+        with open(self._os.path.join(self._cache_dir, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if self._os.path.exists(archive):
+                return archive
+
+            self._os.makedirs(local_dir, exist_ok=True)
+            rq_file = self._os.path.join(local_dir, 'requirements.txt')
+            with open(rq_file, 'wb') as fp:
+                fp.write(content)
+
+            self._api.local('pip wheel -r "{rq}" -w "{dir}" && '
+                            'tar -czf "{archive}.tmp" -C "{dir}" . && '
+                            'mv "{archive}.tmp" "{archive}"'.format(
+                                rq=rq_file, dir=local_dir, archive=archive
+                            ))
+
+        return archive
+
+    def _ship(self, archive, digest):
+        remote_dir = self._remote_dir(digest)
+        remote_archive = remote_dir + '.tar.gz'
+
+        self._api.run('mkdir -p -- "%s"' % remote_dir)
+        self._api.put(archive, remote_archive)
+        self._api.run(
+            'tar -xzf "{archive}" -C "{dir}" && rm -- "{archive}" && '
+            'touch -- "{dir}/{marker}"'.format(
+                archive=remote_archive, dir=remote_dir,
+                marker=self.COMPLETE_MARKER
+            )
+        )
+
+    def _build_remote(self, packages_file, v_env):
+        digest = self._api.run(
+            'sha1sum "%s" | cut -c1-40' % packages_file
+        ).strip()
+        if not self._is_shipped(digest):
+            remote_dir = self._remote_dir(digest)
+            v_env.run('pip wheel -r "{rq}" -w "{dir}" && '
+                      'touch -- "{dir}/{marker}"'.format(
+                          rq=packages_file, dir=remote_dir,
+                          marker=self.COMPLETE_MARKER
+                      ))
+
+        return digest
+
+    def prepare(self, packages_file, v_env):
+        """
+        Ensures that remote host has wheels of all requirements
+
+        :param str packages_file: remote path of requirements file
+        :param VirtualEnv v_env: env to build wheels with ("remote" mode)
+        :return str: remote directory with wheels
+        """
+        if self._build == self.BUILD_REMOTE:
+            return self._remote_dir(self._build_remote(packages_file, v_env))
+
+        content, digest = self._fetch_requirements(packages_file)
+        if not self._is_shipped(digest):
+            self._ship(self._build_local(content, digest), digest)
+
+        return self._remote_dir(digest)
+
+
 class PythonProjectModule(ProjectModule):
-    __slots__ = ('_v_env', '_sys', '_py_rq', '_apt_rq')
+    __slots__ = ('_v_env', '_sys', '_py_rq', '_apt_rq', '_wheelhouse', )
+
+    BUILD_HOOKS = ('puh_python', )
 
     def __init__(self, path, git, virtual_env, system, python_rq_file,
-                 apt_rq_file, container_name=None):
+                 apt_rq_file, container_name=None, wheelhouse=None):
         """
         :param Git git:
         :param VirtualEnv virtual_env:
@@ -103,6 +335,8 @@ class PythonProjectModule(ProjectModule):
         :param str apt_rq_file: path to file with system requirement pkg
                                 Note! This should be relative path.
                                 From module's container
+        :param Wheelhouse wheelhouse: install packages from wheelhouse
+                                      instead of package index
         """
         super(PythonProjectModule, self).__init__(path, git, container_name)
         self._v_env = virtual_env
@@ -110,6 +344,7 @@ class PythonProjectModule(ProjectModule):
         self._sys = system
         self._py_rq = python_rq_file
         self._apt_rq = apt_rq_file
+        self._wheelhouse = wheelhouse
 
         self._post_update_hooks = [
             self.puh_system,
@@ -122,31 +357,82 @@ class PythonProjectModule(ProjectModule):
 
         self._v_env.path = self.path
 
+    @run_after()
+    @watch(lambda m: [m._apt_rq], scope=SCOPE_HOST)
     def puh_system(self):
         self._sys.install_system_packages(
             self._sys.fs.join_path(self.path, self._apt_rq)
         )
 
+    def _active_v_env_dir(self):
+        """
+        :return str: directory of the same virtual env in active app dir
+        """
+        return self._os.path.join(
+            self._os.path.abspath(self._sys.app_directory_active),
+            self.container,
+            self._v_env.name
+        )
+
+    def snapshot_paths(self):
+        return super(PythonProjectModule, self).snapshot_paths() + [
+            self._os.path.join(self._v_env.name, 'bin', 'python'),
+        ]
+
+    def relocate_cmds(self, built_path):
+        return [self._v_env.relocate_cmd(
+            self._os.path.join(built_path, self._v_env.name)
+        )]
+
+    @run_after('puh_system')
+    @watch(lambda m: [m._py_rq])
     def puh_python(self):
+        packages_file = self._sys.fs.join_path(self.path, self._py_rq)
+        # env of build host is kept between builds, it isn't seeded
+        seeded = self._v_env.seed_mode != VirtualEnv.SEED_NONE and \
+            not self._building
+        source = self._active_v_env_dir() if seeded else None
+
+        if self._wheelhouse is None:
+            self._v_env.install_packages(packages_file, source=source)
+            return
+
+        self._v_env.mk(source)
         self._v_env.install_packages(
-            self._sys.fs.join_path(self.path, self._py_rq)
+            packages_file,
+            find_links=self._wheelhouse.prepare(packages_file, self._v_env)
         )
 
 
 class DjangoProjectModule(PythonProjectModule):
-    __slots__ = ('_manage_py', '_db', '_static_dir', '_media_dir', )
+    __slots__ = ('_manage_py', '_db', '_static_dir', '_media_dir',
+                 '_static', '_planner', )
+
+    BUILD_HOOKS = PythonProjectModule.BUILD_HOOKS + ('puh_collect_static', )
 
     def __init__(self, path, git, virtual_env, system, python_rq_file,
                  apt_rq_file, db, manage_py, collect_static=True,
-                 container_name=None, static_dir='static', media_dir=None):
+                 container_name=None, static_dir='static', media_dir=None,
+                 wheelhouse=None, static_collector=None,
+                 migration_planner=None):
+        """
+        :param StaticCollector static_collector: collect static files
+                                                 incrementally. None - run
+                                                 collectstatic only
+        :param MigrationPlanner migration_planner: skip backup and migrate
+                                                   if there are no pending
+                                                   migrations
+        """
         super(DjangoProjectModule, self).__init__(
             path, git, virtual_env, system, python_rq_file, apt_rq_file,
-            container_name
+            container_name, wheelhouse
         )
         self._manage_py = manage_py
         self._db = db
         self._static_dir = static_dir
         self._media_dir = media_dir
+        self._static = static_collector
+        self._planner = migration_planner
 
         self._post_update_hooks += [
             self.puh_db_backup,
@@ -163,19 +449,140 @@ class DjangoProjectModule(PythonProjectModule):
     def manage_py(self):
         return self._sys.fs.join_path(self.path, self._manage_py)
 
+    def snapshot_paths(self):
+        paths = super(DjangoProjectModule, self).snapshot_paths()
+        if not self._os.path.isabs(self._static_dir):
+            paths.append(self._static_dir)
+
+        return paths
+
+    def _migrations(self):
+        """
+        Migrations of the project and of installed packages
+        """
+        return [
+            (self._os.path.dirname(self._manage_py), './*/migrations/*.py'),
+            self._py_rq,
+        ]
+
+    def update(self, tag, force=False):
+        """
+        The same as ProjectModule.update. Asynchronous backup of database is
+        started before git update and is joined before migrations
+        """
+        if self._db.is_async:
+            self._db.start_backup()
+
+        super(DjangoProjectModule, self).update(tag, force)
+
+        if self._db.is_async:
+            # database hooks may be skipped if migrations are unchanged
+            self._db.join_backup()
+
+    async def update_async(self, session, tag, force=False):
+        """
+        The same as `update` but commands of git are sent by session
+        """
+        if self._db.is_async:
+            await session.call(self._db.start_backup)
+
+        await super(DjangoProjectModule, self).update_async(session, tag,
+                                                             force)
+
+        if self._db.is_async:
+            await session.call(self._db.join_backup)
+
+    def update_tasks(self, tag=None, depends=(), force=False):
+        if not self._db.is_async:
+            return super(DjangoProjectModule, self).update_tasks(
+                tag, depends, force
+            )
+
+        start = Task('%s.db_backup_start' % self.name, self._profiled,
+                     'db_backup_start', self._db.start_backup)
+        tasks = super(DjangoProjectModule, self).update_tasks(
+            tag, list(depends) + [start.name], force
+        )
+        join = Task('%s.db_backup_join' % self.name, self._profiled,
+                    'db_backup_join', self._db.join_backup,
+                    depends=[tasks[-1].name])
+
+        return [start] + tasks + [join]
+
+    def _after(self, hook):
+        after = super(DjangoProjectModule, self)._after(hook)
+        if self._plans_backup() and \
+                getattr(hook, '__name__', None) == 'puh_db_backup':
+            # plan of migrations is read by django of virtual env
+            return tuple(after or ()) + ('puh_python', )
+
+        return after
+
+    def _plans_backup(self):
+        # background backup is started before the plan is known
+        return self._planner is not None and not self._db.is_async
+
+    @run_after()
+    @watch(lambda m: m._migrations(), scope=SCOPE_HOST)
     def puh_db_backup(self):
-        self._db.create_backup()
+        if not self._plans_backup():
+            self._db.create_backup()
+            return
+
+        pending, tables = self._planner.backup_tables(self._v_env,
+                                                      self.manage_py)
+        if not pending or tables == []:
+            puts('Backup of "%s" is skipped: %s' % (
+                self.name, 'there are no pending migrations' if not pending
+                else 'pending migrations create new tables only'
+            ))
+            return
+
+        self._db.create_backup(tables)
 
+    @run_after('puh_python', 'puh_db_backup')
+    @watch(lambda m: m._migrations(), scope=SCOPE_HOST)
     def puh_migrate(self):
+        if self._db.is_async:
+            # backup has to be finished before the schema is changed
+            self._db.join_backup()
+
+        if self._planner is not None and \
+                not self._planner.pending(self._v_env, self.manage_py):
+            puts('Migrations of "%s" are skipped: there are no pending '
+                 'ones' % self.name)
+            return
+
         self._v_env.run('"%s" migrate --noinput --' % self.manage_py)
 
+    @run_after('puh_python')
+    @watch(lambda m: [
+        (m._os.path.dirname(m._manage_py), './*/static/*'),
+        m._py_rq,
+    ])
     def puh_collect_static(self):
         static_path = self._sys.fs.join_path(self.path, self._static_dir)
         if not self._sys.fs.exists(static_path):
             self._sys.fs.mkdir(static_path)
 
-        self._v_env.run('"%s" collectstatic --noinput' % self.manage_py)
+        if self._static is None:
+            self._v_env.run('"%s" collectstatic --noinput' % self.manage_py)
+            return
+
+        # build of artifact is kept on build host between builds
+        active = self.path if self._building else self._os.path.join(
+            self._os.path.abspath(self._sys.app_directory_active),
+            self.container
+        )
+        manifest_path = StaticCollector.MANIFEST_NAME
+        self._static.collect(
+            self._v_env, self.manage_py, static_path,
+            self._os.path.join(self.path, self.STATE_DIR_NAME, manifest_path),
+            self._os.path.join(active, self._static_dir),
+            self._os.path.join(active, self.STATE_DIR_NAME, manifest_path)
+        )
 
+    @run_after()
     def puh_ensure_media_root(self):
         if self._media_dir:
             warnings.warn(
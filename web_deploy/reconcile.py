@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    Desired state of files and directories. Reconciler compares desired
+    state (type, owner, group, mode, target of symlink) with actual one,
+    which is collected by one remote command (see `web_deploy.snapshot`),
+    and applies the minimal set of changes by one batched script. Nothing
+    is changed if the host is in desired state already.
+"""
+
+from .base import DeployError
+from .system import FileSystemEntity
+
+
+__author__ = 'y.gavenchuk'
+__all__ = ('DesiredState', 'Change', 'Reconciler', )
+
+
+class DesiredState(object):
+    __slots__ = ('_path', '_type', '_owner', '_group', '_mode', '_target',
+                 '_force', '_sudo', '_create_only', )
+
+    def __init__(self, path, type_, owner=None, group=None, mode=None,
+                 target=None, force=False, sudo=False, create_only=False):
+        """
+        :param str path: path of file, directory or symlink
+        :param str type_: one of FileSystemEntity.TYPE_*
+        :param str|None owner: None - any owner
+        :param str|None group: None - any group
+        :param str|None mode: octal permissions. None - any permissions
+        :param str|None target: target of symlink
+        :param bool force: replace symlink which points to another target
+                           (or a file in place of symlink)
+        :param bool sudo: create file or directory by root
+        :param bool create_only: owner, group and mode are set only when
+                                 path is created. Existing path isn't
+                                 changed
+        """
+        assert type_ != FileSystemEntity.TYPE_SYMLINK or target, \
+            'There should be not empty target of symlink!'
+
+        self._path = path
+        self._type = type_
+        self._owner = owner
+        self._group = group
+        self._mode = mode
+        self._target = target
+        self._force = force
+        self._sudo = sudo
+        self._create_only = create_only
+
+    def __str__(self):
+        return self._path
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def type(self):
+        return self._type
+
+    @property
+    def owner(self):
+        return self._owner
+
+    @property
+    def group(self):
+        return self._group
+
+    @property
+    def mode(self):
+        return self._mode
+
+    @property
+    def target(self):
+        return self._target
+
+    @property
+    def force(self):
+        return self._force
+
+    @property
+    def sudo(self):
+        return self._sudo
+
+    @property
+    def create_only(self):
+        return self._create_only
+
+    def entity(self):
+        """
+        :return FileSystemEntity: the same state for FileSystemAPI
+        """
+        if self._type == FileSystemEntity.TYPE_SYMLINK:
+            # FileSystemEntity keeps target of symlink as its path
+            return FileSystemEntity(self._target, target=self._path,
+                                    type_=self._type)
+
+        return FileSystemEntity(self._path, type_=self._type,
+                                owner=self._owner or '',
+                                group=self._group or '',
+                                mode=self._mode or '')
+
+
+class Change(object):
+    __slots__ = ('_path', '_action', '_detail', '_command', '_sudo', )
+
+    def __init__(self, path, action, detail, command, sudo=False):
+        """
+        :param str path:
+        :param str action: create, owner, mode or link
+        :param str detail: human readable difference
+        :param str command: remote command which applies the change
+        :param bool sudo:
+        """
+        self._path = path
+        self._action = action
+        self._detail = detail
+        self._command = command
+        self._sudo = sudo
+
+    def __str__(self):
+        return '{action:<6} {path}: {detail}'.format(
+            action=self._action, path=self._path, detail=self._detail
+        )
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def action(self):
+        return self._action
+
+    @property
+    def detail(self):
+        return self._detail
+
+    @property
+    def command(self):
+        return self._command
+
+    @property
+    def sudo(self):
+        return self._sudo
+
+
+class Reconciler(object):
+    __slots__ = ('_fs', )
+
+    STAT_TYPES = {
+        FileSystemEntity.TYPE_DIRECTORY: {'directory'},
+        FileSystemEntity.TYPE_FILE: {'regular file', 'regular empty file'},
+        FileSystemEntity.TYPE_SYMLINK: {'symbolic link'},
+    }
+
+    def __init__(self, fs):
+        """
+        :param web_deploy.system.FileSystemAPI fs:
+        """
+        self._fs = fs
+
+    @staticmethod
+    def _same_mode(desired, actual):
+        try:
+            return int(desired, 8) == int(actual, 8)
+        except (TypeError, ValueError):
+            return False
+
+    def _attributes(self, desired, actual):
+        """
+        :return list[Change]: fixes of owner and mode. Owner and mode of
+                              missing (`actual` is None) path are set too
+        """
+        entity = desired.entity()
+        changes = []
+        owner = '%s:%s' % (desired.owner or '', desired.group or '')
+        if (desired.owner or desired.group) and (
+            actual is None or
+            (desired.owner or actual.owner) != actual.owner or
+            (desired.group or actual.group) != actual.group
+        ):
+            changes.append(Change(
+                desired.path, 'owner', owner if actual is None else
+                '%s:%s -> %s' % (actual.owner, actual.group, owner),
+                self._fs._chown_cmd(entity), sudo=True
+            ))
+
+        if desired.mode and (
+            actual is None or not self._same_mode(desired.mode, actual.mode)
+        ):
+            changes.append(Change(
+                desired.path, 'mode', desired.mode if actual is None else
+                '%s -> %s' % (actual.mode, desired.mode),
+                self._fs._chmod_cmd(entity), sudo=True
+            ))
+
+        return changes
+
+    def _create(self, desired):
+        entity = desired.entity()
+        if desired.type == FileSystemEntity.TYPE_DIRECTORY:
+            return [Change(desired.path, 'create', 'directory',
+                           self._fs._mkdir_cmd(entity), desired.sudo)] + \
+                self._attributes(desired, None)
+
+        # mode of new file is set before its owner
+        return [Change(desired.path, 'create', 'file',
+                       self._fs._touch_cmd(entity), desired.sudo)] + \
+            list(reversed(self._attributes(desired, None)))
+
+    def _link(self, desired, actual):
+        if actual is not None and actual.type is not None:
+            if not desired.force or actual.target == desired.target:
+                return []
+
+            detail = '%s -> %s' % (actual.target or actual.type,
+                                   desired.target)
+        else:
+            detail = '-> %s' % desired.target
+
+        return [Change(
+            desired.path, 'link', detail, self._fs._symlink_cmd(
+                desired.entity(), force=desired.force
+            ), desired.sudo
+        )]
+
+    def _diff(self, desired, actual):
+        """
+        :param DesiredState desired:
+        :param web_deploy.snapshot.PathState|None actual: None - unknown
+        :return list[Change]:
+        """
+        if desired.type == FileSystemEntity.TYPE_SYMLINK:
+            if actual is None and not desired.force and (
+                self._fs.is_link(desired.path) or
+                self._fs.exists(desired.path)
+            ):
+                # `ln` fails on existing path
+                return []
+            return self._link(desired, actual)
+
+        # creation of unknown path is harmless: commands are idempotent
+        if actual is None or actual.type is None:
+            return self._create(desired)
+
+        if actual.is_link and actual.exists:
+            # symlink to directory (or file) is fine, its target isn't
+            # managed
+            return []
+
+        if actual.type not in self.STAT_TYPES[desired.type]:
+            raise DeployError('"%s" should be %s. Got %s' % (
+                desired.path, desired.type, actual.type
+            ))
+
+        if desired.create_only:
+            return []
+
+        return self._attributes(desired, actual)
+
+    def plan(self, items):
+        """
+        :param list[DesiredState] items:
+        :return list[Change]: changes which bring host to desired state
+        """
+        unique = []
+        for item in items:
+            if item.path not in {i.path for i in unique}:
+                unique.append(item)
+
+        actual = self._fs.states([i.path for i in unique])
+        changes = []
+        for item in unique:
+            changes += self._diff(item, actual.get(item.path))
+
+        return changes
+
+    def apply(self, items, dry_run=False):
+        """
+        :param list[DesiredState] items:
+        :param bool dry_run: only compute changes
+        :return list[Change]: applied (or planned) changes
+        """
+        changes = self.plan(items)
+        if dry_run or not changes:
+            return changes
+
+        with self._fs.batch():
+            for change in changes:
+                self._fs._run(change.command, change.sudo)
+
+        return changes
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    Release slots. App directory is a symlink to one of N slot directories
+    ("<app dir>1" ... "<app dir>N"). Each slot keeps a release: its tag and
+    time of the last activation are written to "<slot>/.release" on switch.
+    Deploy goes to the least recently activated slot, so the other slots
+    keep previous releases which may be activated again without update
+    (rollback). Symlink is replaced by rename(2), so it always points to a
+    complete slot.
+"""
+
+import re
+import time
+
+from .base import DeployEntity, DeployError
+
+
+__author__ = 'y.gavenchuk'
+__all__ = ('Release', 'ReleaseSlots', )
+
+
+class Release(object):
+    __slots__ = ('_slot', '_tag', '_activated', )
+
+    def __init__(self, slot, tag=None, activated=None):
+        """
+        :param str slot: path of slot directory
+        :param str|None tag: git tag of release. None - unknown
+        :param float|None activated: time of the last activation. None -
+                                     slot is empty or was never activated
+        """
+        self._slot = slot
+        self._tag = tag
+        self._activated = activated
+
+    def __str__(self):
+        return '{slot}: {tag} ({activated})'.format(
+            slot=self._slot,
+            tag=self._tag or '-',
+            activated=time.strftime(
+                '%Y-%m-%d %H:%M:%S', time.localtime(self._activated)
+            ) if self._activated else 'never activated'
+        )
+
+    @property
+    def slot(self):
+        return self._slot
+
+    @property
+    def tag(self):
+        return self._tag
+
+    @property
+    def activated(self):
+        return self._activated
+
+
+class ReleaseSlots(DeployEntity):
+    MARKER = '.release'
+
+    _number_re = re.compile(r'^(.*?)(\d+)/*$')
+
+    __slots__ = ('_link', '_count', '_keep', )
+
+    def __init__(self, link, slots=2, keep=None):
+        """
+        :param str link: path of symlink of app directory
+        :param int slots: number of slots
+        :param int|None keep: number of releases kept by `prune` (including
+                              the active one). Default - all of slots
+        """
+        super(ReleaseSlots, self).__init__()
+        self._link = link
+        self._count = int(slots)
+        self._keep = int(keep) if keep else self._count
+
+        assert self._count >= 2, 'Number of slots should be at least 2'
+        assert 1 <= self._keep <= self._count, \
+            'Number of kept releases should be between 1 and %d' % \
+            self._count
+
+    @property
+    def link(self):
+        return self._link
+
+    @property
+    def slots(self):
+        return ['%s%d' % (self._link, n) for n in range(1, self._count + 1)]
+
+    @property
+    def keep(self):
+        return self._keep
+
+    @classmethod
+    def split(cls, path):
+        """
+        :param str path: slot (or another directory of the same number,
+                         e.g. resolved target of symlink)
+        :return tuple(str, str): path without number and number of slot
+        :raise DeployError: if path has no number
+        """
+        match = cls._number_re.match(path)
+        if match is None:
+            raise DeployError('"%s" is not a release slot' % path)
+
+        return match.groups()
+
+    def _number(self, path):
+        """
+        :param str path: slot of symlink (the link is a prefix of path)
+        :return str:
+        """
+        if path.startswith(self._link) and path[len(self._link):].isdigit():
+            return path[len(self._link):]
+
+        return self.split(path)[1]
+
+    def _sibling(self, path, number):
+        """
+        :param str path: directory of slot
+        :param str number:
+        :return str: directory of slot `number` next to `path`
+        """
+        path = self._os.path.abspath(path)
+        return path[:-len(self._number(path))] + number
+
+    def _slot_of(self, path):
+        """
+        :param str path: active directory (target of symlink)
+        :return str: slot of the same number
+        """
+        return self._link + self._number(self._os.path.abspath(path))
+
+    def active(self):
+        """
+        :return str|None: slot which symlink points to. None - there is no
+                          symlink yet
+        """
+        target = str(self._api.run('readlink -- "%s"' % self._link,
+                                   quiet=True)).strip()
+        return self._slot_of(target) if target else None
+
+    def _status_cmd(self):
+        return 'for s in {slots}; do printf "%s\\t%s\\n" "$s" ' \
+               '"$(cat "$s/{marker}" 2>/dev/null)"; done'.format(
+                   slots=' '.join('"%s"' % s for s in self.slots),
+                   marker=self.MARKER
+               )
+
+    def releases(self):
+        """
+        Reads releases of all slots by one remote command
+
+        :return list[Release]:
+        """
+        known = {}
+        output = self._api.run(self._status_cmd(), quiet=True)
+        for line in str(output).splitlines():
+            slot, _, marker = line.strip('\r\n').partition('\t')
+            activated, _, tag = marker.strip().partition(' ')
+            try:
+                known[slot] = Release(slot, tag or None, float(activated))
+            except ValueError:
+                continue
+
+        return [known.get(s) or Release(s) for s in self.slots]
+
+    def inactive(self, active):
+        """
+        :param str active: target of symlink
+        :return str: slot for the next release: the least recently
+                     activated one
+        """
+        if self._count == 2:
+            # no need to ask the host
+            number = self._number(self._os.path.abspath(active))
+            return self._sibling(active, ({'1', '2'} ^ {number}).pop())
+
+        active_slot = self._slot_of(active)
+        candidates = [r for r in self.releases() if r.slot != active_slot]
+        candidates.sort(key=lambda r: r.activated or 0)
+
+        return self._sibling(active, self._number(candidates[0].slot))
+
+    def switch_cmd(self, slot, tag=None):
+        """
+        Records release of slot and points symlink to it. New symlink is
+        renamed over the old one, so the switch is atomic
+        """
+        return 'echo "$(date +%s) {tag}" > "{slot}/{marker}" && ' \
+               'rm -f -- "{link}.new" && ' \
+               'ln -sT -- "{slot}" "{link}.new" && ' \
+               'mv -fT -- "{link}.new" "{link}"'.format(
+                   tag=tag or '', slot=slot, marker=self.MARKER,
+                   link=self._link
+               )
+
+    def switch(self, slot, tag=None):
+        """
+        :param str slot: path of slot (or another directory of the same
+                         number, e.g. resolved target of symlink)
+        :param str|None tag: tag of release in slot
+        """
+        self._api.run(self.switch_cmd(slot, tag))
+
+    def _find(self, releases, to):
+        for release in releases:
+            if to in {release.tag, release.slot,
+                      self._number(release.slot)}:
+                return release
+
+        raise DeployError('Release "%s" is not found' % to)
+
+    def rollback(self, active, to=None):
+        """
+        Activates previous (or selected) release. Nothing is updated, so it
+        takes one round trip
+
+        :param str active: target of symlink
+        :param str|None to: tag, slot or number of slot. Default - the
+                            most recently activated release except of the
+                            active one
+        :return Release: activated release
+        """
+        active_slot = self._slot_of(active)
+        releases = [
+            r for r in self.releases()
+            if r.slot != active_slot and r.activated
+        ]
+        if to:
+            release = self._find(releases, str(to))
+        elif releases:
+            release = max(releases, key=lambda r: r.activated)
+        else:
+            raise DeployError('There is no release to roll back to')
+
+        self.switch(self._sibling(active, self._number(release.slot)),
+                    release.tag)
+        return release
+
+    def prune(self, active):
+        """
+        Forgets old releases, so `keep` releases are left. Only release
+        marker of slot is removed: its clones and virtualenvs are kept, so
+        the next deploy to the slot is still incremental one
+
+        :param str active: target of symlink
+        :return list[Release]: removed releases
+        """
+        if self._keep >= self._count:
+            return []
+
+        active_slot = self._slot_of(active)
+        releases = [
+            r for r in self.releases()
+            if r.slot != active_slot and r.activated
+        ]
+        releases.sort(key=lambda r: r.activated, reverse=True)
+        removed = releases[self._keep - 1:]
+        if removed:
+            self._api.run('rm -f -- %s' % ' '.join(
+                '"%s/%s"' % (r.slot, self.MARKER) for r in removed
+            ))
+
+        return removed
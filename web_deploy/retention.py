@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    Retention of backups. Backups are described by manifest (one line per
+    backup: "name created duration size checksum"), so the policy doesn't
+    need to scan the directory of backups.
+"""
+
+__author__ = 'y.gavenchuk'
+__all__ = ('Backup', 'RetentionPolicy', 'parse_size', )
+
+
+_SIZE_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+
+def parse_size(value):
+    """
+    :param str|int|None value: size in bytes or with suffix K, M, G, T
+                               (e.g. "100G")
+    :return int|None:
+    """
+    if value is None or value == '':
+        return None
+
+    value = str(value).strip().upper().rstrip('B')
+    unit = value[-1:] if value[-1:] in _SIZE_UNITS else ''
+    number = value[:-1] if unit else value
+
+    return int(float(number) * _SIZE_UNITS[unit])
+
+
+class Backup(object):
+    # mark of name of dump of some tables (see DataBase.create_backup)
+    PARTIAL_MARK = '_tables.'
+
+    __slots__ = ('_name', '_created', '_duration', '_size', '_checksum', )
+
+    def __init__(self, name, created, duration=0, size=0, checksum=None):
+        """
+        :param str name: file name of backup
+        :param int created: unix timestamp of start of backup
+        :param int duration: seconds
+        :param int size: bytes
+        :param str|None checksum: sha1 of file
+        """
+        self._name = name
+        self._created = int(created)
+        self._duration = int(duration)
+        self._size = int(size)
+        self._checksum = checksum if checksum and checksum != '-' else None
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def from_line(cls, line):
+        """
+        :param str line: line of manifest
+        :return Backup|None: None for malformed line
+        """
+        parts = line.split()
+        if len(parts) != 5:
+            return None
+
+        try:
+            return cls(*parts)
+        except ValueError:
+            return None
+
+    def to_line(self):
+        return '%s %d %d %d %s' % (self.name, self.created, self.duration,
+                                   self.size, self.checksum or '-')
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def created(self):
+        return self._created
+
+    @property
+    def duration(self):
+        return self._duration
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def checksum(self):
+        return self._checksum
+
+    @property
+    def partial(self):
+        """
+        :return bool: backup of some tables only, it can't restore database
+        """
+        return self.PARTIAL_MARK in self._name
+
+
+class RetentionPolicy(object):
+    """
+    Backup is kept if it is one of the newest `keep_last` backups or it is
+    the newest one in one of the latest `hourly` hours, `daily` days or
+    `weekly` weeks. Then the oldest of kept backups are removed until their
+    total size fits `max_size`. Full and partial backups are rotated as
+    separate groups, the newest backup of each group is never removed.
+    """
+    # bucket name => length of bucket (seconds)
+    BUCKETS = (
+        ('hourly', 3600),
+        ('daily', 86400),
+        ('weekly', 604800),
+    )
+
+    __slots__ = ('_keep_last', '_hourly', '_daily', '_weekly', '_max_size', )
+
+    def __init__(self, keep_last=5, hourly=0, daily=0, weekly=0,
+                 max_size=None):
+        """
+        :param int keep_last: number of the newest backups to keep
+        :param int hourly: number of hours with kept backup
+        :param int daily: number of days with kept backup
+        :param int weekly: number of weeks with kept backup
+        :param int|str|None max_size: quota of backups, e.g. "100G"
+        """
+        self._keep_last = int(keep_last)
+        self._hourly = int(hourly)
+        self._daily = int(daily)
+        self._weekly = int(weekly)
+        self._max_size = parse_size(max_size)
+
+        assert self._keep_last > 0, "Number of backups should be positive"
+
+    @property
+    def keep_last(self):
+        return self._keep_last
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+    def _bucketed(self, backups):
+        kept = set()
+        for bucket, length in self.BUCKETS:
+            count = getattr(self, '_' + bucket)
+            seen = set()
+            for backup in backups:
+                if len(seen) >= count:
+                    break
+
+                key = backup.created // length
+                if key not in seen:
+                    seen.add(key)
+                    kept.add(backup.name)
+
+        return kept
+
+    def select(self, backups):
+        """
+        :param list[Backup] backups:
+        :return tuple(list[Backup], list[Backup]): backups to keep and to
+                                                   remove (newest first)
+        """
+        backups = sorted(backups, key=lambda b: (b.created, b.name),
+                         reverse=True)
+        kept_names, newest = set(), set()
+        for partial in (False, True):
+            group = [b for b in backups if b.partial == partial]
+            kept_names |= {b.name for b in group[:self._keep_last]}
+            kept_names |= self._bucketed(group)
+            newest |= {b.name for b in group[:1]}
+
+        keep, remove = [], []
+        total = sum(b.size for b in backups if b.name in newest)
+        for backup in backups:
+            if backup.name in newest:
+                keep.append(backup)
+                continue
+
+            if backup.name not in kept_names:
+                remove.append(backup)
+                continue
+
+            total += backup.size
+            if self._max_size is not None and total > self._max_size:
+                remove.append(backup)
+                continue
+
+            keep.append(backup)
+
+        return keep, remove
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from fabric import context_managers
+
+from .base import DeployError
+from .parallel import Task, TaskRunner
+
+
+__author__ = 'y.gavenchuk'
+__all__ = ('Rollout', )
+
+
+def _on_host(host, func, *args):
+    with context_managers.settings(host_string=host):
+        return func(*args)
+
+
+class Rollout(object):
+    """
+    Runs the same deploy routine over a list of hosts: hosts are split into
+    rolling batches, hosts of a batch are handled in parallel. Rollout is
+    halted as soon as number of failed hosts exceeds `max_failures`.
+    """
+    __slots__ = ('_hosts', '_batch_size', '_max_failures', '_runner', )
+
+    def __init__(self, hosts, workers=None, batch_size=None, max_failures=0,
+                 pool=TaskRunner.POOL_PROCESS):
+        """
+        :param list[str] hosts: host strings
+        :param int|None workers: max number of hosts updated simultaneously
+        :param int|None batch_size: number of hosts in rolling batch.
+                                    None means all hosts in one batch
+        :param int max_failures: max number of failed hosts
+        :param str pool: "process" or "thread"
+        """
+        self._hosts = list(hosts)
+        assert len(set(self._hosts)) == len(self._hosts), \
+            "Hosts shouldn't be duplicated"
+
+        self._batch_size = int(batch_size) if batch_size else None
+        assert self._batch_size is None or self._batch_size > 0, \
+            "Batch size should be positive"
+
+        self._max_failures = int(max_failures)
+        self._runner = TaskRunner(workers, pool)
+
+    @property
+    def hosts(self):
+        return list(self._hosts)
+
+    @property
+    def max_failures(self):
+        return self._max_failures
+
+    @property
+    def batches(self):
+        size = self._batch_size or len(self._hosts) or 1
+        for i in range(0, len(self._hosts), size):
+            yield self._hosts[i:i + size]
+
+    def run(self, func, *args):
+        """
+        Calls `func(*args)` with `env.host_string` set to each of hosts
+
+        :return list[TaskResult]: results of handled hosts
+        :raise DeployError: if rollout was halted
+        """
+        results = []
+        failures = 0
+        for batch in self.batches:
+            batch_results = self._runner.run(
+                [Task(host, _on_host, host, func, *args) for host in batch]
+            )
+            results += batch_results
+            failures += len([r for r in batch_results if r.failed])
+
+            if failures > self._max_failures:
+                raise DeployError(
+                    'Rollout halted after %d failed host(s): %s' % (
+                        failures,
+                        '; '.join(str(r) for r in results if r.failed)
+                    )
+                )
+
+        return results
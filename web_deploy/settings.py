@@ -14,63 +14,378 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
+import os
+import pickle
+import tempfile
 from abc import ABCMeta, abstractmethod
 
-from six import add_metaclass, PY2
+from six import add_metaclass
 import xmltodict
 
-if PY2:
-    from codecs import open
+from .base import DeployError
 
 __author__ = 'y.gavenchuk'
 
 
+# Required elements of project. Nested dict describes children of element,
+# None - element without required children. Lists of elements are checked
+# item by item
+SCHEMA = {
+    'system': {
+        'project_tree': {'item': None},
+        'app_dir': None,
+        'log_files': {'item': None},
+        'daemons': {'daemon': None},
+    },
+    'modules': {
+        'module': {
+            'type': None,
+            'path': None,
+            'git': {'path': None, 'name': None, 'url': None},
+        },
+    },
+}
+
+# attributes of <project> which control inheritance
+_META_KEYS = ('name', 'extends', 'abstract', 'environment', )
+
+
+def validate(data, schema=SCHEMA, path='WebDeploy/project'):
+    """
+    :param dict data: parsed config
+    :param dict schema:
+    :param str path: path of `data` (used in error message)
+    :raise DeployError: if required element is missing
+    """
+    items = data if isinstance(data, list) else [data]
+    for item in items:
+        for key, children in schema.items():
+            item_path = '%s/%s' % (path, key)
+            if not isinstance(item, dict) or item.get(key) is None:
+                raise DeployError(
+                    'Invalid config: element "%s" is required' % item_path
+                )
+
+            if children:
+                validate(item[key], children, item_path)
+
+
+def _as_list(value):
+    if value is None:
+        return []
+
+    return value if isinstance(value, list) else [value]
+
+
+def merge(base, override):
+    """
+    Deep merge of configs: dicts are merged recursively, other values
+    (including lists of elements) of `override` replace the ones of `base`
+
+    :return dict: new dict
+    """
+    if not isinstance(base, dict) or not isinstance(override, dict):
+        return override
+
+    result = dict(base)
+    for key, value in override.items():
+        result[key] = merge(base[key], value) if key in base else value
+
+    return result
+
+
+class ProjectsResolver(object):
+    """
+    Resolves inheritance of projects. Config of project is merged from:
+
+        * <defaults> element;
+        * project named by `extends` attribute (resolved the same way);
+        * the project itself;
+        * its <environment name="..."> element for selected environment.
+
+    <defaults> and each parent may have environments too. Projects with
+    `abstract="1"` are templates only.
+    """
+    __slots__ = ('_defaults', '_projects', )
+
+    def __init__(self, data):
+        """
+        :param dict data: content of <WebDeploy> element
+        """
+        self._defaults = data.get('defaults') or {}
+        self._projects = {}
+        for project in _as_list(data.get('project')):
+            name = project.get('name')
+            if name in self._projects:
+                raise DeployError('Invalid config: project "%s" is '
+                                  'duplicated' % name)
+            self._projects[name] = project
+
+    @staticmethod
+    def _environments(item):
+        return {e.get('name'): e for e in _as_list(item.get('environment'))}
+
+    @classmethod
+    def _own(cls, item, environment):
+        own = {k: v for k, v in item.items() if k not in _META_KEYS}
+        env_cfg = cls._environments(item).get(environment)
+        if env_cfg:
+            own = merge(own, {
+                k: v for k, v in env_cfg.items() if k not in _META_KEYS
+            })
+
+        return own
+
+    def _chain(self, name, seen=()):
+        if name not in self._projects:
+            raise DeployError('Invalid config: unknown project "%s"' % name)
+        if name in seen:
+            raise DeployError('Invalid config: circular inheritance of '
+                              'project "%s"' % name)
+
+        project = self._projects[name]
+        parent = project.get('extends')
+        chain = self._chain(parent, seen + (name, )) if parent else []
+
+        return chain + [project]
+
+    def environments(self, name):
+        """
+        :return set[str]: names of environments available for project
+        """
+        names = set(self._environments(self._defaults))
+        for item in self._chain(name):
+            names |= set(self._environments(item))
+
+        return names
+
+    def resolve(self, name, environment=None):
+        """
+        :param str|None name: None - project without name (single project)
+        :param str|None environment:
+        :return dict: config of project
+        """
+        result = self._own(self._defaults, environment)
+        for item in self._chain(name):
+            result = merge(result, self._own(item, environment))
+
+        return result
+
+    def compile(self):
+        """
+        :return dict: (name, environment) => validated config of project.
+                      Environment None - config without environment
+        """
+        compiled = {}
+        for name, project in self._projects.items():
+            if str(project.get('abstract', '')).lower() in {'1', 'true'}:
+                continue
+
+            for environment in [None] + sorted(self.environments(name)):
+                config = self.resolve(name, environment)
+                selector = ':'.join(str(v) for v in (name, environment) if v)
+                validate(config, path='WebDeploy/project%s' % (
+                    '[%s]' % selector if selector else ''
+                ))
+                compiled[(name, environment)] = config
+
+        return compiled
+
+
+class SettingsCache(object):
+    """
+    Keeps compiled (parsed and validated) configs in memory and, if it's
+    enabled, on disk. Entry is valid while modification time and size of
+    config are the same. Otherwise content of config is hashed: touched but
+    unchanged file isn't compiled again. Disk cache keeps passwords of
+    config: its directory and files are private (0700 and 0600), it's
+    loaded only if it's owned by the current user and isn't writable by
+    others.
+    """
+    DEFAULT_DIR = '~/.cache/web-deploy/settings'
+    # environment variable which enables disk cache by default
+    DIR_VARIABLE = 'WEB_DEPLOY_SETTINGS_CACHE'
+    VERSION = 2
+
+    # path of config => (stamp of file, pickled data)
+    _memory = {}
+
+    __slots__ = ('_dir', )
+
+    def __init__(self, cache_dir=None):
+        """
+        :param str|None cache_dir: None - keep compiled configs in memory only
+        """
+        self._dir = os.path.expanduser(cache_dir) if cache_dir else None
+
+    @classmethod
+    def default(cls):
+        """
+        :return SettingsCache: disk cache is in directory of environment
+                               variable `DIR_VARIABLE` (if it's set)
+        """
+        return cls(os.environ.get(cls.DIR_VARIABLE))
+
+    @staticmethod
+    def _digest(path):
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(1 << 16), b''):
+                sha1.update(chunk)
+
+        return sha1.hexdigest()
+
+    def _entry_path(self, path):
+        name = hashlib.sha1(path.encode('utf-8')).hexdigest()
+        return os.path.join(self._dir, name + '.pickle')
+
+    @staticmethod
+    def _is_trusted(fp):
+        stat = os.fstat(fp.fileno())
+        return stat.st_uid == os.getuid() and not stat.st_mode & 0o022
+
+    def _read(self, path):
+        """
+        :return tuple|None: (version, stamp, digest, payload)
+        """
+        if not self._dir:
+            return None
+
+        try:
+            with open(self._entry_path(path), 'rb') as fp:
+                # pickle of another user may run arbitrary code
+                if not self._is_trusted(fp):
+                    return None
+                entry = pickle.load(fp)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+        return entry if entry[0] == self.VERSION else None
+
+    def _write(self, path, stamp, digest, payload):
+        if not self._dir:
+            return
+
+        try:
+            os.makedirs(self._dir, mode=0o700, exist_ok=True)
+            # existing directory isn't changed by makedirs
+            os.chmod(self._dir, 0o700)
+            with tempfile.NamedTemporaryFile(dir=self._dir,
+                                             delete=False) as fp:
+                os.fchmod(fp.fileno(), 0o600)
+                pickle.dump((self.VERSION, stamp, digest, payload), fp,
+                            pickle.HIGHEST_PROTOCOL)
+            os.replace(fp.name, self._entry_path(path))
+        except OSError:
+            # cache is optional
+            pass
+
+    def load(self, path, compile_func):
+        """
+        :param str path: path of config
+        :param callable compile_func: receives path and returns data
+        :return: data of config (own copy of caller)
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        stamp = (path, stat.st_mtime_ns, stat.st_size)
+
+        known_stamp, payload = self._memory.get(path, (None, None))
+        if known_stamp != stamp:
+            entry = self._read(path)
+            if entry is not None and entry[1] == stamp:
+                payload = entry[3]
+            else:
+                digest = self._digest(path)
+                if entry is not None and entry[2] == digest:
+                    payload = entry[3]
+                else:
+                    payload = pickle.dumps(compile_func(path),
+                                           pickle.HIGHEST_PROTOCOL)
+
+                self._write(path, stamp, digest, payload)
+
+            # one entry per config: old versions of edited config aren't
+            # kept by long-running processes
+            self._memory[path] = (stamp, payload)
+
+        return pickle.loads(payload)
+
+
 @add_metaclass(ABCMeta)
 class AbstractSettings(object):
     _parser = None
 
-    def __init__(self, config):
+    def __init__(self, config, cache=None):
+        """
+        :param str config: path of config
+        :param SettingsCache|None cache: default is SettingsCache.default()
+        """
         self._cfg_file = config
-        self._data = self.parse()
+        self._cache = cache or SettingsCache.default()
+        compiled = self.parse()
+        self._data = compiled['data']
+        self._projects = compiled['projects']
 
     @abstractmethod
+    def compile(self, path):
+        """
+        :param str path: path of config
+        :return dict: raw data ("data") and resolved and validated configs
+                      of projects ("projects", see ProjectsResolver.compile)
+        """
+
     def parse(self):
-        pass
+        return self._cache.load(self._cfg_file, self.compile)
 
     @property
     def data(self):
         return self._data
 
+    @property
+    def projects(self):
+        """
+        :return list[str]: names of projects (None for unnamed one)
+        """
+        return sorted({n for n, _ in self._projects}, key=str)
+
+    def project(self, name=None, environment=None):
+        """
+        :param str|None name: may be omitted if there is only one project
+        :param str|None environment:
+        :return dict: config of project
+        :raise DeployError: if project or environment is unknown
+        """
+        if name is None:
+            names = self.projects
+            if len(names) != 1:
+                raise DeployError('Project should be selected: %s' % ', '.join(
+                    str(n) for n in names
+                ))
+            name = names[0]
 
-class SettingsXML(AbstractSettings):
-    _wired_keys = {'@', '#'}
-    _parser = xmltodict
+        config = self._projects.get((name, environment or None))
+        if config is None:
+            raise DeployError('Unknown project "%s" (environment "%s")' % (
+                name, environment
+            ))
 
-    def _is_key_wired(self, key):
-        return key[0] in self._wired_keys
+        return config
 
-    @staticmethod
-    def _normalize_key(key):
-        return key[1:]
-
-    def _fix_wired_keys(self, data):
-        if isinstance(data, dict):
-            for k in data.keys():
-                if self._is_key_wired(str(k)):
-                    item = data.pop(k)
-                    data[self._normalize_key(k)] = item
-                else:
-                    item = data[k]
 
-                self._fix_wired_keys(item)
+class SettingsXML(AbstractSettings):
+    _parser = xmltodict
 
-        elif isinstance(data, (list, tuple, set)):
-            for item in data[:]:
-                self._fix_wired_keys(item)
+    def compile(self, path):
+        # attributes and text of elements are keys without prefix
+        with open(path, 'rb') as fp:
+            data = self._parser.parse(
+                fp, attr_prefix='', cdata_key='text'
+            )['WebDeploy']
 
-    def parse(self):
-        with open(self._cfg_file, 'r', encoding='utf-8') as fp:
-            data = self._parser.parse(fp.read())['WebDeploy']
-            self._fix_wired_keys(data)
+        if not data or not data.get('project'):
+            raise DeployError('Invalid config: element "WebDeploy/project" '
+                              'is required')
 
-            return data
+        return {'data': data, 'projects': ProjectsResolver(data).compile()}
@@ -0,0 +1,459 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    Snapshot of remote host state. Facts about paths which are checked by
+    deploy (existence, type, owner, mode and target of symlink) are gathered
+    by one remote command and then served from memory instead of separate
+    `test -e`/`test -L`/`readlink` round trips. Any command sent through
+    the snapshot which isn't known to be read only (e.g. `readlink`,
+    `test`, `ls`) may write anywhere: it invalidates all of facts, so the
+    deploy sees results of its own changes.
+
+    Snapshot is activated for the calling thread and host only: other
+    threads (and hosts) talk to the wrapped transport.
+"""
+
+import re
+import shlex
+import threading
+from contextlib import contextmanager
+
+from fabric.api import env
+
+from . import transport
+from .transport import Transport, _ContextTracker
+
+
+__author__ = 'y.gavenchuk'
+__all__ = ('PathState', 'HostSnapshot', )
+
+
+class PathState(object):
+    __slots__ = ('_exists', '_type', '_owner', '_group', '_mode',
+                 '_target', )
+
+    TYPE_SYMLINK = 'symbolic link'
+
+    def __init__(self, exists, type_=None, owner=None, group=None,
+                 mode=None, target=None):
+        """
+        :param bool exists: result of `test -e` (symlink to missing path
+                            doesn't exist)
+        :param str|None type_: type of file reported by `stat` (None - there
+                               is no such file)
+        :param str|None owner:
+        :param str|None group:
+        :param str|None mode: octal permissions
+        :param str|None target: target of symlink
+        """
+        self._exists = exists
+        self._type = type_
+        self._owner = owner
+        self._group = group
+        self._mode = mode
+        self._target = target
+
+    @property
+    def exists(self):
+        return self._exists
+
+    @property
+    def is_link(self):
+        return self._type == self.TYPE_SYMLINK
+
+    @property
+    def type(self):
+        return self._type
+
+    @property
+    def owner(self):
+        return self._owner
+
+    @property
+    def group(self):
+        return self._group
+
+    @property
+    def mode(self):
+        return self._mode
+
+    @property
+    def target(self):
+        return self._target
+
+
+class _CachedResult(str):
+    """
+    Answer from snapshot with attributes of fabric's result
+    """
+    return_code = 0
+    failed = False
+    succeeded = True
+    stderr = ''
+
+
+class HostSnapshot(_ContextTracker, Transport):
+    """
+    Transport which wraps installed one (see `web_deploy.transport`) and
+    answers checks of collected paths from memory
+    """
+    MARKER = '__wd_stat__'
+
+    _stat_fn = '_wd_stat() {{ if [ -e "$1" ] || [ -L "$1" ]; then ' \
+               'printf "{m}\\t%s\\t%s\\t" "$1" "$([ -e "$1" ] && ' \
+               'echo 1 || echo 0)"; ' \
+               'LC_ALL=C stat --printf "%F\\t%U\\t%G\\t%a\\t" -- "$1"; ' \
+               'printf "%s\\n" "$(readlink -- "$1")"; ' \
+               'else printf "{m}\\t%s\\t-\\n" "$1"; fi; }}'.format(m=MARKER)
+    _readlink_re = re.compile(r'^readlink -- "([^"]+)"$')
+    # commands which don't change the host. Command with redirection,
+    # pipe or substitution is never read only
+    READ_ONLY = frozenset({
+        'readlink', 'test', '[', 'ls', 'cat', 'stat', 'pwd', 'id', 'echo',
+        'printf', 'true', 'false',
+    })
+    _separator_re = re.compile(r'\s*(?:;|&&|\|\||\n)\s*')
+    _side_effect_re = re.compile(r'>|(?<!\|)\|(?!\|)|`|\$\(|<\(')
+    _null_re = re.compile(r'\d?>\s*/dev/null')
+
+    # snapshot activated by the thread
+    _local = threading.local()
+    # router is installed while any snapshot is active
+    _router_lock = threading.Lock()
+    _router_users = 0
+    _router_previous = None
+
+    def __init__(self, api=None, files=None, cm=None):
+        """
+        :param api: transport of commands. Default is installed one
+        :param files: transport of checks of files
+        :param cm: context managers
+        """
+        super(HostSnapshot, self).__init__()
+        current = transport.installed()
+        if isinstance(current[0], _Router):
+            current = current[0].wrapped
+        self._api = api or current[0]
+        self._files = files or current[1]
+        self._cm = cm or current[2]
+        self._host = env.host_string
+        self._states = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+
+    @classmethod
+    def current(cls):
+        """
+        :return HostSnapshot|None: snapshot activated by the calling thread
+                                   for the current host
+        """
+        snapshot = getattr(cls._local, 'snapshot', None)
+        if snapshot is not None and snapshot.host == env.host_string:
+            return snapshot
+
+        return None
+
+    @contextmanager
+    def activate(self):
+        """
+        Deploy entities of the calling thread (and host) talk to snapshot
+        for the duration of the block. Daemons keep their own transport
+        """
+        cls = HostSnapshot
+        with cls._router_lock:
+            if not cls._router_users:
+                current = transport.installed()
+                router = _Router(*current[:3])
+                cls._router_previous = transport.install(
+                    router, router, router, current[3]
+                )
+            cls._router_users += 1
+
+        previous = getattr(cls._local, 'snapshot', None)
+        cls._local.snapshot = self
+        try:
+            yield self
+        finally:
+            cls._local.snapshot = previous
+            with cls._router_lock:
+                cls._router_users -= 1
+                if not cls._router_users:
+                    transport.install(*cls._router_previous)
+                    cls._router_previous = None
+
+    @property
+    def host(self):
+        return self._host
+
+    @property
+    def hits(self):
+        """
+        :return int: number of checks answered from memory
+        """
+        return self._hits
+
+    def __contains__(self, path):
+        return path in self._states
+
+    def __len__(self):
+        return len(self._states)
+
+    def state(self, path):
+        """
+        :param str path:
+        :return PathState|None: None - path is unknown
+        """
+        with self._lock:
+            return self._states.get(path)
+
+    def _script(self, paths, link=None, slot_paths=(), slots=2):
+        commands = [self._stat_fn]
+        commands += [
+            '_wd_stat %s' % shlex.quote(p) for p in paths
+        ]
+        if link and slot_paths:
+            # slots are "<link>1" ... "<link><slots>": link points to one of
+            # them
+            commands += [
+                '_wd_slot="$(readlink -- {link})"'.format(
+                    link=shlex.quote(link)
+                ),
+                '[ -n "$_wd_slot" ] || _wd_slot=%s' % shlex.quote(
+                    link + '1'
+                ),
+                # number of slot is stripped from its path
+                '_wd_slot="${_wd_slot%"${_wd_slot##*[!0-9]}"}"',
+                'for _wd_n in {numbers}; do for _wd_p in {paths}; do '
+                '_wd_stat "$_wd_slot$_wd_n/$_wd_p"; done; '
+                'done'.format(
+                    numbers=' '.join(str(n) for n in range(1, slots + 1)),
+                    paths=' '.join(shlex.quote(p) for p in slot_paths)
+                ),
+            ]
+
+        return '; '.join(commands)
+
+    def _parse(self, line):
+        parts = line.rstrip('\r\n').split('\t')
+        if len(parts) < 3 or parts[0] != self.MARKER:
+            return None, None
+
+        if parts[2] == '-':
+            return parts[1], PathState(False)
+
+        if len(parts) != 8:
+            return None, None
+
+        path, exists, type_, owner, group, mode, target = parts[1:]
+        return path, PathState(exists == '1', type_, owner, group, mode,
+                               target or None)
+
+    def collect(self, paths, link=None, slot_paths=(), slots=2):
+        """
+        Gathers facts about paths by one remote command
+
+        :param list[str] paths:
+        :param str|None link: symlink of app directory. Its target is one
+                              of slots: "<link>1" ... "<link><slots>"
+        :param list[str] slot_paths: paths relative to each slot
+        :param int slots: number of slots
+        :return int: number of known paths
+        """
+        output = self._api.run(self._script(paths, link, slot_paths, slots),
+                               quiet=True)
+
+        states = {}
+        for line in str(output).splitlines():
+            path, path_state = self._parse(line)
+            if path is not None:
+                states[path] = path_state
+
+        with self._lock:
+            self._states.update(states)
+
+        return len(states)
+
+    def invalidate(self, *paths, **kwargs):
+        """
+        Forgets paths, their parents and children (unless `children` is
+        False). Without paths forgets everything
+        """
+        children = kwargs.get('children', True)
+        with self._lock:
+            if not paths:
+                self._states.clear()
+                return
+
+            for known in list(self._states):
+                for path in paths:
+                    path = path.rstrip('/')
+                    if known.rstrip('/') == path or \
+                            path.startswith(known.rstrip('/') + '/') or \
+                            (children and known.startswith(path + '/')):
+                        self._states.pop(known, None)
+                        break
+
+    def _is_read_only(self, command):
+        """
+        :param str command:
+        :return bool: command consists of read only commands only
+        """
+        if self._side_effect_re.search(self._null_re.sub('', command)):
+            return False
+
+        for part in self._separator_re.split(command.strip()):
+            words = part.split()
+            if words and words[0] not in self.READ_ONLY:
+                return False
+
+        return True
+
+    def _forget(self, command):
+        # prefixes are run by the host too
+        if not self._is_read_only(' && '.join(self._prefixes + [command])):
+            self.invalidate()
+
+    def _cached(self, path):
+        # relative paths are resolved by remote side
+        if self._cwd and not path.startswith('/'):
+            return None
+
+        path_state = self.state(path)
+        if path_state is not None:
+            self._hits += 1
+
+        return path_state
+
+    def _command(self, kind, command, **kwargs):
+        match = self._readlink_re.match(command)
+        if match:
+            path_state = self._cached(match.group(1))
+            if path_state is not None and path_state.is_link:
+                return _CachedResult(path_state.target)
+
+        try:
+            return getattr(self._api, kind)(command, **kwargs)
+        finally:
+            self._forget(command)
+
+    def run(self, command, **kwargs):
+        return self._command('run', command, **kwargs)
+
+    def sudo(self, command, **kwargs):
+        return self._command('sudo', command, **kwargs)
+
+    def local(self, command, **kwargs):
+        # e.g. rsync of built tree to the host
+        try:
+            return self._api.local(command, **kwargs)
+        finally:
+            self._forget(command)
+
+    def put(self, local_path=None, remote_path=None, **kwargs):
+        try:
+            return self._api.put(local_path, remote_path, **kwargs)
+        finally:
+            self._forget('"%s"' % remote_path)
+
+    def get(self, remote_path, local_path=None, **kwargs):
+        return self._api.get(remote_path, local_path, **kwargs)
+
+    def exists(self, path, use_sudo=False, verbose=False):
+        path_state = self._cached(path)
+        if path_state is not None:
+            return path_state.exists
+
+        return self._files.exists(path, use_sudo, verbose)
+
+    def is_link(self, path, use_sudo=False, verbose=False):
+        path_state = self._cached(path)
+        if path_state is not None:
+            return path_state.is_link
+
+        return self._files.is_link(path, use_sudo, verbose)
+
+    @contextmanager
+    def cd(self, path):
+        with self._cm.cd(path), self._push(self._cwd, path):
+            yield
+
+    @contextmanager
+    def prefix(self, command):
+        with self._cm.prefix(command), self._push(self._prefixes, command):
+            yield
+
+    def shell_env(self, **kwargs):
+        return self._cm.shell_env(**kwargs)
+
+
+class _Router(Transport):
+    """
+    Transport installed while any snapshot is active: calls go to snapshot
+    of the calling thread and host or to the wrapped transport
+    """
+    __slots__ = ('_api', '_files', '_cm', )
+
+    def __init__(self, api, files, cm):
+        self._api = api
+        self._files = files
+        self._cm = cm
+
+    @property
+    def wrapped(self):
+        """
+        :return tuple: (api, files, cm) of wrapped transport
+        """
+        return self._api, self._files, self._cm
+
+    def run(self, command, **kwargs):
+        return (HostSnapshot.current() or self._api).run(command, **kwargs)
+
+    def sudo(self, command, **kwargs):
+        return (HostSnapshot.current() or self._api).sudo(command, **kwargs)
+
+    def local(self, command, **kwargs):
+        return (HostSnapshot.current() or self._api).local(command,
+                                                            **kwargs)
+
+    def put(self, local_path=None, remote_path=None, **kwargs):
+        return (HostSnapshot.current() or self._api).put(
+            local_path, remote_path, **kwargs
+        )
+
+    def get(self, remote_path, local_path=None, **kwargs):
+        return (HostSnapshot.current() or self._api).get(
+            remote_path, local_path, **kwargs
+        )
+
+    def exists(self, path, use_sudo=False, verbose=False):
+        return (HostSnapshot.current() or self._files).exists(
+            path, use_sudo, verbose
+        )
+
+    def is_link(self, path, use_sudo=False, verbose=False):
+        return (HostSnapshot.current() or self._files).is_link(
+            path, use_sudo, verbose
+        )
+
+    def cd(self, path):
+        return (HostSnapshot.current() or self._cm).cd(path)
+
+    def prefix(self, command):
+        return (HostSnapshot.current() or self._cm).prefix(command)
+
+    def shell_env(self, **kwargs):
+        return (HostSnapshot.current() or self._cm).shell_env(**kwargs)
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    Incremental collection of static files. Sources of static files (found
+    by finders of django) are fingerprinted by sha256 on the server and
+    compared with the manifest of the active app directory. Collected files
+    of unchanged sources are hard-linked from the active app directory, so
+    `collectstatic` copies only new and changed files (their old copies
+    are unlinked, files of the active release are never modified). Only
+    changed files are precompressed (gzip, and brotli if its python package
+    is installed into the virtualenv). The manifest of release is written
+    after successful collection. Storages without local files (e.g. remote
+    ones) have no paths: static files are collected by plain
+    `collectstatic` then.
+"""
+
+import base64
+
+from .base import DeployEntity
+
+
+__author__ = 'y.gavenchuk'
+__all__ = ('StaticCollector', )
+
+
+# runs by `manage.py shell`: `args` is defined by StaticCollector._script
+_PREPARE = '''
+import hashlib
+import json
+import os
+
+from django.contrib.staticfiles.finders import get_finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+
+
+def _digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _local_path(storage, path):
+    # storage without local files (e.g. remote one) has no path()
+    try:
+        return storage.path(path)
+    except NotImplementedError:
+        return None
+
+
+def _remove(path):
+    if os.path.lexists(path):
+        os.remove(path)
+
+
+def _link(source, target):
+    # new name is renamed over the old one: file of active release is
+    # never changed
+    if not os.path.isfile(source):
+        _remove(target)
+        return
+    if os.path.exists(target) and os.path.samefile(source, target):
+        return
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    _remove(target + '.wd-tmp')
+    os.link(source, target + '.wd-tmp')
+    os.replace(target + '.wd-tmp', target)
+
+
+try:
+    with open(args['active_manifest']) as f:
+        known = json.load(f)['files']
+except (IOError, ValueError, KeyError, TypeError):
+    known = {}
+
+files = {}
+plain = _local_path(staticfiles_storage, '') is None
+for finder in [] if plain else get_finders():
+    for path, storage in finder.list(['CVS', '.*', '*~']):
+        prefix = getattr(storage, 'prefix', None)
+        name = os.path.join(prefix, path) if prefix else path
+        if name in files:
+            continue
+        local_path = _local_path(storage, path)
+        if local_path is None:
+            plain = True
+            break
+        files[name] = _digest(local_path)
+    if plain:
+        break
+
+changed = []
+shared = args['active_static'] == args['static']
+if plain:
+    # nothing is linked or compressed, the next release collects all
+    files = {}
+    print('Static files: storage without local paths, plain collectstatic')
+for name, digest in sorted(files.items()):
+    source = os.path.join(args['active_static'], name)
+    target = os.path.join(args['static'], name)
+    if known.get(name) == digest and os.path.isfile(source):
+        if not shared:
+            for suffix in [''] + args['suffixes']:
+                _link(source + suffix, target + suffix)
+        continue
+
+    changed.append(name)
+    # target may be a hard link to file of active release: it's unlinked,
+    # so collectstatic copies the changed file instead of touching it
+    for suffix in [''] + args['suffixes']:
+        _remove(target + suffix)
+
+os.makedirs(os.path.dirname(args['manifest']), exist_ok=True)
+with open(args['manifest'] + '.new', 'w') as f:
+    json.dump({'files': files, 'changed': changed}, f)
+
+if not plain:
+    print('Static files: %d of %d are changed' % (len(changed),
+                                                  len(files)))
+'''
+
+# runs by python of virtualenv after collectstatic
+_FINISH = '''
+import gzip
+import io
+import json
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _write(path, data):
+    with open(path + '.wd-tmp', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.wd-tmp', path)
+
+
+def _gzip(data):
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=9,
+                       mtime=0) as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+with open(args['manifest'] + '.new') as f:
+    manifest = json.load(f)
+
+for name in manifest['changed'] if args['compress'] else []:
+    path = os.path.join(args['static'], name)
+    extension = os.path.splitext(name)[1].lower()
+    if extension not in args['extensions'] or not os.path.isfile(path):
+        continue
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < args['min_size']:
+        continue
+
+    _write(path + '.gz', _gzip(data))
+    if brotli is not None:
+        _write(path + '.br', brotli.compress(data))
+
+os.replace(args['manifest'] + '.new', args['manifest'])
+'''
+
+
+class StaticCollector(DeployEntity):
+    MANIFEST_NAME = 'static.manifest'
+    COMPRESSED_SUFFIXES = ('.gz', '.br', )
+    COMPRESSED_EXTENSIONS = ('.css', '.js', '.json', '.map', '.svg', '.txt',
+                             '.xml', '.html', '.ico', '.eot', '.ttf', '.otf')
+    MIN_COMPRESSED_SIZE = 256
+
+    __slots__ = ('_compress', )
+
+    def __init__(self, compress=True):
+        """
+        :param bool compress: precompress changed static files
+        """
+        super(StaticCollector, self).__init__()
+        self._compress = compress
+
+    @property
+    def compress(self):
+        return self._compress
+
+    @staticmethod
+    def _script(code, **kwargs):
+        """
+        :return str: python command which runs code with `args`. It's
+                     encoded, so it's passed through any shell as is
+        """
+        source = 'args = %r\n%s' % (kwargs, code)
+        return 'import base64; exec(base64.b64decode(\'%s\'))' % (
+            base64.b64encode(source.encode('utf-8')).decode('ascii')
+        )
+
+    def collect_cmd(self, manage_py, static, manifest, active_static,
+                    active_manifest):
+        """
+        :param str manage_py: path of manage.py
+        :param str static: directory of collected static files
+        :param str manifest: path of manifest of this release
+        :param str active_static: directory of static files of the active
+                                  release (may be the same as `static`)
+        :param str active_manifest: path of manifest of the active release
+        :return str: one command: preparation, collectstatic and
+                     compression. It should be run in virtualenv
+        """
+        args = dict(static=static, manifest=manifest)
+        prepare = self._script(
+            _PREPARE, active_static=active_static,
+            active_manifest=active_manifest,
+            suffixes=list(self.COMPRESSED_SUFFIXES), **args
+        )
+        finish = self._script(
+            _FINISH, compress=self._compress,
+            extensions=list(self.COMPRESSED_EXTENSIONS),
+            min_size=self.MIN_COMPRESSED_SIZE, **args
+        )
+
+        return '"{manage_py}" shell -c "{prepare}" && ' \
+               '"{manage_py}" collectstatic --noinput && ' \
+               'python -c "{finish}"'.format(manage_py=manage_py,
+                                             prepare=prepare, finish=finish)
+
+    def collect(self, v_env, manage_py, static, manifest, active_static,
+                active_manifest):
+        """
+        Collects static files by one remote command. See `collect_cmd`
+
+        :param web_deploy.python.VirtualEnv v_env:
+        """
+        v_env.run(self.collect_cmd(manage_py, static, manifest,
+                                   active_static, active_manifest))
@@ -14,14 +14,22 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+from contextlib import contextmanager
+
 from six import string_types
 
 from .base import DeployEntity, DeployError
+from .batch import CommandBatch
 from .daemon import Daemon
+from .parallel import Task, TaskRunner
+from .profiler import phase, profiled
+from .release import ReleaseSlots
+from .snapshot import HostSnapshot
 
 
 __author__ = 'y.gavenchuk'
-__all__ = ('System', )
+__all__ = ('System', 'AsyncFileSystemAPI', )
 
 
 class FileSystemEntity(object):
@@ -150,68 +158,166 @@ class FileSystemEntity(object):
 
 
 class FileSystemAPI(DeployEntity):
+    def __init__(self):
+        super(FileSystemAPI, self).__init__()
+        self._batch = None
+
     def _run(self, cmd, sudo=False):
+        if self._batch is not None:
+            return self._batch.add(cmd, sudo)
+
         if sudo:
             return self._api.sudo(cmd)
 
         return self._api.run(cmd)
 
-    def mkdir(self, item, sudo=False):
+    def _flush(self):
         """
-        :param FileSystemEntity item:
-        :param bool sudo:
+        Queries should see results of all previous commands
         """
-        fse_item = FileSystemEntity(item)
-        self._run('mkdir -p -- "%s"' % fse_item.path, sudo)
+        if self._batch is not None:
+            self._batch.flush()
 
-    def chown(self, item):
+    @contextmanager
+    def batch(self):
+        """
+        Collects all commands of this API and executes them at exit as one
+        remote script per privilege level. Nested calls share outer batch.
+
+        :return CommandBatch:
+        """
+        if self._batch is not None:
+            yield self._batch
+            return
+
+        batch = self._batch = CommandBatch(self._api)
+        try:
+            yield batch
+        finally:
+            self._batch = None
+
+        batch.flush()
+
+    @staticmethod
+    def _mkdir_cmd(item):
+        return 'mkdir -p -- "%s"' % FileSystemEntity(item).path
+
+    @staticmethod
+    def _chown_cmd(item):
         fse_item = FileSystemEntity(item)
+        if not (fse_item.group or fse_item.owner):
+            return None
 
-        if fse_item.group or fse_item.owner:
-            self._api.sudo('chown {owner}:{group} -- "{path}"'.format(
-                owner=fse_item.owner,
-                group=fse_item.group,
-                path=fse_item.path
-            ))
+        return 'chown {owner}:{group} -- "{path}"'.format(
+            owner=fse_item.owner,
+            group=fse_item.group,
+            path=fse_item.path
+        )
 
-    def chmod(self, item):
+    @staticmethod
+    def _chmod_cmd(item):
         fse_item = FileSystemEntity(item)
         if not fse_item.mode:
-            return
+            return None
 
-        self._api.sudo('chmod {mode} -- "{path}"'.format(
+        return 'chmod {mode} -- "{path}"'.format(
             mode=fse_item.mode,
             path=fse_item.path
-        ))
+        )
+
+    @staticmethod
+    def _readlink_cmd(item):
+        return 'readlink -- "{0}"'.format(str(item))
+
+    @staticmethod
+    def _touch_cmd(item):
+        return 'touch -- "%s"' % str(item)
+
+    @staticmethod
+    def _symlink(item):
+        """
+        :return FileSystemEntity: validated symlink
+        """
+        fse = FileSystemEntity(item)
+        if fse.type != FileSystemEntity.TYPE_SYMLINK:
+            raise DeployError("Symlink expected!. Got '%s'" % fse.type)
+
+        if fse.path == fse.target:
+            raise DeployError("Source and target are equ`al! '%s'" % str(fse))
+
+        return fse
+
+    @staticmethod
+    def _symlink_cmd(fse, force=False):
+        return 'ln -s{force}T -- "{source}" "{target}"'.format(
+            source=fse.path,
+            target=fse.target,
+            force='f' if force else ''
+        )
+
+    def mkdir(self, item, sudo=False):
+        """
+        :param FileSystemEntity item:
+        :param bool sudo:
+        """
+        self._run(self._mkdir_cmd(item), sudo)
+
+    def chown(self, item):
+        cmd = self._chown_cmd(item)
+        if cmd:
+            self._run(cmd, sudo=True)
+
+    def chmod(self, item):
+        cmd = self._chmod_cmd(item)
+        if cmd:
+            self._run(cmd, sudo=True)
 
     def exists(self, item):
+        self._flush()
         return self._files.exists(str(item))
 
+    def is_link(self, item):
+        self._flush()
+        return self._files.is_link(str(item))
+
+    def states(self, paths):
+        """
+        Facts about paths (see `web_deploy.snapshot.PathState`). Installed
+        snapshot answers about known paths, the rest are collected by one
+        remote command
+
+        :param list[str] paths:
+        :return dict: path => PathState (None - state is unknown)
+        """
+        self._flush()
+        snapshot = HostSnapshot.current()
+        if snapshot is None:
+            snapshot = HostSnapshot(self._api, self._files, self._cm)
+
+        unknown = [p for p in paths if snapshot.state(p) is None]
+        if unknown:
+            snapshot.collect(unknown)
+
+        return {p: snapshot.state(p) for p in paths}
+
     def readlink(self, item):
         """
         :param FileSystemEntity|str item:
 
         :return str:
         """
-        return self._api.run('readlink -- "{0}"'.format(str(item)))
+        self._flush()
+        return self._api.run(self._readlink_cmd(item))
 
     def touch(self, item, sudo=False):
-        self._run('touch -- "%s"' % str(item), sudo)
+        self._run(self._touch_cmd(item), sudo)
 
     def mk_symlink(self, item, force=False):
-        fse = FileSystemEntity(item)
-        if fse.type != FileSystemEntity.TYPE_SYMLINK:
-            raise DeployError("Symlink expected!. Got '%s'" % fse.type)
-
-        if fse.path == fse.target:
-            raise DeployError("Source and target are equ`al! '%s'" % str(fse))
-
-        if not self.exists(fse.target) or force:
-            self._api.run('ln -s{force}T -- "{source}" "{target}"'.format(
-                source=fse.path,
-                target=fse.target,
-                force='f' if force else ''
-            ))
+        fse = self._symlink(item)
+        # forced link is replaced by `ln -f`: no need to flush the batch
+        # to check the target
+        if force or not self.exists(fse.target):
+            self._run(self._symlink_cmd(fse, force))
 
     def join_path(self, *paths):
         return self._os.path.join(
@@ -219,10 +325,95 @@ class FileSystemAPI(DeployEntity):
         )
 
 
+class AsyncFileSystemAPI(FileSystemAPI):
+    """
+    The same as FileSystemAPI but commands are sent by session (see
+    `web_deploy.aio.Session`) and methods are coroutines. Batch can't be
+    flushed at exit of `with` block: it's flushed by `flush`
+    """
+    def __init__(self, session):
+        super(AsyncFileSystemAPI, self).__init__()
+        self._session = session
+
+    async def _run(self, cmd, sudo=False):
+        if self._batch is not None:
+            return self._batch.add(cmd, sudo)
+
+        if sudo:
+            return await self._session.sudo(cmd)
+
+        return await self._session.run(cmd)
+
+    async def _flush(self):
+        if self._batch is not None:
+            await self._batch.flush_async(self._session)
+
+    @contextmanager
+    def batch(self):
+        """
+        Collects commands until `flush`. Nested calls share outer batch,
+        see `FileSystemAPI.batch`
+
+        :return CommandBatch:
+        """
+        if self._batch is None:
+            self._batch = CommandBatch()
+
+        yield self._batch
+
+    async def flush(self):
+        """
+        Executes commands of batch and closes it
+        """
+        await self._flush()
+        self._batch = None
+
+    async def mkdir(self, item, sudo=False):
+        await self._run(self._mkdir_cmd(item), sudo)
+
+    async def chown(self, item):
+        cmd = self._chown_cmd(item)
+        if cmd:
+            await self._run(cmd, sudo=True)
+
+    async def chmod(self, item):
+        cmd = self._chmod_cmd(item)
+        if cmd:
+            await self._run(cmd, sudo=True)
+
+    async def exists(self, item):
+        await self._flush()
+        return await self._session.exists(str(item))
+
+    async def readlink(self, item):
+        await self._flush()
+        return await self._session.run(self._readlink_cmd(item))
+
+    async def touch(self, item, sudo=False):
+        await self._run(self._touch_cmd(item), sudo)
+
+    async def mk_symlink(self, item, force=False):
+        fse = self._symlink(item)
+        if force or not await self.exists(fse.target):
+            await self._run(self._symlink_cmd(fse, force))
+
+
 class System(DeployEntity):
-    __slots__ = ('_tree', '_log_files', '_app_dir', '_daemons', '_fs', )
+    __slots__ = ('_tree', '_log_files', '_app_dir', '_daemons', '_fs',
+                 '_concurrent_restart', '_releases', )
 
-    def __init__(self, project_tree, app_dir, log_files, daemons=None):
+    def __init__(self, project_tree, app_dir, log_files, daemons=None,
+                 concurrent_restart=False, releases=None):
+        """
+        :param list project_tree:
+        :param str app_dir:
+        :param list log_files:
+        :param list[Daemon] daemons:
+        :param bool concurrent_restart: restart daemons in parallel (with
+                                        respect to their `after` option)
+        :param dict|None releases: options of ReleaseSlots (number of
+                                   slots and kept releases)
+        """
         super(System, self).__init__()
         self._tree = project_tree
         self._log_files = log_files
@@ -234,43 +425,18 @@ class System(DeployEntity):
         for d in daemons:
             assert isinstance(d, Daemon), daemon_err_msg % type(d)
         self._daemons = daemons or []
+        self._concurrent_restart = concurrent_restart
 
         self._fs = FileSystemAPI()
+        self._releases = ReleaseSlots(app_dir, **(releases or {}))
 
-    def _mk_log_dir(self, dir_item):
-        fse_dir = FileSystemEntity(
-            dir_item,
-            type_=FileSystemEntity.TYPE_DIRECTORY,
-            owner='www-data',
-            group='www-data',
-            mode='755'
-        )
-        self.fs.mkdir(fse_dir, sudo=True)
-        self.fs.chown(fse_dir)
-        self.fs.chmod(fse_dir)
-
-    def _mk_file(self, file_item):
-        """
-        :param FileSystemEntity file_item:
-        """
-        self.fs.touch(file_item, sudo=True)
-        self.fs.chmod(file_item)
-        self.fs.chown(file_item)
-
-    def _mk_log(self, log_file):
-        fs_log = FileSystemEntity(log_file)
-
-        if not self.fs.exists(fs_log.path):
-            self._mk_log_dir(self._os.path.dirname(fs_log.path))
-            self._mk_file(fs_log)
-
-    def _mk_symlink(self, source, target):
-        fse_item = FileSystemEntity(
+    @staticmethod
+    def _symlink_item(source, target):
+        return FileSystemEntity(
             source,
             target=target,
             type_=FileSystemEntity.TYPE_SYMLINK,
         )
-        self.fs.mk_symlink(fse_item, force=True)
 
     @property
     def fs(self):
@@ -280,34 +446,198 @@ class System(DeployEntity):
     def app_directory(self):
         return self._app_dir
 
+    @property
+    def releases(self):
+        """
+        :return ReleaseSlots:
+        """
+        return self._releases
+
     @property
     def app_directory_active(self):
         return self.fs.readlink(self.app_directory)
 
     @property
     def app_directory_inactive(self):
-        active_dir = self._os.path.abspath(self.app_directory_active)
-        inactive_dir_suffix = ({'1', '2'} ^ {active_dir[-1]}).pop()
+        return self._releases.inactive(self.app_directory_active)
 
-        return active_dir[:-1] + inactive_dir_suffix
+    def app_directory_switch(self, tag=None):
+        """
+        :param str|None tag: tag of release in inactive app directory
+        """
+        self._releases.switch(self.app_directory_inactive, tag)
 
-    def app_directory_switch(self):
-        self._mk_symlink(self.app_directory_inactive, self.app_directory)
+    def rollback(self, to=None):
+        """
+        Switches app directory to previous (or selected) release
 
-    def create_project_tree(self):
+        :param str|None to: tag, slot or number of slot
+        :return web_deploy.release.Release:
+        """
+        return self._releases.rollback(self.app_directory_active, to)
+
+    def prune_releases(self):
+        """
+        :return list[web_deploy.release.Release]: removed releases
+        """
+        return self._releases.prune(self.app_directory_active)
+
+    def _desired_tree(self, desired_state):
+        items = []
         for directory in self._tree:
-            self.fs.mkdir(directory)
+            fse = FileSystemEntity(directory)
+            # owner and mode of directory are managed if they're configured
+            attrs = directory if isinstance(directory, dict) else {}
+            items.append(desired_state(
+                fse.path, FileSystemEntity.TYPE_DIRECTORY,
+                owner=fse.owner if 'owner' in attrs else None,
+                group=fse.group if 'group' in attrs else None,
+                mode=fse.mode if 'mode' in attrs else None
+            ))
+
+        # app directory points to the first slot unless it's switched
+        items.append(desired_state(
+            self.app_directory, FileSystemEntity.TYPE_SYMLINK,
+            target=self.app_directory + '1'
+        ))
+
+        return items
+
+    def _desired_logs(self, desired_state):
+        items = []
+        for log_file in self._log_files:
+            fse = FileSystemEntity(log_file)
+            items += [
+                desired_state(
+                    self._os.path.dirname(fse.path),
+                    FileSystemEntity.TYPE_DIRECTORY,
+                    owner='www-data', group='www-data', mode='755',
+                    sudo=True, create_only=True
+                ),
+                desired_state(
+                    fse.path, FileSystemEntity.TYPE_FILE, owner=fse.owner,
+                    group=fse.group, mode=fse.mode, sudo=True,
+                    create_only=True
+                ),
+            ]
+
+        return items
+
+    def reconcile(self, dry_run=False, tree=True, logs=True):
+        """
+        Brings project tree and log files to desired state by the minimal
+        set of changes
+
+        :param bool dry_run: only compute changes
+        :param bool tree: project tree and symlink of app directory
+        :param bool logs: log files and their directories
+        :return list[web_deploy.reconcile.Change]:
+        """
+        # reconcile module depends on this one
+        from .reconcile import DesiredState, Reconciler
+
+        items = []
+        if tree:
+            items += self._desired_tree(DesiredState)
+        if logs:
+            items += self._desired_logs(DesiredState)
 
-        if not self._files.is_link(self.app_directory):
-            self._mk_symlink(self.app_directory + '1', self.app_directory)
+        return Reconciler(self.fs).apply(items, dry_run)
+
+    def create_project_tree(self):
+        return self.reconcile(logs=False)
 
     def install_system_packages(self, apt_pkg_file):
         self._api.sudo('apt-get -y install -- `cat "%s"`' % apt_pkg_file)
 
     def ensure_log_files(self):
-        for f in self._log_files:
-            self._mk_log(f)
+        return self.reconcile(tree=False)
+
+    def snapshot_paths(self):
+        """
+        :return list[str]: paths which are checked by deploy of project
+                           (see `web_deploy.snapshot`)
+        """
+        paths = [self.app_directory]
+        paths += [FileSystemEntity(d).path for d in self._tree]
+        for log_file in self._log_files:
+            log_path = FileSystemEntity(log_file).path
+            paths += [self._os.path.dirname(log_path), log_path]
+
+        return paths
 
     def restart_daemons(self):
+        if not self._concurrent_restart:
+            for daemon in self._daemons:
+                with phase('daemon:%s' % daemon.name):
+                    daemon.apply()
+            return
+
+        results = TaskRunner().run([
+            Task(d.name, profiled, 'daemon:%s' % d.name, d.apply,
+                 depends=d.after)
+            for d in self._daemons
+        ])
+        failed = [r for r in results if r.failed]
+        if failed:
+            raise DeployError('Restart of daemons failed: %s' % '; '.join(
+                str(r) for r in failed
+            ))
+
+    def _ordered_daemons(self):
+        """
+        :return list[Daemon]: daemons sorted by their `after` option
+        """
+        names = [d.name for d in self._daemons]
         for daemon in self._daemons:
-            daemon.restart()
+            unknown = set(daemon.after).difference(names)
+            if unknown:
+                raise DeployError('Unknown daemons "%s" after "%s"' % (
+                    '", "'.join(sorted(unknown)), daemon.name
+                ))
+
+        order = []
+        while len(order) < len(self._daemons):
+            ready = [
+                d for d in self._daemons
+                if d not in order and
+                set(d.after).issubset(o.name for o in order)
+            ]
+            if not ready:
+                raise DeployError('Daemons "%s" depend on each other' % (
+                    '", "'.join(d.name for d in self._daemons
+                                if d not in order)
+                ))
+            order.append(ready[0])
+
+        return order
+
+    # The same as `restart_daemons` but commands are sent by session (see
+    # `web_deploy.aio.Session`), concurrent restart doesn't fork processes
+
+    async def restart_daemons_async(self, session):
+        if not self._concurrent_restart:
+            for daemon in self._daemons:
+                await daemon.apply_async(session)
+            return
+
+        futures = {}
+
+        async def apply(daemon):
+            await asyncio.gather(*[futures[name] for name in daemon.after])
+            await daemon.apply_async(session)
+
+        # futures of daemons are created after futures they wait for
+        for daemon in self._ordered_daemons():
+            futures[daemon.name] = asyncio.ensure_future(apply(daemon))
+
+        results = await asyncio.gather(*futures.values(),
+                                       return_exceptions=True)
+        failed = [
+            '%s: %s' % (name, error)
+            for name, error in zip(futures, results) if error is not None
+        ]
+        if failed:
+            raise DeployError('Restart of daemons failed: %s' % '; '.join(
+                failed
+            ))
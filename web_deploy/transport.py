@@ -0,0 +1,481 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Yuriy Gavenchuk aka murminathor
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    Transports of remote commands. Deploy entities talk to remote host by
+    `_api`, `_files` and `_cm` attributes (fabric's modules by default).
+    Transport implements the subset of them used by web_deploy and may be
+    installed instead:
+
+        * FabricTransport - fabric itself;
+        * LocalFabricTransport - remote commands are executed by fabric's
+          `local` (e.g. build on the local machine);
+        * RecordingTransport - records commands passed to another transport;
+        * SimulatedTransport - doesn't execute anything, answers by canned
+          responses and accounts simulated latency of each round trip.
+"""
+
+import json
+import multiprocessing
+import os
+import re
+import shlex
+import shutil
+import time
+from abc import ABCMeta, abstractmethod
+from contextlib import contextmanager
+
+from fabric import api as fab_api, context_managers as fab_cm
+from fabric.contrib import files as fab_files
+from six import add_metaclass
+
+from .base import DeployEntity
+from .daemon import Daemon
+
+
+__author__ = 'y.gavenchuk'
+__all__ = ('Transport', 'FabricTransport', 'LocalFabricTransport',
+           'RecordingTransport',
+           'SimulatedTransport', 'SimulatedResult', 'install', 'installed',
+           'using', )
+
+
+def installed():
+    """
+    :return tuple: current (api, files, cm) of deploy entities and api of
+                   daemons
+    """
+    return (DeployEntity._api, DeployEntity._files, DeployEntity._cm,
+            Daemon._api)
+
+
+def install(api=None, files=None, cm=None, daemon_api=None):
+    """
+    Replaces `_api`, `_files` and `_cm` of deploy entities and `_api` of
+    daemons (the same as of entities by default). None leaves an attribute
+    unchanged
+
+    :return tuple: previous values, see `installed`
+    """
+    previous = installed()
+    if api is not None:
+        DeployEntity._api = api
+    if files is not None:
+        DeployEntity._files = files
+    if cm is not None:
+        DeployEntity._cm = cm
+    if daemon_api is not None or api is not None:
+        Daemon._api = daemon_api or api
+
+    return previous
+
+
+@contextmanager
+def using(transport):
+    """
+    Installs transport for the duration of the block
+
+    :param Transport transport:
+    """
+    previous = install(transport, transport, transport)
+    try:
+        yield transport
+    finally:
+        install(*previous)
+
+
+@add_metaclass(ABCMeta)
+class Transport(object):
+    """
+    Interface of transport: fabric-like commands, file transfers, checks of
+    remote files and context managers
+    """
+    @abstractmethod
+    def run(self, command, **kwargs):
+        pass
+
+    @abstractmethod
+    def sudo(self, command, **kwargs):
+        pass
+
+    @abstractmethod
+    def local(self, command, **kwargs):
+        pass
+
+    @abstractmethod
+    def put(self, local_path=None, remote_path=None, **kwargs):
+        pass
+
+    @abstractmethod
+    def get(self, remote_path, local_path=None, **kwargs):
+        pass
+
+    @abstractmethod
+    def exists(self, path, use_sudo=False, verbose=False):
+        pass
+
+    @abstractmethod
+    def is_link(self, path, use_sudo=False, verbose=False):
+        pass
+
+    @abstractmethod
+    def cd(self, path):
+        pass
+
+    @abstractmethod
+    def prefix(self, command):
+        pass
+
+    @abstractmethod
+    def shell_env(self, **kwargs):
+        pass
+
+
+class FabricTransport(Transport):
+    def run(self, command, **kwargs):
+        return fab_api.run(command, **kwargs)
+
+    def sudo(self, command, **kwargs):
+        return fab_api.sudo(command, **kwargs)
+
+    def local(self, command, **kwargs):
+        return fab_api.local(command, **kwargs)
+
+    def put(self, local_path=None, remote_path=None, **kwargs):
+        return fab_api.put(local_path, remote_path, **kwargs)
+
+    def get(self, remote_path, local_path=None, **kwargs):
+        return fab_api.get(remote_path, local_path, **kwargs)
+
+    def exists(self, path, use_sudo=False, verbose=False):
+        return fab_files.exists(path, use_sudo, verbose)
+
+    def is_link(self, path, use_sudo=False, verbose=False):
+        return fab_files.is_link(path, use_sudo, verbose)
+
+    def cd(self, path):
+        return fab_api.cd(path)
+
+    def prefix(self, command):
+        return fab_api.prefix(command)
+
+    def shell_env(self, **kwargs):
+        return fab_cm.shell_env(**kwargs)
+
+
+class LocalFabricTransport(FabricTransport):
+    """
+    Executes "remote" commands on the local machine
+    """
+    SHELL = '/bin/bash'
+
+    def _local(self, command, warn_only=False, quiet=False, **kwargs):
+        options = {'warn_only': warn_only or quiet}
+        hide = ('running', 'stdout', 'stderr') if quiet else ()
+        with fab_api.settings(fab_cm.hide(*hide), **options):
+            return fab_api.local(command, capture=True, shell=self.SHELL)
+
+    def run(self, command, **kwargs):
+        return self._local(command, **kwargs)
+
+    def sudo(self, command, **kwargs):
+        return self._local('sudo -n %s -c %s' % (
+            self.SHELL, shlex.quote(command)
+        ), **kwargs)
+
+    @staticmethod
+    def _copy(source, target):
+        if hasattr(target, 'write'):
+            with open(os.path.expanduser(source), 'rb') as fp:
+                target.write(fp.read())
+        elif hasattr(source, 'read'):
+            with open(os.path.expanduser(target), 'wb') as fp:
+                fp.write(source.read())
+        else:
+            shutil.copy(os.path.expanduser(source),
+                        os.path.expanduser(target))
+
+    def put(self, local_path=None, remote_path=None, **kwargs):
+        self._copy(local_path, remote_path)
+        return [remote_path]
+
+    def get(self, remote_path, local_path=None, **kwargs):
+        self._copy(remote_path, local_path)
+        return [local_path]
+
+    def exists(self, path, use_sudo=False, verbose=False):
+        return os.path.exists(os.path.expanduser(path))
+
+    def is_link(self, path, use_sudo=False, verbose=False):
+        return os.path.islink(os.path.expanduser(path))
+
+    def cd(self, path):
+        return fab_api.lcd(path)
+
+
+class _ContextTracker(object):
+    """
+    Keeps state of `cd`, `prefix` and `shell_env` blocks and composes
+    commands the same way as fabric does
+    """
+    def __init__(self):
+        self._cwd = []
+        self._prefixes = []
+        self._env = []
+
+    @contextmanager
+    def _push(self, stack, value):
+        stack.append(value)
+        try:
+            yield
+        finally:
+            stack.pop()
+
+    def cd(self, path):
+        return self._push(self._cwd, path)
+
+    def prefix(self, command):
+        return self._push(self._prefixes, command)
+
+    def shell_env(self, **kwargs):
+        return self._push(self._env, kwargs)
+
+    def _full_command(self, command):
+        parts = []
+        if self._env:
+            env = {}
+            for item in self._env:
+                env.update(item)
+            parts.append('export %s' % ' '.join(
+                '%s="%s"' % (k, v) for k, v in sorted(env.items())
+            ))
+        if self._cwd:
+            parts.append('cd %s' % self._join_cwd(self._cwd))
+        parts += self._prefixes
+        parts.append(command)
+
+        return ' && '.join(parts)
+
+    @staticmethod
+    def _join_cwd(paths):
+        path = ''
+        for item in paths:
+            path = item if item.startswith('/') or not path else \
+                '%s/%s' % (path, item)
+
+        return path
+
+
+class RecordingTransport(_ContextTracker, Transport):
+    """
+    Passes all of calls to another transport and records them
+    """
+    def __init__(self, transport=None):
+        """
+        :param Transport|None transport: default is FabricTransport
+        """
+        super(RecordingTransport, self).__init__()
+        self._transport = transport or FabricTransport()
+        self._records = []
+
+    @property
+    def records(self):
+        """
+        :return list[dict]: kind of call, its target (command or path) and
+                            duration (seconds)
+        """
+        return list(self._records)
+
+    def _record(self, kind, target, func, *args, **kwargs):
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._records.append({
+                'kind': kind,
+                'target': target,
+                'duration': time.time() - start,
+            })
+
+    def _command(self, kind, command, **kwargs):
+        func = getattr(self._transport, kind)
+        full_command = self._full_command(command)
+        # context is replayed to inner transport
+        with self._replay():
+            return self._record(kind, full_command, func, command, **kwargs)
+
+    @contextmanager
+    def _replay(self):
+        managers = [self._transport.cd(p) for p in self._cwd]
+        managers += [self._transport.prefix(p) for p in self._prefixes]
+        managers += [self._transport.shell_env(**e) for e in self._env]
+        entered = []
+        try:
+            for manager in managers:
+                manager.__enter__()
+                entered.append(manager)
+            yield
+        finally:
+            for manager in reversed(entered):
+                manager.__exit__(None, None, None)
+
+    def run(self, command, **kwargs):
+        return self._command('run', command, **kwargs)
+
+    def sudo(self, command, **kwargs):
+        return self._command('sudo', command, **kwargs)
+
+    def local(self, command, **kwargs):
+        return self._record('local', command, self._transport.local,
+                            command, **kwargs)
+
+    def put(self, local_path=None, remote_path=None, **kwargs):
+        return self._record('put', remote_path, self._transport.put,
+                            local_path, remote_path, **kwargs)
+
+    def get(self, remote_path, local_path=None, **kwargs):
+        return self._record('get', remote_path, self._transport.get,
+                            remote_path, local_path, **kwargs)
+
+    def exists(self, path, use_sudo=False, verbose=False):
+        return self._record('exists', path, self._transport.exists,
+                            path, use_sudo, verbose)
+
+    def is_link(self, path, use_sudo=False, verbose=False):
+        return self._record('is_link', path, self._transport.is_link,
+                            path, use_sudo, verbose)
+
+    def save(self, path):
+        with open(path, 'w') as fp:
+            json.dump(self._records, fp, indent=2)
+
+
+class SimulatedResult(str):
+    """
+    Output of simulated command with attributes of fabric's result
+    """
+    return_code = 0
+    failed = False
+    succeeded = True
+    stderr = ''
+
+
+class SimulatedTransport(_ContextTracker, Transport):
+    """
+    Executes nothing. Each remote call (command, transfer or check of file)
+    is one round trip which takes `latency` seconds. Counters are shared
+    with forked workers, so concurrent deploy is accounted too.
+    """
+    def __init__(self, latency=0.05, latencies=None, responses=None,
+                 paths=(), links=(), sleep=False):
+        """
+        :param float latency: default latency of round trip (seconds)
+        :param list[tuple(str, float)] latencies: latency of commands which
+                                                  match regexp
+        :param list[tuple(str, str)] responses: output of commands (or
+                                                content of downloaded files)
+                                                which match regexp
+        :param list[str] paths: existing remote paths
+        :param list[str] links: existing remote symlinks
+        :param bool sleep: really wait for latency
+        """
+        super(SimulatedTransport, self).__init__()
+        self._latency = float(latency)
+        self._latencies = [
+            (re.compile(p), float(l)) for p, l in (latencies or ())
+        ]
+        self._responses = [(re.compile(p), r) for p, r in (responses or ())]
+        self._paths = set(paths) | set(links)
+        self._links = set(links)
+        self._sleep = sleep
+        self._round_trips = multiprocessing.Value('i', 0)
+        self._elapsed = multiprocessing.Value('d', 0.0)
+        self.commands = []
+
+    @property
+    def round_trips(self):
+        return self._round_trips.value
+
+    @property
+    def elapsed(self):
+        """
+        :return float: projected wall-clock of sequential round trips
+        """
+        return self._elapsed.value
+
+    def report(self):
+        return {
+            'round_trips': self.round_trips,
+            'projected_seconds': round(self.elapsed, 3),
+        }
+
+    def _round_trip(self, target):
+        latency = self._latency
+        for pattern, value in self._latencies:
+            if pattern.search(target):
+                latency = value
+                break
+
+        with self._round_trips.get_lock():
+            self._round_trips.value += 1
+        with self._elapsed.get_lock():
+            self._elapsed.value += latency
+
+        self.commands.append(target)
+        if self._sleep:
+            time.sleep(latency)
+
+    def _response(self, target):
+        for pattern, response in self._responses:
+            if pattern.search(target):
+                return response
+
+        return ''
+
+    def _command(self, command):
+        full_command = self._full_command(command)
+        self._round_trip(full_command)
+        return SimulatedResult(self._response(full_command))
+
+    def run(self, command, **kwargs):
+        return self._command(command)
+
+    def sudo(self, command, **kwargs):
+        return self._command(command)
+
+    def local(self, command, **kwargs):
+        # local commands are not round trips
+        return SimulatedResult('')
+
+    def put(self, local_path=None, remote_path=None, **kwargs):
+        self._round_trip('put %s' % remote_path)
+        return [remote_path]
+
+    def get(self, remote_path, local_path=None, **kwargs):
+        self._round_trip('get %s' % remote_path)
+        content = self._response('get %s' % remote_path)
+        if hasattr(local_path, 'write'):
+            local_path.write(content.encode('utf-8'))
+
+        return [local_path]
+
+    def exists(self, path, use_sudo=False, verbose=False):
+        self._round_trip('test -e %s' % path)
+        return path in self._paths
+
+    def is_link(self, path, use_sudo=False, verbose=False):
+        self._round_trip('test -L %s' % path)
+        return path in self._links
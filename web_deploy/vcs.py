@@ -14,7 +14,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from .base import LocatedDeployEntity
+from .base import LocatedDeployEntity, run_sync
 
 
 __author__ = 'y.gavenchuk'
@@ -22,12 +22,30 @@ __all__ = ('Git', )
 
 
 class Git(LocatedDeployEntity):
-    __slots__ = ('_name', '_url', )
+    """
+    By default `update` clones repository and pulls changes as separate
+    remote commands. If any of `mirror`, `depth` or `filter_spec` is set,
+    only requested ref is fetched and checked out by one remote command:
 
-    def __init__(self, path, name, url):
+        * mirror - path of bare mirror of repository shared by all clones on
+                   the host. It's updated before fetch (under `flock`) and
+                   objects of new clone are copied from it (`--reference`
+                   with `--dissociate`), so they are downloaded only once.
+                   Clones don't depend on the mirror: its prune can't
+                   corrupt them;
+        * depth - depth of history (shallow clone/fetch);
+        * filter_spec - partial clone filter, e.g. "blob:none".
+    """
+    __slots__ = ('_name', '_url', '_mirror', '_depth', '_filter', )
+
+    def __init__(self, path, name, url, mirror=None, depth=None,
+                 filter_spec=None):
         super(Git, self).__init__(path)
         self._name = name
         self._url = url
+        self._mirror = mirror
+        self._depth = int(depth) if depth else None
+        self._filter = filter_spec
 
     @property
     def _git_cmd(self):
@@ -37,33 +55,135 @@ class Git(LocatedDeployEntity):
     def repository_dir(self):
         return self._os.path.join(self._path, self._name)
 
+    @property
+    def name(self):
+        return self._name
+
     @property
     def url(self):
         return self._url
 
+    @property
+    def is_fast(self):
+        return bool(self._mirror or self._depth or self._filter)
+
     def clone(self):
-        if self._files.exists(self.repository_dir):
+        run_sync(self.clone_async(self._session()))
+
+    async def clone_async(self, session):
+        if await session.exists(self.repository_dir):
             return
 
-        self._api.run('{git} clone "{repository}" "{target_dir}"'.format(
+        await session.run(
+            '{git} clone "{repository}" "{target_dir}"'.format(
+                git=self._git_cmd,
+                repository=self.url,
+                target_dir=self.repository_dir
+            )
+        )
+
+    def _fetch_options(self):
+        if self._depth:
+            return ['--depth %d' % self._depth]
+
+        return []
+
+    def _fast_update_cmd(self, tag=None):
+        """
+        :param str tag: tag (or branch, or commit). If it's not specified
+                        current branch is updated (or the default one in
+                        case of detached HEAD)
+        :return str:
+        """
+        commands = []
+        clone_options = ['--no-checkout'] + self._fetch_options()
+        if self._filter:
+            # fetch of partial clone uses the same filter
+            clone_options.append('--filter=%s' % self._filter)
+
+        clone = '{git} clone {options} "{url}" "{repo}"'
+        if self._mirror:
+            # updates of mirror are serialized, clones copy its objects
+            # while it isn't updated
+            lock = '9>"%s.lock"' % self._mirror
+            commands += [
+                'mkdir -p "%s"' % self._os.path.dirname(self._mirror),
+                '( flock 9 && ( [ -d "{mirror}" ] || {git} clone --mirror '
+                '"{url}" "{mirror}" ) && {git} --git-dir="{mirror}" fetch '
+                '--prune --quiet ) {lock}'.format(
+                    git=self._git_cmd, url=self.url, mirror=self._mirror,
+                    lock=lock
+                ),
+            ]
+            clone_options += ['--reference "%s"' % self._mirror,
+                              '--dissociate']
+            clone = '( flock -s 9 && %s ) %s' % (clone, lock)
+
+        commands += [
+            '( [ -d "{repo}/.git" ] || {clone} )'.format(
+                repo=self.repository_dir,
+                clone=clone.format(
+                    git=self._git_cmd,
+                    options=' '.join(clone_options),
+                    url=self.url,
+                    repo=self.repository_dir
+                )
+            ),
+            'cd "%s"' % self.repository_dir,
+        ]
+        if self._mirror:
+            # clones made before `--dissociate` borrow objects of mirror
+            commands.append(
+                '( [ ! -f .git/objects/info/alternates ] || ( {git} repack '
+                '-a -d -q && rm -f .git/objects/info/alternates ) )'.format(
+                    git=self._git_cmd
+                )
+            )
+
+        fetch = '{git} fetch {options} {source} {ref}'.format(
             git=self._git_cmd,
-            repository=self.url,
-            target_dir=self.repository_dir
-        ))
+            options=' '.join(self._fetch_options() + ['--quiet']),
+            # mirror is just updated: the network isn't asked again
+            source='"%s"' % self._mirror if self._mirror else 'origin',
+            ref=tag or '$({git} symbolic-ref -q --short HEAD '
+                       '|| echo HEAD)'.format(git=self._git_cmd)
+        )
+        if self._mirror:
+            fetch = '( flock -s 9 && %s ) %s' % (fetch, lock)
+
+        commands += [
+            fetch,
+            '{git} checkout -f --quiet FETCH_HEAD'.format(git=self._git_cmd),
+            '{git} clean -fd'.format(git=self._git_cmd),
+        ]
+
+        return ' && '.join(commands)
 
     def update(self, tag=None):
-        self.clone()
+        run_sync(self.update_async(self._session(), tag))
+
+    async def update_async(self, session, tag=None):
+        """
+        The same as `update` but commands are sent by session
+
+        :param session: FabricSession or web_deploy.aio.Session
+        :param str tag:
+        """
+        if self.is_fast:
+            await session.run(self._fast_update_cmd(tag))
+            return
 
-        with self._api.cd(self.repository_dir):
+        await self.clone_async(session)
+        with session.cd(self.repository_dir):
             # If the working directory does not exist before initializing,
             # it has already been cloned and are not in need of updating
-            self._api.run('{git} clean -fd'.format(git=self._git_cmd))
+            await session.run('{git} clean -fd'.format(git=self._git_cmd))
 
             if tag:
-                self._api.run('{git} fetch'.format(git=self._git_cmd))
-                self._api.run('{git} checkout {tag}'.format(
+                await session.run('{git} fetch'.format(git=self._git_cmd))
+                await session.run('{git} checkout {tag}'.format(
                     tag=tag,
                     git=self._git_cmd
                 ))
 
-            self._api.run('{git} pull'.format(git=self._git_cmd))
+            await session.run('{git} pull'.format(git=self._git_cmd))